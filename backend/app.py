@@ -1,11 +1,31 @@
 import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
 from pathlib import Path
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from typing import List, Optional
+import anyio
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from backend.schemas import QueryRequest, QueryResponse
-from backend.rag import rag_system
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from python_multipart.multipart import MultipartParser, parse_options_header
+from python_multipart.exceptions import MultipartParseError
+from starlette.requests import ClientDisconnect
+from backend.schemas import (
+    QueryRequest, QueryResponse, BatchQueryRequest, BatchQueryResponse, JobStatus,
+    QueryFilters, SearchRequest, SearchResponse
+)
+from backend.rag import rag_system, DeadlineExceeded, QueryQueueFull, NOT_INITIALIZED
+from backend.scheduler import PRIORITIES
+from backend.jobs import ingestion_queue
+from backend.config import PDF_DIR, load_manifest
+from backend.filters import to_timestamp
+from backend.metrics import Gauge, RequestMetricsMiddleware, registry
 
 # Load environment variables
 load_dotenv()
@@ -13,12 +33,42 @@ load_dotenv()
 # Configuration from environment
 API_HOST = os.getenv("API_HOST", "0.0.0.0")
 API_PORT = int(os.getenv("API_PORT", "8000"))
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "1000"))
+# Deepest hit a /search page may reach (offset + limit)
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "100"))
+# Deadline for requests that do not set timeout_ms (0 = none)
+QUERY_TIMEOUT_MS = int(os.getenv("QUERY_TIMEOUT_MS", "0"))
+# Uploads are streamed to disk in blocks of this size and rejected past the limit
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1 << 20)))
+MAX_UPLOAD_MB = float(os.getenv("MAX_UPLOAD_MB", "512"))
+# Room for the multipart boundaries and headers around an uploaded file
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+# Load models in the background as soon as the server starts (otherwise on first query)
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+
+
+async def background_warm_up():
+    try:
+        await rag_system.warm_up()
+    except Exception as e:
+        print(f"✗ Warm-up failed, retrying on first query: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Bind the port immediately and warm up models in the background"""
+    warmup = asyncio.create_task(background_warm_up()) if WARMUP_ON_STARTUP else None
+    yield
+    if warmup is not None and not warmup.done():
+        warmup.cancel()
+
 
 # Initialize FastAPI app
 app = FastAPI(
     title="DocuMind Enterprise API",
     description="Document-grounded question answering system",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware for potential frontend integration
@@ -30,6 +80,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request ids, latency histograms and (with LOG_REQUESTS) one JSON log line per request
+app.add_middleware(RequestMetricsMiddleware)
+
+registry.register(Gauge(
+    "documind_generations_running", "Ollama generations holding a slot",
+    lambda: rag_system.slot_usage()[0]
+))
+registry.register(Gauge(
+    "documind_generations_waiting", "Generations waiting for a slot",
+    lambda: rag_system.slot_usage()[1]
+))
+
 # Frontend path
 frontend_path = Path(__file__).parent.parent / "frontend"
 
@@ -40,66 +102,509 @@ async def health_check():
     return {"status": "OK"}
 
 
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness check: 200 once Chroma and the models are loaded, 503 while
+    warm-up is still running. Includes the per-step startup timings and
+    the state of each Ollama host.
+    """
+    timings = {step: round(seconds, 3) for step, seconds in rag_system.startup_timings.items()}
+    if not rag_system.ready:
+        return JSONResponse(status_code=503, content={"status": "loading", "startup": timings})
+    return {
+        "status": "ready",
+        "collection_loaded": rag_system.collection is not None,
+        "startup": timings,
+        "llm_hosts": rag_system.llm.status()
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: request and stage latencies, tokens/sec, cache hits"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+async def until_disconnected(http_request: Request, awaitable):
+    """
+    Await awaitable, cancelling it if the client disconnects first.
+    
+    Cancellation reaches the generation scheduler, which aborts the
+    Ollama request unless another caller is sharing it. Raises
+    ClientDisconnected in that case.
+    """
+    task = asyncio.ensure_future(awaitable)
+    
+    async def wait_for_disconnect():
+        # The body has been read, so the next message is the disconnect
+        while (await http_request.receive())["type"] != "http.disconnect":
+            pass
+    
+    watcher = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        done, _ = await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
+            # Let the cancellation reach the scheduler before responding
+            await asyncio.gather(task, return_exceptions=True)
+    if task not in done:
+        raise ClientDisconnected()
+    return task.result()
+
+
+def check_scheduling(priority: str, timeout_ms):
+    """Validate priority and timeout; returns the time.monotonic() deadline or None"""
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Priority must be one of: {', '.join(PRIORITIES)}")
+    if timeout_ms is None:
+        timeout_ms = QUERY_TIMEOUT_MS or None
+    elif timeout_ms < 1:
+        raise HTTPException(status_code=400, detail="timeout_ms must be at least 1")
+    return time.monotonic() + timeout_ms / 1000 if timeout_ms else None
+
+
 @app.post("/query", response_model=QueryResponse)
-async def query_documents(request: QueryRequest):
+async def query_documents(request: QueryRequest, http_request: Request):
     """
     Query the document database with a question.
     
     Returns a grounded answer based on the document context,
     or explicitly states when information is not available.
+    Identical concurrent questions share one generation, which is
+    aborted if every client asking for it disconnects.
     """
     try:
         # Validate input
         if not request.question or not request.question.strip():
             raise HTTPException(status_code=400, detail="Question cannot be empty")
         
-        # Run RAG pipeline
-        answer = rag_system.query(request.question)
+        filters = check_filters(request.filters)
+        deadline = check_scheduling(request.priority, request.timeout_ms)
         
-        return QueryResponse(answer=answer)
+        # Run RAG pipeline off the event loop
+        result = await until_disconnected(http_request, rag_system.aquery(
+            request.question, filters, request.priority, deadline, request.extractive
+        ))
+        
+        return QueryResponse(**result)
     
+    except HTTPException:
+        raise
+    except ClientDisconnected:
+        # Nobody is listening; 499 only shows up in metrics and logs
+        return Response(status_code=499)
+    except QueryQueueFull as e:
+        raise HTTPException(status_code=429, detail=f"Server busy, try again later: {str(e)}")
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         # Handle errors gracefully
         raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
 
 
-@app.post("/upload")
-async def upload_document(file: UploadFile = File(...)):
+@app.post("/query/batch", response_model=BatchQueryResponse)
+async def query_documents_batch(request: BatchQueryRequest, http_request: Request):
     """
-    Upload a PDF document to the knowledge base.
-    File is saved to data/pdfs/ directory for ingestion.
+    Answer a list of questions in one request.
+    
+    Retrieval for all questions is batched into one encode and one
+    vector search; generation runs with the requested parallelism at
+    batch priority by default. Returns per-question answers, sources
+    and timings.
     """
     try:
-        # Validate file type
-        if not file.filename.lower().endswith('.pdf'):
-            raise HTTPException(status_code=400, detail="Only PDF files are supported")
+        if not request.questions:
+            raise HTTPException(status_code=400, detail="Questions cannot be empty")
+        if len(request.questions) > BATCH_MAX_QUESTIONS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch"
+            )
+        if any(not question or not question.strip() for question in request.questions):
+            raise HTTPException(status_code=400, detail="Question cannot be empty")
+        if request.parallelism is not None and request.parallelism < 1:
+            raise HTTPException(status_code=400, detail="Parallelism must be at least 1")
+        
+        filters = check_filters(request.filters)
+        deadline = check_scheduling(request.priority, request.timeout_ms)
         
+        result = await until_disconnected(http_request, rag_system.aquery_batch(
+            request.questions, request.parallelism, filters, request.priority, deadline
+        ))
+        
+        return BatchQueryResponse(**result)
+    
+    except HTTPException:
+        raise
+    except ClientDisconnected:
+        return Response(status_code=499)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing batch: {str(e)}")
+
+
+def check_filters(filters):
+    """Validate query filters and return them as a dict (None if absent)"""
+    if filters is None:
+        return None
+    if filters.sources is not None and not filters.sources:
+        raise HTTPException(status_code=400, detail="Filter sources cannot be empty")
+    if filters.page_from is not None and filters.page_to is not None and filters.page_from > filters.page_to:
+        raise HTTPException(status_code=400, detail="page_from cannot be greater than page_to")
+    if (filters.ingested_after is not None and filters.ingested_before is not None
+            and to_timestamp(filters.ingested_after) > to_timestamp(filters.ingested_before)):
+        raise HTTPException(status_code=400, detail="ingested_after cannot be later than ingested_before")
+    return filters.model_dump()
+
+
+def sse_event(event: str, data) -> str:
+    """Encode one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/query/stream")
+async def query_documents_stream(request: QueryRequest, http_request: Request):
+    """
+    Query the documents and stream the answer as Server-Sent Events.
+    
+    Emits a `sources` event once retrieval finishes, then `token` events
+    as Ollama generates, then a final `done` event with the full answer.
+    Errors after the sources are sent, such as the deadline passing while
+    waiting for a generation slot, end the stream with an `error` event
+    carrying the status code the non-streaming endpoint would return.
+    The generation stops when the client closes the stream.
+    """
+    if not request.question or not request.question.strip():
+        raise HTTPException(status_code=400, detail="Question cannot be empty")
+    
+    filters = check_filters(request.filters)
+    deadline = check_scheduling(request.priority, request.timeout_ms)
+    events = rag_system.astream_query(request.question, filters, request.priority, deadline, request.extractive)
+    
+    # Run retrieval (and turn away a full queue) before committing to a 200 response
+    try:
+        first = await until_disconnected(http_request, events.__anext__())
+    except ClientDisconnected:
+        await events.aclose()
+        return Response(status_code=499)
+    except QueryQueueFull as e:
+        raise HTTPException(status_code=429, detail=f"Server busy, try again later: {str(e)}")
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
+    
+    async def stream():
+        try:
+            yield sse_event(*first)
+            async for event, data in events:
+                yield sse_event(event, data)
+        except QueryQueueFull as e:
+            yield sse_event("error", {"status": 429, "detail": f"Server busy, try again later: {str(e)}"})
+        except DeadlineExceeded as e:
+            yield sse_event("error", {"status": 504, "detail": str(e)})
+        except Exception as e:
+            yield sse_event("error", {"status": 500, "detail": f"Error processing query: {str(e)}"})
+        finally:
+            await events.aclose()
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def run_search(request: SearchRequest):
+    """Validate a search request and run it"""
+    try:
+        if not request.query or not request.query.strip():
+            raise HTTPException(status_code=400, detail="Query cannot be empty")
+        if request.limit < 1:
+            raise HTTPException(status_code=400, detail="Limit must be at least 1")
+        if request.offset < 0:
+            raise HTTPException(status_code=400, detail="Offset cannot be negative")
+        if request.offset + request.limit > SEARCH_MAX_RESULTS:
+            raise HTTPException(status_code=400, detail=f"offset + limit cannot exceed {SEARCH_MAX_RESULTS}")
+        
+        filters = check_filters(request.filters)
+        
+        result = await rag_system.asearch(request.query, request.limit, request.offset, filters)
+        if result is None:
+            raise HTTPException(status_code=503, detail=NOT_INITIALIZED)
+        
+        return SearchResponse(query=request.query, offset=request.offset, limit=request.limit, **result)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching documents: {str(e)}")
+
+
+@app.get("/search", response_model=SearchResponse)
+async def search_documents(
+    q: str,
+    limit: int = 10,
+    offset: int = 0,
+    source: Optional[List[str]] = Query(None),
+    page_from: Optional[int] = None,
+    page_to: Optional[int] = None
+):
+    """
+    Find the chunks most relevant to q without generating an answer.
+    
+    Returns chunk text, source, page and similarity score for one page
+    of results; pass next_offset as offset to get the next page. Repeat
+    source to search several documents.
+    """
+    filters = None
+    if source is not None or page_from is not None or page_to is not None:
+        filters = QueryFilters(sources=source, page_from=page_from, page_to=page_to)
+    return await run_search(SearchRequest(query=q, limit=limit, offset=offset, filters=filters))
+
+
+@app.post("/search", response_model=SearchResponse)
+async def search_documents_post(request: SearchRequest):
+    """Same as GET /search, with the full filter set in a JSON body"""
+    return await run_search(request)
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class InvalidUpload(Exception):
+    pass
+
+
+def write_block(f, digest, block):
+    f.write(block)
+    digest.update(block)
+
+
+def discard_part(f, tmp_path):
+    """Close and remove a partly received upload"""
+    if f is not None:
+        f.close()
+    tmp_path.unlink(missing_ok=True)
+
+
+class FilePart:
+    """
+    Collects the first `file` field of a multipart body as python-multipart
+    parses it: its filename once the part headers are in, then its data.
+    """
+    
+    def __init__(self):
+        self.headers = {}
+        self.field = b""
+        self.value = b""
+        self.active = False
+        self.filename = None
+        self.complete = False
+        self.size = 0
+        self.pending = []
+        self.pending_bytes = 0
+    
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end
+        }
+    
+    def on_part_begin(self):
+        self.headers = {}
+    
+    def on_header_field(self, data, start, end):
+        self.field += data[start:end]
+    
+    def on_header_value(self, data, start, end):
+        self.value += data[start:end]
+    
+    def on_header_end(self):
+        self.headers[self.field.lower()] = self.value
+        self.field, self.value = b"", b""
+    
+    def on_headers_finished(self):
+        _, options = parse_options_header(self.headers.get(b"content-disposition", b""))
+        if options.get(b"name") == b"file" and self.filename is None:
+            self.filename = options.get(b"filename", b"").decode("utf-8", "replace")
+            self.active = True
+    
+    def on_part_data(self, data, start, end):
+        if self.active:
+            self.size += end - start
+            self.pending_bytes += end - start
+            self.pending.append(data[start:end])
+    
+    def on_part_end(self):
+        if self.active:
+            self.active = False
+            self.complete = True
+    
+    def take(self):
+        """Data received since the last call"""
+        block, self.pending, self.pending_bytes = b"".join(self.pending), [], 0
+        return block
+
+
+async def receive_upload(request: Request, directory: Path, max_bytes: int):
+    """
+    Stream the `file` field of a multipart upload from the request body
+    into a temporary file in directory, hashing as it goes.
+    
+    The body is parsed as it arrives rather than spooled first, so the
+    PDF is written to disk once and an oversized upload is rejected
+    (UploadTooLarge) from its Content-Length, or as soon as more than
+    max_bytes of it have arrived. Data is written in UPLOAD_CHUNK_BYTES
+    blocks. All file operations run in the threadpool so a slow disk
+    never stalls the event loop. The caller renames the temporary file
+    into place, so a half-written PDF is never picked up by ingestion. Returns
+    (filename, size, sha256, tmp_path); raises InvalidUpload for a body
+    that is not a form with a PDF `file` field.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not options.get(b"boundary"):
+        raise InvalidUpload("Expected a multipart/form-data body with a `file` field")
+    max_body = max_bytes + MULTIPART_OVERHEAD_BYTES
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > max_body:
+        raise UploadTooLarge()
+    
+    part = FilePart()
+    parser = MultipartParser(options[b"boundary"], part.callbacks(), max_size=max_body)
+    digest = hashlib.sha256()
+    filename = tmp_path = f = None
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_body:
+                raise UploadTooLarge()
+            parser.write(chunk)
+            if part.size > max_bytes:
+                raise UploadTooLarge()
+            if part.filename is not None and f is None:
+                filename = Path(part.filename).name
+                if not filename.lower().endswith('.pdf'):
+                    raise InvalidUpload("Only PDF files are supported")
+                tmp_path = directory / f".{filename}.{uuid.uuid4().hex}.part"
+                f = await run_in_threadpool(open, tmp_path, "wb")
+            if f is not None and (part.pending_bytes >= UPLOAD_CHUNK_BYTES or part.complete and part.pending):
+                await run_in_threadpool(write_block, f, digest, part.take())
+        parser.finalize()
+        if f is None:
+            raise InvalidUpload("No file uploaded in the `file` field")
+        if not part.complete:
+            raise InvalidUpload("Upload ended before the file was complete")
+        await run_in_threadpool(write_block, f, digest, part.take())
+        await run_in_threadpool(f.close)
+        return filename, part.size, digest.hexdigest(), tmp_path
+    except BaseException:
+        if tmp_path is not None:
+            # Shielded so the file is removed even when the request is cancelled
+            with anyio.CancelScope(shield=True):
+                await run_in_threadpool(discard_part, f, tmp_path)
+        raise
+
+
+def find_ingested(sha256: str):
+    """Source name of an ingested file with this content hash, if any"""
+    manifest = load_manifest()
+    if manifest is None:
+        return None
+    for source, entry in manifest["files"].items():
+        if entry.get("sha256") == sha256 and os.path.exists(entry["path"]):
+            return source
+    return None
+
+
+@app.post("/upload", openapi_extra={"requestBody": {"required": True, "content": {"multipart/form-data": {
+    "schema": {"type": "object", "required": ["file"], "properties": {"file": {"type": "string", "format": "binary"}}}
+}}}})
+async def upload_document(request: Request):
+    """
+    Upload a PDF document (multipart form field `file`) to the knowledge base.
+    File is saved to data/pdfs/ and queued for background ingestion;
+    poll /jobs/{job_id} to see when it becomes queryable.
+    
+    The file is streamed from the request straight to disk in fixed-size
+    blocks, so memory use does not grow with its size and an upload over
+    MAX_UPLOAD_MB is rejected while it is still arriving. A file whose
+    content is already ingested is not stored or ingested again.
+    """
+    try:
         # Create data/pdfs directory if it doesn't exist
-        pdf_dir = Path(__file__).parent.parent / "data" / "pdfs"
-        pdf_dir.mkdir(parents=True, exist_ok=True)
+        pdf_dir = Path(PDF_DIR)
+        await run_in_threadpool(pdf_dir.mkdir, parents=True, exist_ok=True)
         
         # Save the uploaded file
-        file_path = pdf_dir / file.filename
-        content = await file.read()
+        try:
+            filename, size, sha256, tmp_path = await receive_upload(
+                request, pdf_dir, int(MAX_UPLOAD_MB * (1 << 20))
+            )
+        except UploadTooLarge:
+            raise HTTPException(status_code=413, detail=f"File exceeds the {MAX_UPLOAD_MB:g} MB upload limit")
+        except (InvalidUpload, MultipartParseError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
-        with open(file_path, "wb") as f:
-            f.write(content)
+        file_path = pdf_dir / filename
+        duplicate_of = await run_in_threadpool(find_ingested, sha256)
+        if duplicate_of is not None:
+            await run_in_threadpool(tmp_path.unlink, missing_ok=True)
+            return {
+                "status": "duplicate",
+                "message": f"File '{filename}' has the same content as '{duplicate_of}', which is already ingested",
+                "filename": filename,
+                "size": size,
+                "sha256": sha256,
+                "duplicate_of": duplicate_of,
+                "job_id": None
+            }
+        
+        await run_in_threadpool(os.replace, tmp_path, file_path)
+        job = ingestion_queue.submit(filename)
         
         return {
             "status": "success",
-            "message": f"File '{file.filename}' uploaded successfully",
-            "filename": file.filename,
-            "size": len(content),
+            "message": f"File '{filename}' uploaded successfully",
+            "filename": filename,
+            "size": size,
+            "sha256": sha256,
             "path": str(file_path),
-            "note": "Run ingestion to add document to knowledge base"
+            "job_id": job["id"],
+            "job_url": f"/jobs/{job['id']}",
+            "note": "Document queued for ingestion"
         }
     
     except HTTPException:
         raise
+    except ClientDisconnect:
+        return Response(status_code=499)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")
 
 
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str):
+    """Status, progress and timings of a background ingestion job"""
+    job = ingestion_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return JobStatus(**job)
+
+
 @app.get("/")
 async def root():
     """Root endpoint - serve frontend"""
@@ -0,0 +1,76 @@
+import os
+import asyncio
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Configuration from environment variables with defaults
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "32"))
+QUERY_BATCH_MAX_WAIT_MS = float(os.getenv("QUERY_BATCH_MAX_WAIT_MS", "5"))
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-item calls into batched calls.
+
+    Items submitted within max_wait_ms of the first pending item (or until
+    max_batch_size items are pending) are passed together to
+    batch_fn(items) on the executor, and each caller receives the result at
+    its position in the returned list. Must be used from one event loop.
+    """
+
+    def __init__(self, batch_fn, executor, max_batch_size=QUERY_BATCH_MAX_SIZE,
+                 max_wait_ms=QUERY_BATCH_MAX_WAIT_MS):
+        self.batch_fn = batch_fn
+        self.executor = executor
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._pending = []
+        self._timer = None
+        self.stats = {"batches": 0, "items": 0, "largest_batch": 0}
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+
+        if len(self._pending) >= self.max_batch_size or self.max_wait <= 0:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._pending:
+            batch = self._pending[:self.max_batch_size]
+            self._pending = self._pending[self.max_batch_size:]
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        # Callers that gave up (e.g. client disconnected) are dropped
+        batch = [(item, future) for item, future in batch if not future.done()]
+        if not batch:
+            return
+
+        self.stats["batches"] += 1
+        self.stats["items"] += len(batch)
+        self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.executor, self.batch_fn, [item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
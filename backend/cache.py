@@ -0,0 +1,136 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+import numpy as np
+
+# Load environment variables
+load_dotenv()
+
+# Configuration from environment variables with defaults
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "3600"))
+CACHE_SIMILARITY_THRESHOLD = float(os.getenv("CACHE_SIMILARITY_THRESHOLD", "0.95"))
+
+
+class SemanticCache:
+    """
+    Answer cache keyed on questions.
+
+    Lookups first try an exact match on the normalized question text, then
+    a cosine-similarity search over the embeddings of cached questions.
+    Entries expire after ttl seconds and the least recently used entry is
+    evicted once max_entries is reached. Entries are partitioned by scope
+    (e.g. the query's metadata filters), and lookups only match entries
+    of the same scope. The whole cache is dropped when
+    the file at version_path (the ingestion manifest) changes, i.e. after
+    any re-ingestion.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS,
+                 threshold=CACHE_SIMILARITY_THRESHOLD, version_path=None, enabled=CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.version_path = version_path
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = self._current_version()
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "invalidations": 0}
+
+    @staticmethod
+    def normalize(question: str) -> str:
+        """Lowercase, collapse whitespace and drop trailing punctuation"""
+        return " ".join(question.lower().split()).rstrip("?!. ")
+
+    def _current_version(self):
+        if not self.version_path:
+            return None
+        try:
+            return os.stat(self.version_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _check_version(self):
+        """Drop everything if the collection was re-ingested since the last call"""
+        version = self._current_version()
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+            self.stats["invalidations"] += 1
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for key in [key for key, entry in self._entries.items() if entry["created_at"] < cutoff]:
+            del self._entries[key]
+
+    def get(self, question: str, scope: str = ""):
+        """Exact-match lookup; returns the cached entry or None"""
+        if not self.enabled:
+            return None
+        key = (scope, self.normalize(question))
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(key)
+            if entry is None or entry["created_at"] < time.time() - self.ttl:
+                return None
+            self._entries.move_to_end(key)
+            self.stats["exact_hits"] += 1
+            return entry
+
+    def get_similar(self, embedding, scope: str = ""):
+        """
+        Nearest cached question by cosine similarity.
+
+        Returns (entry, similarity) when the best match reaches the
+        threshold, otherwise None (and counts a miss).
+        """
+        if not self.enabled:
+            return None
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        with self._lock:
+            self._check_version()
+            self._expire()
+            keys = [key for key in self._entries if key[0] == scope]
+            if keys:
+                matrix = np.stack([self._entries[key]["embedding"] for key in keys])
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self._entries.move_to_end(keys[best])
+                    self.stats["semantic_hits"] += 1
+                    return self._entries[keys[best]], float(scores[best])
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, question: str, embedding, answer: str, sources=None, scope: str = ""):
+        """Store an answer, evicting the least recently used entry if full"""
+        if not self.enabled:
+            return
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        key = (scope, self.normalize(question))
+        with self._lock:
+            self._check_version()
+            self._entries[key] = {
+                "answer": answer,
+                "sources": sources or [],
+                "embedding": vector,
+                "created_at": time.time()
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.stats["invalidations"] += 1
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,36 @@
+import os
+import json
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Paths shared by the API server and the ingestion pipeline. They live here
+# rather than in ingestion.ingest so the server can start without importing
+# PyMuPDF, LangChain or Chroma.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.join(BASE_DIR, "..")
+
+PDF_DIR = os.path.join(PROJECT_ROOT, "data", "pdfs")
+CHROMA_DB_PATH = os.path.join(PROJECT_ROOT, os.getenv("CHROMA_DB_PATH", "chroma_db"))
+COLLECTION_NAME = "documind"
+# Tracks which files (and which chunk ids) are currently in the collection
+MANIFEST_PATH = os.path.join(CHROMA_DB_PATH, "ingest_manifest.json")
+
+# Text boundaries shared by the chunker and the extractive sentence splitter,
+# so extracted sentences are the units chunks were cut along.
+# Sentence ends: terminal punctuation followed by whitespace and a capital
+# (so "No. 12" stays whole)
+SENTENCE_END = r"(?<=[.!?])\s+(?=[A-Z\"'(])"
+# Paragraphs: a blank line
+PARAGRAPH_BREAK = r"\n\s*\n"
+# Separators tried in order by the chunker (regexes)
+CHUNK_SEPARATORS = [PARAGRAPH_BREAK, SENTENCE_END, r"\n", " ", ""]
+
+
+def load_manifest():
+    """Load the ingestion manifest, or None if the collection is untracked"""
+    if not os.path.exists(MANIFEST_PATH):
+        return None
+    with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
@@ -0,0 +1,128 @@
+import os
+import re
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Configuration from environment variables with defaults
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Rough characters-per-token ratio used to estimate prompt length
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "4"))
+# Chunks with at least this fraction of their words already in a better chunk are dropped
+DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.9"))
+
+# Shortest shared text treated as splitter overlap rather than coincidence
+MIN_OVERLAP = 20
+# Longest suffix/prefix overlap searched for (the splitter uses 120 characters)
+MAX_OVERLAP = 300
+# Don't bother appending a truncated chunk with less room than this
+MIN_TRUNCATED_TOKENS = 40
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def _overlap(first: str, second: str) -> int:
+    """Length of the longest suffix of first that is a prefix of second"""
+    for size in range(min(len(first), len(second), MAX_OVERLAP), MIN_OVERLAP - 1, -1):
+        if first.endswith(second[:size]):
+            return size
+    return 0
+
+
+def _merge(first: str, second: str):
+    """Merged text if the two chunks overlap or one contains the other, else None"""
+    if second in first:
+        return first
+    if first in second:
+        return second
+    size = _overlap(first, second)
+    if size:
+        return first + second[size:]
+    size = _overlap(second, first)
+    if size:
+        return second + first[size:]
+    return None
+
+
+def _coverage(words: set, other: set) -> float:
+    """Fraction of words that also appear in other"""
+    if not words:
+        return 1.0
+    return len(words & other) / len(words)
+
+
+def build_context(results, token_budget: int = CONTEXT_TOKEN_BUDGET):
+    """
+    Assemble the prompt context from single-query retrieval results.
+
+    Overlapping chunks from the same source page are stitched back into
+    one passage, near-duplicate passages are dropped, and passages are
+    added in relevance order until token_budget is reached (the last one
+    truncated at a word boundary if worthwhile). Passages from the same
+    page share one header. Returns (context, stats).
+    """
+    documents = results["documents"][0] if results["documents"] else []
+    metadatas = results["metadatas"][0] if results["metadatas"] else [{}] * len(documents)
+
+    # Merge overlapping chunks of the same page, keeping the best rank
+    passages = []
+    for rank, (text, meta) in enumerate(zip(documents, metadatas)):
+        key = (meta.get("source", "unknown"), meta.get("page", "unknown"))
+        text = text.strip()
+        for passage in passages:
+            if passage["key"] == key:
+                merged = _merge(passage["text"], text)
+                if merged is not None:
+                    passage["text"] = merged
+                    break
+        else:
+            passages.append({"key": key, "rank": rank, "text": text})
+
+    # Drop near-duplicates of better-ranked passages (e.g. the same text on two pages)
+    kept = []
+    for passage in sorted(passages, key=lambda p: p["rank"]):
+        words = set(WORD_PATTERN.findall(passage["text"].lower()))
+        if any(_coverage(words, other["words"]) >= DUPLICATE_THRESHOLD for other in kept):
+            continue
+        passage["words"] = words
+        kept.append(passage)
+
+    # Fill the token budget in relevance order
+    selected = []
+    used = 0
+    for passage in kept:
+        cost = estimate_tokens(passage["text"]) + 8
+        if used + cost <= token_budget:
+            selected.append(passage)
+            used += cost
+            continue
+        remaining = token_budget - used - 8
+        if remaining >= MIN_TRUNCATED_TOKENS:
+            cut = passage["text"][:int(remaining * CHARS_PER_TOKEN)]
+            cut = cut[:cut.rfind(" ")] if " " in cut else cut
+            selected.append(dict(passage, text=cut + " …"))
+            used += estimate_tokens(cut) + 8
+        break
+
+    # One header per page, pages ordered by their best passage
+    groups = {}
+    for passage in selected:
+        groups.setdefault(passage["key"], []).append(passage["text"])
+
+    context_parts = []
+    for (source, page), texts in groups.items():
+        context_parts.append(f"[{source}, Page {page}]\n" + "\n…\n".join(texts))
+
+    stats = {
+        "chunks": len(documents),
+        "passages": len(passages),
+        "deduplicated": len(passages) - len(kept),
+        "selected": len(selected),
+        "tokens": used
+    }
+    return "\n\n".join(context_parts), stats
@@ -0,0 +1,335 @@
+import os
+import sys
+import json
+import time
+import socket
+import struct
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+import numpy as np
+
+# Load environment variables
+load_dotenv()
+
+# Configuration from environment variables with defaults
+# Unix socket of a shared embedding service; when set, processes encode
+# through it instead of loading their own copy of the model
+EMBEDDING_SERVICE_SOCKET = os.getenv("EMBEDDING_SERVICE_SOCKET", "")
+# Texts per encoder forward pass, and how long to wait to fill one
+EMBEDDING_SERVICE_MAX_BATCH = int(os.getenv("EMBEDDING_SERVICE_MAX_BATCH", "64"))
+EMBEDDING_SERVICE_MAX_WAIT_MS = float(os.getenv("EMBEDDING_SERVICE_MAX_WAIT_MS", "5"))
+# Texts accepted but not yet encoded; past this, requests are refused as busy
+EMBEDDING_SERVICE_MAX_PENDING = int(os.getenv("EMBEDDING_SERVICE_MAX_PENDING", "4096"))
+# How long a client keeps retrying a busy service before giving up
+EMBEDDING_SERVICE_TIMEOUT = float(os.getenv("EMBEDDING_SERVICE_TIMEOUT", "60"))
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+DEFAULT_SOCKET = "/tmp/documind-embeddings.sock"
+
+# Frame: 4-byte big-endian header length, JSON header, then header["nbytes"]
+# bytes of float32 vectors (responses to encode requests only)
+LENGTH = struct.Struct(">I")
+
+
+class EmbeddingServiceBusy(Exception):
+    """Raised when the service stays over EMBEDDING_SERVICE_MAX_PENDING for the whole timeout"""
+
+
+class EmbeddingServiceError(Exception):
+    pass
+
+
+def _encode_header(header):
+    data = json.dumps(header).encode("utf-8")
+    return LENGTH.pack(len(data)) + data
+
+
+async def _read_frame(reader):
+    try:
+        size = LENGTH.unpack(await reader.readexactly(LENGTH.size))[0]
+    except asyncio.IncompleteReadError:
+        return None
+    return json.loads(await reader.readexactly(size))
+
+
+def _recv_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if not n:
+            raise ConnectionError("Embedding service closed the connection")
+        received += n
+    return bytes(buffer)
+
+
+class EmbeddingService:
+    """
+    Owns one embedding model and encodes for every API worker and
+    ingestion run on the machine.
+
+    Texts from concurrent requests are coalesced into batches of up to
+    max_batch by a MicroBatcher and encoded on a single thread, so the
+    model is loaded once and its forward passes do not compete with each
+    other for cores. Requests that would take the backlog past
+    max_pending texts are refused as busy (clients back off and retry), so
+    a burst cannot grow the queue without bound. Per-caller counters are
+    served by the "stats" operation.
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL, max_batch=EMBEDDING_SERVICE_MAX_BATCH,
+                 max_wait_ms=EMBEDDING_SERVICE_MAX_WAIT_MS, max_pending=EMBEDDING_SERVICE_MAX_PENDING):
+        from backend.batching import MicroBatcher
+        from backend.models import get_embedding_model
+
+        self.model_name = model_name
+        self.model = get_embedding_model(model_name, local=True)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="encoder")
+        self.batcher = MicroBatcher(self.encode_batch, self.executor, max_batch, max_wait_ms)
+        self.pending = 0
+        self.started_at = time.time()
+        self.encode_seconds = 0.0
+        self.callers = {}
+
+    def encode_batch(self, texts):
+        start = time.perf_counter()
+        vectors = np.asarray(
+            self.model.encode(texts, batch_size=self.max_batch, convert_to_numpy=True, show_progress_bar=False),
+            dtype=np.float32
+        )
+        self.encode_seconds += time.perf_counter() - start
+        return list(vectors)
+
+    def _caller_stats(self, caller):
+        stats = self.callers.get(caller)
+        if stats is None:
+            stats = self.callers[caller] = {
+                "requests": 0, "texts": 0, "busy": 0, "errors": 0, "seconds": 0.0, "last_seen": None
+            }
+        stats["last_seen"] = time.time()
+        return stats
+
+    async def encode(self, request):
+        """Returns (header, payload) for an encode request"""
+        texts = request.get("texts") or []
+        stats = self._caller_stats(request.get("caller") or "unknown")
+
+        if request.get("model") not in (None, self.model_name):
+            stats["errors"] += 1
+            return {"error": f"Service runs {self.model_name}, not {request.get('model')}"}, b""
+        # A request larger than max_pending is still admitted when nothing is queued
+        if self.pending and self.pending + len(texts) > self.max_pending:
+            stats["busy"] += 1
+            return {"error": "busy", "pending": self.pending}, b""
+
+        start = time.perf_counter()
+        self.pending += len(texts)
+        try:
+            vectors = await asyncio.gather(*(self.batcher.submit(text) for text in texts))
+        except Exception as e:
+            stats["errors"] += 1
+            return {"error": str(e)}, b""
+        finally:
+            self.pending -= len(texts)
+
+        array = np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dim)
+        stats["requests"] += 1
+        stats["texts"] += len(texts)
+        stats["seconds"] += time.perf_counter() - start
+        payload = array.tobytes()
+        return {"shape": list(array.shape), "nbytes": len(payload)}, payload
+
+    def stats(self):
+        return {
+            "model": self.model_name,
+            "dim": self.dim,
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "encode_seconds": round(self.encode_seconds, 3),
+            "batches": dict(self.batcher.stats),
+            "callers": {
+                caller: dict(stats, seconds=round(stats["seconds"], 3))
+                for caller, stats in sorted(self.callers.items())
+            }
+        }
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request = await _read_frame(reader)
+                if request is None:
+                    break
+                op = request.get("op", "encode")
+                payload = b""
+                if op == "encode":
+                    header, payload = await self.encode(request)
+                elif op == "ping":
+                    header = {"model": self.model_name, "dim": self.dim}
+                elif op == "stats":
+                    header = self.stats()
+                else:
+                    header = {"error": f"Unknown op: {op}"}
+                writer.write(_encode_header(header) + payload)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path):
+        if os.path.exists(socket_path):
+            # Refuse to steal the socket of a running service; remove a stale one
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+                raise RuntimeError(f"An embedding service is already listening on {socket_path}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(socket_path)
+            finally:
+                probe.close()
+
+        server = await asyncio.start_unix_server(self.handle, path=socket_path)
+        os.chmod(socket_path, 0o660)
+        print(f"✓ Embedding service for {self.model_name} listening on {socket_path}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+
+class RemoteEmbeddingModel:
+    """
+    SentenceTransformer stand-in that encodes through the embedding service.
+
+    Safe to share between threads: each thread keeps its own connection.
+    Busy responses are retried with exponential backoff until timeout.
+    """
+
+    def __init__(self, socket_path, model_name, caller=None, timeout=EMBEDDING_SERVICE_TIMEOUT):
+        self.socket_path = socket_path
+        self.model_name = model_name
+        self.caller = caller or f"{os.path.basename(sys.argv[0]) or 'python'}:{os.getpid()}"
+        self.timeout = timeout
+        self.dim = None
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "texts": 0, "busy_retries": 0, "seconds": 0.0}
+
+    def _connection(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _drop_connection(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def _call(self, request):
+        data = _encode_header(request)
+        # One reconnect covers a service restart between calls
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                sock.sendall(data)
+                size = LENGTH.unpack(_recv_exactly(sock, LENGTH.size))[0]
+                header = json.loads(_recv_exactly(sock, size))
+                payload = _recv_exactly(sock, header["nbytes"]) if header.get("nbytes") else b""
+                return header, payload
+            except socket.timeout:
+                # The reply may still arrive later and desync the stream
+                self._drop_connection()
+                raise
+            except (ConnectionError, FileNotFoundError):
+                self._drop_connection()
+                if attempt:
+                    raise
+
+    def ping(self):
+        """Check the service is reachable and serves this model"""
+        header, _ = self._call({"op": "ping"})
+        if header["model"] != self.model_name:
+            raise EmbeddingServiceError(f"Service runs {header['model']}, not {self.model_name}")
+        self.dim = header["dim"]
+        return header
+
+    def service_stats(self):
+        return self._call({"op": "stats"})[0]
+
+    def get_sentence_embedding_dimension(self):
+        if self.dim is None:
+            self.ping()
+        return self.dim
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, show_progress_bar=False, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.empty((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+        delay = 0.01
+        request = {"op": "encode", "model": self.model_name, "caller": self.caller, "texts": texts}
+        while True:
+            header, payload = self._call(request)
+            if header.get("error") != "busy":
+                break
+            if time.monotonic() + delay > deadline:
+                raise EmbeddingServiceBusy(f"{header.get('pending')} texts pending after {self.timeout:g}s")
+            with self._stats_lock:
+                self.stats["busy_retries"] += 1
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+        if "error" in header:
+            raise EmbeddingServiceError(header["error"])
+        vectors = np.frombuffer(payload, dtype=np.float32).reshape(header["shape"])
+        with self._stats_lock:
+            self.stats["requests"] += 1
+            self.stats["texts"] += len(texts)
+            self.stats["seconds"] += time.perf_counter() - start
+        return vectors[0] if single else vectors
+
+
+def connect(model_name, socket_path=None):
+    """Client for the embedding service, checked to be up and serving model_name"""
+    model = RemoteEmbeddingModel(socket_path or EMBEDDING_SERVICE_SOCKET, model_name)
+    model.ping()
+    return model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared embedding service for API workers and ingestion")
+    parser.add_argument("--socket", default=EMBEDDING_SERVICE_SOCKET or DEFAULT_SOCKET, help="Unix socket path")
+    parser.add_argument("--model", default=EMBEDDING_MODEL, help="SentenceTransformer model name")
+    parser.add_argument("--max-batch", type=int, default=EMBEDDING_SERVICE_MAX_BATCH)
+    parser.add_argument("--max-pending", type=int, default=EMBEDDING_SERVICE_MAX_PENDING)
+    parser.add_argument("--stats", action="store_true", help="Print a running service's per-caller stats and exit")
+    args = parser.parse_args()
+
+    if args.stats:
+        print(json.dumps(RemoteEmbeddingModel(args.socket, args.model).service_stats(), indent=2))
+        sys.exit(0)
+
+    service = EmbeddingService(args.model, max_batch=args.max_batch, max_pending=args.max_pending)
+    try:
+        asyncio.run(service.serve(args.socket))
+    except KeyboardInterrupt:
+        pass
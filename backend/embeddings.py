@@ -0,0 +1,234 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are only serialized within one process
+    fcntl = None
+
+# Load environment variables
+load_dotenv()
+
+# Path configuration
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.join(BASE_DIR, "..")
+
+# Configuration from environment variables with defaults
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = os.path.join(PROJECT_ROOT, os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache"))
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "10000"))
+
+# Index record: 16-byte text digest followed by the row number in vectors.f32
+INDEX_RECORD = np.dtype([("key", "S16"), ("row", "<u8")])
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class EmbeddingCache:
+    """
+    Persistent text -> embedding cache for one embedding model.
+
+    Vectors live in an append-only float32 file that is read through a
+    memory map, and an append-only index maps 16-byte text digests to rows.
+    A bounded LRU dict sits in front of the memory map. Appends take an
+    exclusive file lock so the API server and ingestion runs can share the
+    same cache directory.
+    """
+
+    def __init__(self, model_name: str, cache_dir=EMBEDDING_CACHE_PATH,
+                 memory_entries=EMBEDDING_CACHE_MEMORY_ENTRIES):
+        self.model_name = model_name
+        self.dir = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+        self.vectors_path = os.path.join(self.dir, "vectors.f32")
+        self.index_path = os.path.join(self.dir, "index.bin")
+        self.meta_path = os.path.join(self.dir, "meta.json")
+        self.memory_entries = memory_entries
+        self.dim = None
+        self._rows = {}
+        self._index_size = 0
+        self._mmap = None
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+        os.makedirs(self.dir, exist_ok=True)
+        self._load_index()
+
+    def _load_meta(self):
+        """Read the vector width, once any process has written meta.json"""
+        if self.dim is None and os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+
+    def _load_index(self):
+        """Read index records appended since the last call (possibly by another process)"""
+        # meta.json is written before the first record, so rows never outrun dim
+        self._load_meta()
+        if not os.path.exists(self.index_path):
+            return
+        size = os.path.getsize(self.index_path)
+        size -= size % INDEX_RECORD.itemsize
+        if size <= self._index_size:
+            return
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_size)
+            records = np.frombuffer(f.read(size - self._index_size), dtype=INDEX_RECORD)
+        for key, row in zip(records["key"].tolist(), records["row"].tolist()):
+            self._rows[key] = row
+        self._index_size = size
+
+    def _vector(self, row: int):
+        if self._mmap is None or row >= self._mmap.shape[0]:
+            rows = os.path.getsize(self.vectors_path) // (self.dim * 4)
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        return np.array(self._mmap[row])
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, key):
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return vector
+        row = self._rows.get(key)
+        if row is not None:
+            vector = self._vector(row)
+            self._remember(key, vector)
+            self.stats["disk_hits"] += 1
+            return vector
+        return None
+
+    def _append(self, keys, vectors):
+        """Persist new vectors and their index records under an exclusive lock"""
+        with open(self.vectors_path, "ab") as vectors_file:
+            if fcntl:
+                fcntl.flock(vectors_file, fcntl.LOCK_EX)
+            try:
+                # Another process may have created the cache since we last looked
+                self._load_meta()
+                if self.dim is None:
+                    self.dim = int(vectors.shape[1])
+                    tmp_path = self.meta_path + ".tmp"
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        json.dump({"model": self.model_name, "dim": self.dim}, f)
+                    os.replace(tmp_path, self.meta_path)
+
+                # Rows are derived from the file size, so an interrupted
+                # append only wastes space and never misaligns the index
+                vectors_file.seek(0, os.SEEK_END)
+                first_row = vectors_file.tell() // (self.dim * 4)
+                vectors_file.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+                vectors_file.flush()
+
+                records = np.empty(len(keys), dtype=INDEX_RECORD)
+                records["key"] = keys
+                records["row"] = np.arange(first_row, first_row + len(keys))
+                with open(self.index_path, "ab") as index_file:
+                    index_file.write(records.tobytes())
+            finally:
+                if fcntl:
+                    fcntl.flock(vectors_file, fcntl.LOCK_UN)
+
+        for key, row, vector in zip(keys, records["row"].tolist(), vectors):
+            self._rows[key] = row
+            self._remember(key, vector)
+
+    def encode(self, texts, model, batch_size=32, persist=True):
+        """
+        Embeddings for texts as a float32 array, calling model.encode only
+        for texts that are not cached yet.
+
+        New embeddings are written to disk only with persist; otherwise
+        they stay in the bounded in-memory LRU. Query text is open-ended,
+        so only ingestion persists: the files then grow with the corpus,
+        not with traffic.
+        """
+        keys = [text_key(text) for text in texts]
+        result = [None] * len(texts)
+
+        with self._lock:
+            missing = {}
+            for i, key in enumerate(keys):
+                vector = self._lookup(key)
+                if vector is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    result[i] = vector
+
+            if missing:
+                # Pick up rows appended by other processes before encoding
+                self._load_index()
+                for key in list(missing):
+                    vector = self._lookup(key)
+                    if vector is not None:
+                        for i in missing.pop(key):
+                            result[i] = vector
+
+            self.stats["misses"] += sum(len(positions) for positions in missing.values())
+
+        if missing:
+            miss_keys = list(missing)
+            vectors = np.asarray(
+                model.encode(
+                    [texts[missing[key][0]] for key in miss_keys],
+                    batch_size=batch_size,
+                    convert_to_numpy=True,
+                    show_progress_bar=False
+                ),
+                dtype=np.float32
+            )
+            with self._lock:
+                if persist:
+                    self._append(miss_keys, vectors)
+                else:
+                    for key, vector in zip(miss_keys, vectors):
+                        self._remember(key, vector)
+            for key, vector in zip(miss_keys, vectors):
+                for i in missing[key]:
+                    result[i] = vector
+
+        if not result:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return np.stack(result)
+
+
+class PassthroughCache:
+    """Stand-in used when EMBEDDING_CACHE_ENABLED is false"""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def encode(self, texts, model, batch_size=32, persist=True):
+        self.stats["misses"] += len(texts)
+        return np.asarray(
+            model.encode(list(texts), batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False),
+            dtype=np.float32
+        )
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(model_name: str):
+    """Process-wide embedding cache for a model name"""
+    with _caches_lock:
+        if model_name not in _caches:
+            cache_class = EmbeddingCache if EMBEDDING_CACHE_ENABLED else PassthroughCache
+            _caches[model_name] = cache_class(model_name)
+        return _caches[model_name]
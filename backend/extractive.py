@@ -0,0 +1,81 @@
+import os
+import re
+from dotenv import load_dotenv
+
+import numpy as np
+
+from backend.config import PARAGRAPH_BREAK, SENTENCE_END
+
+# Load environment variables
+load_dotenv()
+
+# Configuration from environment variables with defaults
+# Answer straight from the documents, skipping the LLM, when a retrieved
+# sentence is similar enough to the question (per-request "extractive" overrides)
+EXTRACTIVE_ENABLED = os.getenv("EXTRACTIVE_ENABLED", "false").lower() == "true"
+# Minimum cosine similarity between the question and the best sentence span
+EXTRACTIVE_THRESHOLD = float(os.getenv("EXTRACTIVE_THRESHOLD", "0.75"))
+# Only sentences from the best-ranked chunks are candidates
+EXTRACTIVE_CHUNKS = int(os.getenv("EXTRACTIVE_CHUNKS", "3"))
+# Longest span considered, in consecutive sentences
+EXTRACTIVE_MAX_SENTENCES = int(os.getenv("EXTRACTIVE_MAX_SENTENCES", "2"))
+# Spans encoded per query at most, taken from the best-ranked chunks first
+EXTRACTIVE_MAX_SPANS = int(os.getenv("EXTRACTIVE_MAX_SPANS", "48"))
+
+# The boundaries the chunker splits on (backend/config.py)
+SENTENCE_BOUNDARY = re.compile(f"{SENTENCE_END}|{PARAGRAPH_BREAK}")
+# Fragments shorter than this (headings, page numbers) are not answers on their own
+MIN_SENTENCE_CHARS = 20
+
+
+def split_sentences(text: str):
+    sentences = (" ".join(part.split()) for part in SENTENCE_BOUNDARY.split(text))
+    return [sentence for sentence in sentences if sentence]
+
+
+def cosine_similarities(query, vectors):
+    """Cosine similarity of one query vector with each row of vectors"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not len(vectors):
+        return np.empty(0, dtype=np.float32)
+    query = np.asarray(query, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query)
+    return vectors @ query / np.maximum(norms, 1e-12)
+
+
+def candidate_spans(results, max_chunks: int = EXTRACTIVE_CHUNKS, max_sentences: int = EXTRACTIVE_MAX_SENTENCES,
+                    max_spans: int = EXTRACTIVE_MAX_SPANS):
+    """
+    Runs of 1..max_sentences consecutive sentences from the top max_chunks
+    chunks of single-query retrieval results, as (span, chunk position)
+    pairs without repeats, at most max_spans of them.
+    """
+    spans, seen = [], set()
+    documents = (results.get("documents") or [[]])[0][:max_chunks]
+    for position, document in enumerate(documents):
+        sentences = split_sentences(document)
+        for size in range(1, max_sentences + 1):
+            for start in range(len(sentences) - size + 1):
+                span = " ".join(sentences[start:start + size])
+                if len(span) >= MIN_SENTENCE_CHARS and span not in seen:
+                    seen.add(span)
+                    spans.append((span, position))
+                    if len(spans) >= max_spans:
+                        return spans
+    return spans
+
+
+def best_span(query_embedding, results, encode, max_chunks: int = EXTRACTIVE_CHUNKS,
+              max_sentences: int = EXTRACTIVE_MAX_SENTENCES, max_spans: int = EXTRACTIVE_MAX_SPANS):
+    """
+    The retrieved sentence span most similar to the question.
+
+    encode(texts) returns one embedding per text. Returns (span, similarity,
+    chunk position), or None if the chunks have no usable sentences.
+    """
+    spans = candidate_spans(results, max_chunks, max_sentences, max_spans)
+    if not spans:
+        return None
+    similarities = cosine_similarities(query_embedding, encode([span for span, _ in spans]))
+    best = int(np.argmax(similarities))
+    return spans[best][0], float(similarities[best]), spans[best][1]
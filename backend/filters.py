@@ -0,0 +1,273 @@
+import os
+import json
+import weakref
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+import numpy as np
+
+# Load environment variables
+load_dotenv()
+
+# Configuration from environment variables with defaults
+# Distinct filters whose resolved chunk sets are kept between queries
+FILTER_CACHE_ENTRIES = int(os.getenv("FILTER_CACHE_ENTRIES", "128"))
+
+FILTER_KEYS = ("sources", "page_from", "page_to", "ingested_after", "ingested_before")
+
+
+def to_timestamp(value: datetime) -> float:
+    """Unix timestamp of a datetime, reading naive values as UTC like the stored ingestion times"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def normalize_filters(filters):
+    """
+    Drop unset fields and turn datetimes into Unix timestamps (naive
+    datetimes are taken as UTC).
+
+    Returns None when nothing is left, so unfiltered queries keep sharing
+    retrieval batches and cache entries.
+    """
+    if not filters:
+        return None
+    normalized = {}
+    for key in FILTER_KEYS:
+        value = filters.get(key)
+        if value is None:
+            continue
+        if isinstance(value, datetime):
+            value = to_timestamp(value)
+        if key == "sources":
+            value = sorted(set(value))
+        normalized[key] = value
+    return normalized or None
+
+
+def filters_key(filters) -> str:
+    """Stable string identifying a normalized filter set ("" for none)"""
+    return json.dumps(filters, sort_keys=True) if filters else ""
+
+
+class AllowedChunks:
+    """
+    The chunks matching one filter, resolved lazily and shared by every
+    query with that filter.
+
+    Chroma filters through its where clause and only needs len(); other
+    backends ask derive() for a structure of their own (row numbers,
+    labels, a document mask), which is built once per backend object and
+    state rather than on every query.
+    """
+
+    def __init__(self, parts):
+        # (ids, mask) per selected source: the matching ids are ids[mask]
+        self._parts = parts
+        self._ids = None
+        self._id_set = None
+        self._count = None
+        self._derived = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        if self._count is None:
+            self._count = sum(int(np.count_nonzero(mask)) for _, mask in self._parts)
+        return self._count
+
+    def __bool__(self):
+        return len(self) > 0
+
+    @property
+    def ids(self):
+        """Matching chunk ids as an object array"""
+        if self._ids is None:
+            arrays = [ids[mask] for ids, mask in self._parts]
+            self._ids = np.concatenate(arrays) if arrays else np.empty(0, dtype=object)
+        return self._ids
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def __contains__(self, chunk_id):
+        if self._id_set is None:
+            self._id_set = set(self.ids.tolist())
+        return chunk_id in self._id_set
+
+    def derive(self, owner, build, state=None):
+        """
+        build(self), memoized per owner object until its state changes;
+        dropped with the owner (e.g. a replaced index or segment)
+        """
+        with self._lock:
+            cached = self._derived.get(owner)
+            if cached is not None and cached[0] == state:
+                return cached[1]
+        value = build(self)
+        with self._lock:
+            self._derived[owner] = (state, value)
+        return value
+
+
+class SourceIndex:
+    """
+    Per-source chunk ids, pages and ingestion times.
+
+    Loaded from the ingestion manifest (chunk ids embed their page) and
+    reloaded whenever the manifest changes, so resolving a filter to the
+    matching chunk ids costs a lookup per selected source rather than a
+    scan of the collection. Resolved filters are cached (up to
+    FILTER_CACHE_ENTRIES) until the manifest changes. Collections ingested
+    without a manifest are indexed once from their Chroma metadata instead.
+    """
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        self._sources = {}
+        self._version = False
+        self._resolved = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _current_version(self):
+        try:
+            return os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def refresh(self, collection=None):
+        """Reload if the manifest changed since the last call"""
+        version = self._current_version()
+        with self._lock:
+            if version == self._version:
+                return
+            if version is not None:
+                self._sources = self._from_manifest()
+            elif collection is not None:
+                self._sources = self._from_collection(collection)
+            else:
+                self._sources = {}
+            self._resolved.clear()
+            self._version = version
+
+    def _from_manifest(self):
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        sources = {}
+        for source, entry in manifest["files"].items():
+            ids = entry["chunk_ids"]
+            # Chunk ids are "<source>:<page>:<digest>[:<ordinal>]"
+            pages = [int(chunk_id[len(source) + 1:].split(":", 1)[0]) for chunk_id in ids]
+            sources[source] = {
+                "ids": np.array(ids, dtype=object),
+                "pages": np.array(pages, dtype=np.int64),
+                "ingested_at": entry.get("ingested_at")
+            }
+        return sources
+
+    @staticmethod
+    def _from_collection(collection, batch_size=1000):
+        grouped = {}
+        offset = 0
+        while True:
+            batch = collection.get(limit=batch_size, offset=offset, include=["metadatas"])
+            if not batch["ids"]:
+                break
+            for chunk_id, metadata in zip(batch["ids"], batch["metadatas"]):
+                metadata = metadata or {}
+                ids, pages = grouped.setdefault(metadata.get("source", "unknown"), ([], []))
+                ids.append(chunk_id)
+                pages.append(int(metadata.get("page", 0)))
+            offset += len(batch["ids"])
+        return {
+            source: {
+                "ids": np.array(ids, dtype=object),
+                "pages": np.array(pages, dtype=np.int64),
+                "ingested_at": None
+            }
+            for source, (ids, pages) in grouped.items()
+        }
+
+    def sources(self):
+        with self._lock:
+            return sorted(self._sources)
+
+    def resolve(self, filters):
+        """
+        Translate normalized filters into a Chroma where clause and the
+        AllowedChunks matching them.
+
+        Ingestion dates are per file, so date bounds narrow the source list
+        rather than becoming a metadata condition. Returns (where, allowed);
+        both are None for unfiltered queries.
+        """
+        if not filters:
+            return None, None
+
+        key = filters_key(filters)
+        with self._lock:
+            version = self._version
+            resolved = self._resolved.get(key)
+            if resolved is not None:
+                self._resolved.move_to_end(key)
+                return resolved
+
+        resolved = self._resolve(filters)
+        with self._lock:
+            # Not cached if the manifest was reloaded meanwhile
+            if self._version != version:
+                return resolved
+            self._resolved[key] = resolved
+            while len(self._resolved) > FILTER_CACHE_ENTRIES:
+                self._resolved.popitem(last=False)
+        return resolved
+
+    def _resolve(self, filters):
+        page_from = filters.get("page_from")
+        page_to = filters.get("page_to")
+        after = filters.get("ingested_after")
+        before = filters.get("ingested_before")
+
+        with self._lock:
+            names = filters.get("sources") or sorted(self._sources)
+            selected = []
+            for name in names:
+                entry = self._sources.get(name)
+                if entry is None:
+                    continue
+                if after is not None or before is not None:
+                    ingested_at = entry["ingested_at"]
+                    if ingested_at is None:
+                        continue
+                    if after is not None and ingested_at < after:
+                        continue
+                    if before is not None and ingested_at > before:
+                        continue
+                selected.append((name, entry))
+
+            parts = []
+            for _, entry in selected:
+                mask = np.ones(len(entry["pages"]), dtype=bool)
+                if page_from is not None:
+                    mask &= entry["pages"] >= page_from
+                if page_to is not None:
+                    mask &= entry["pages"] <= page_to
+                parts.append((entry["ids"], mask))
+            allowed = AllowedChunks(parts)
+
+        conditions = []
+        if "sources" in filters or after is not None or before is not None:
+            conditions.append({"source": {"$in": [name for name, _ in selected]}})
+        if page_from is not None:
+            conditions.append({"page": {"$gte": page_from}})
+        if page_to is not None:
+            conditions.append({"page": {"$lte": page_to}})
+
+        where = None
+        if len(conditions) == 1:
+            where = conditions[0]
+        elif conditions:
+            where = {"$and": conditions}
+        return where, allowed
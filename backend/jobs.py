@@ -0,0 +1,132 @@
+import os
+import time
+import uuid
+import queue
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+from backend.config import PDF_DIR
+from backend.rag import rag_system
+
+# Load environment variables
+load_dotenv()
+
+# Number of finished jobs kept around for GET /jobs/{id}
+JOB_HISTORY_LIMIT = int(os.getenv("JOB_HISTORY_LIMIT", "200"))
+
+
+class IngestionJobQueue:
+    """
+    In-process ingestion queue served by a single background thread.
+
+    Each job syncs the PDF directory into the live collection used by
+    rag_system, so uploaded documents become queryable without a restart.
+    One worker keeps manifest updates serialized; the API event loop never
+    waits on it.
+    """
+
+    def __init__(self, pdf_dir=PDF_DIR, history_limit=JOB_HISTORY_LIMIT):
+        self.pdf_dir = pdf_dir
+        self.history_limit = history_limit
+        self._queue = queue.Queue()
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def submit(self, filename: str):
+        """Enqueue an ingestion job for an uploaded file and return its status"""
+        job = {
+            "id": uuid.uuid4().hex,
+            "filename": filename,
+            "status": "queued",
+            "stage": None,
+            "progress": {},
+            "error": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None
+        }
+        with self._lock:
+            self._jobs[job["id"]] = job
+            self._trim_history()
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="ingestion-worker", daemon=True)
+                self._worker.start()
+        self._queue.put(job["id"])
+        return self.get(job["id"])
+
+    def get(self, job_id: str):
+        """Snapshot of a job's status with queue/run timings, or None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = dict(job, progress=dict(job["progress"]))
+
+        now = time.time()
+        started = snapshot["started_at"] or now
+        snapshot["queue_seconds"] = round(started - snapshot["created_at"], 3)
+        if snapshot["started_at"] is not None:
+            finished = snapshot["finished_at"] or now
+            snapshot["run_seconds"] = round(finished - snapshot["started_at"], 3)
+        else:
+            snapshot["run_seconds"] = None
+        return snapshot
+
+    def _trim_history(self):
+        finished = [
+            job_id for job_id, job in self._jobs.items()
+            if job["status"] in ("completed", "failed")
+        ]
+        for job_id in finished[:max(0, len(self._jobs) - self.history_limit)]:
+            del self._jobs[job_id]
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _run(self):
+        # Imported here: PyMuPDF, LangChain and Chroma are only needed once
+        # something is uploaded, not to start the server
+        from ingestion.ingest import ingest_incremental, list_pdfs
+        
+        while True:
+            job_id = self._queue.get()
+            self._update(job_id, status="running", stage="scanning", started_at=time.time())
+
+            def progress(stage, stats):
+                self._update(job_id, stage=stage, progress=dict(stats))
+
+            try:
+                # Share the server's model and index instead of loading copies
+                rag_system.load()
+                collection, stats = ingest_incremental(
+                    list_pdfs(self.pdf_dir),
+                    # Extraction stays in this thread: forking a process pool
+                    # from a server that has already loaded torch is unsafe
+                    workers=1,
+                    collection=rag_system.collection,
+                    vector_store=rag_system.vector_store,
+                    model=rag_system.model,
+                    lexical_index=rag_system.lexical_index,
+                    progress=progress
+                )
+                # First ingestion into an empty server: start serving the new collection
+                if rag_system.collection is None:
+                    rag_system.attach_collection(collection)
+                self._update(
+                    job_id,
+                    status="completed",
+                    stage="done",
+                    progress=dict(stats),
+                    finished_at=time.time()
+                )
+            except Exception as e:
+                self._update(job_id, status="failed", error=str(e), finished_at=time.time())
+            finally:
+                self._queue.task_done()
+
+
+# Singleton instance
+ingestion_queue = IngestionJobQueue()
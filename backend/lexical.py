@@ -0,0 +1,463 @@
+import os
+import re
+import json
+import math
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: saves are only serialized within one process
+    fcntl = None
+
+# Load environment variables
+load_dotenv()
+
+# Path configuration
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.join(BASE_DIR, "..")
+
+# Configuration from environment variables with defaults
+LEXICAL_INDEX_PATH = os.path.join(
+    PROJECT_ROOT,
+    os.getenv("LEXICAL_INDEX_PATH", os.path.join(os.getenv("CHROMA_DB_PATH", "chroma_db"), "lexical_index"))
+)
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+# Fold the delta segment into the base once it (or the deleted docs) exceeds this share
+COMPACT_RATIO = float(os.getenv("LEXICAL_COMPACT_RATIO", "0.1"))
+# Query terms found in more than this share of chunks (idf < 0.11) add almost
+# nothing to BM25 but cost a scan of their whole postings list, so they are skipped
+MAX_DF_RATIO = float(os.getenv("BM25_MAX_DF_RATIO", "0.9"))
+
+# Words, plus identifiers such as "4.2.1", "HR-101" or "POL/2023/07"
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./:]\w+)*")
+TOKEN_SEPARATORS = re.compile(r"[-./:]")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from how in is it of on or that the this to was "
+    "were what when where which who why will with".split()
+)
+
+
+def tokenize(text: str):
+    """
+    Lowercased terms of text without stopwords.
+
+    Compound identifiers are indexed whole and by their parts, so "HR-101"
+    matches queries for "hr-101" as well as "hr 101".
+    """
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token not in STOPWORDS:
+            tokens.append(token)
+        if TOKEN_SEPARATORS.search(token):
+            tokens.extend(
+                part for part in TOKEN_SEPARATORS.split(token)
+                if part and part not in STOPWORDS
+            )
+    return tokens
+
+
+class Segment:
+    """
+    Immutable postings for a set of chunks in CSR layout.
+
+    Postings of term i are post_docs/post_tfs[offsets[i]:offsets[i + 1]].
+    Deletions only clear the segment's alive mask.
+    """
+
+    def __init__(self, doc_ids, doc_lens, terms, offsets, post_docs, post_tfs, alive=None):
+        self.doc_ids = doc_ids
+        self.doc_lens = doc_lens
+        self.terms = terms
+        self.term_index = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.post_docs = post_docs
+        self.post_tfs = post_tfs
+        self.alive = np.ones(len(doc_ids), dtype=bool) if alive is None else alive
+
+    def allowed_mask(self, allowed):
+        """Which documents of the segment are in an AllowedChunks"""
+        return np.fromiter((doc_id in allowed for doc_id in self.doc_ids), dtype=bool, count=len(self.doc_ids))
+
+    @classmethod
+    def build(cls, docs):
+        """Segment from a list of (chunk_id, Counter of terms)"""
+        term_ids = {}
+        post_terms, post_docs, post_tfs = [], [], []
+        for doc, (_, counts) in enumerate(docs):
+            for term, tf in counts.items():
+                post_terms.append(term_ids.setdefault(term, len(term_ids)))
+                post_docs.append(doc)
+                post_tfs.append(tf)
+
+        return cls._from_postings(
+            [chunk_id for chunk_id, _ in docs],
+            np.array([sum(counts.values()) for _, counts in docs], dtype=np.int32),
+            list(term_ids),
+            np.array(post_terms, dtype=np.int64),
+            np.array(post_docs, dtype=np.int32),
+            np.array(post_tfs, dtype=np.float32)
+        )
+
+    @classmethod
+    def merge(cls, segments):
+        """Single segment holding the alive documents of all segments"""
+        term_ids = {}
+        doc_ids, doc_lens = [], []
+        all_terms, all_docs, all_tfs = [], [], []
+        doc_base = 0
+
+        for segment in segments:
+            remap = np.array(
+                [term_ids.setdefault(term, len(term_ids)) for term in segment.terms],
+                dtype=np.int64
+            )
+            post_terms = np.repeat(remap, np.diff(segment.offsets))
+            keep = segment.alive[segment.post_docs]
+            new_doc = np.cumsum(segment.alive) - 1 + doc_base
+
+            all_terms.append(post_terms[keep])
+            all_docs.append(new_doc[segment.post_docs[keep]].astype(np.int32))
+            all_tfs.append(segment.post_tfs[keep])
+            doc_ids.extend(doc_id for doc_id, alive in zip(segment.doc_ids, segment.alive) if alive)
+            doc_lens.append(segment.doc_lens[segment.alive])
+            doc_base += int(segment.alive.sum())
+
+        return cls._from_postings(
+            doc_ids,
+            np.concatenate(doc_lens) if doc_lens else np.empty(0, dtype=np.int32),
+            list(term_ids),
+            np.concatenate(all_terms) if all_terms else np.empty(0, dtype=np.int64),
+            np.concatenate(all_docs) if all_docs else np.empty(0, dtype=np.int32),
+            np.concatenate(all_tfs) if all_tfs else np.empty(0, dtype=np.float32)
+        )
+
+    @classmethod
+    def _from_postings(cls, doc_ids, doc_lens, terms, post_terms, post_docs, post_tfs):
+        order = np.argsort(post_terms, kind="stable")
+        counts = np.bincount(post_terms, minlength=len(terms))
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(doc_ids, doc_lens, terms, offsets, post_docs[order], post_tfs[order])
+
+    def postings(self, term):
+        i = self.term_index.get(term)
+        if i is None:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.post_docs[start:end], self.post_tfs[start:end]
+
+    def save(self, path):
+        np.savez(
+            path,
+            doc_ids=np.array([doc_id.encode("utf-8") for doc_id in self.doc_ids], dtype=bytes),
+            doc_lens=self.doc_lens,
+            terms=np.array([term.encode("utf-8") for term in self.terms], dtype=bytes),
+            offsets=self.offsets,
+            post_docs=self.post_docs,
+            post_tfs=self.post_tfs
+        )
+
+    @classmethod
+    def load(cls, path, alive=None):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                [doc_id.decode("utf-8") for doc_id in data["doc_ids"].tolist()],
+                data["doc_lens"],
+                [term.decode("utf-8") for term in data["terms"].tolist()],
+                data["offsets"],
+                data["post_docs"],
+                data["post_tfs"],
+                alive
+            )
+
+
+class BM25Index:
+    """
+    In-process BM25 inverted index over chunk texts, keyed by chunk id.
+
+    Documents live in a large base segment, a smaller delta segment and an
+    in-memory buffer of recent additions. save() seals the buffer into the
+    delta and only rewrites the base when the delta or the deleted share
+    grows past COMPACT_RATIO, so small ingestions stay cheap. A state.json
+    file written last points at the current generation of segment files.
+
+    Saves and loads take a file lock in path, and a save first reloads any
+    index another process saved since this one was loaded, replaying the
+    unsaved changes on top, so concurrent writers never drop each other's
+    chunks.
+    """
+
+    def __init__(self, path=LEXICAL_INDEX_PATH, k1=BM25_K1, b=BM25_B):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.base = None
+        self.delta = None
+        self.pending = []
+        self.locations = {}
+        self.total_len = 0
+        self.generation = 0
+        self._base_dirty = False
+        self._dirty = False
+        # Changes since the last load or save, replayed onto a newer saved index
+        self._changes = []
+        self._lock = threading.RLock()
+        self._version = None
+
+    @property
+    def state_path(self):
+        return os.path.join(self.path, "state.json")
+
+    @classmethod
+    def load(cls, path=LEXICAL_INDEX_PATH):
+        """Load the index at path, or return an empty one if none was saved"""
+        index = cls(path)
+        index._load()
+        return index
+
+    @property
+    def lock_path(self):
+        return os.path.join(self.path, "index.lock")
+
+    @contextmanager
+    def _file_lock(self, exclusive):
+        """Shared (load) or exclusive (save) lock against other processes using path"""
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.lock_path, "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        """Read the saved index, discarding unsaved changes"""
+        if self._current_version() is None:
+            self._read()
+            return
+        # A concurrent save removes the segment files it replaces
+        with self._file_lock(exclusive=False):
+            self._read()
+
+    def _read(self):
+        self.base, self.delta, self.pending = None, None, []
+        self.locations, self.total_len, self.generation = {}, 0, 0
+        self._base_dirty, self._dirty, self._changes = False, False, []
+        self._version = self._current_version()
+        if self._version is None:
+            return
+
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        self.generation = state["generation"]
+        with np.load(os.path.join(self.path, state["alive"]), allow_pickle=False) as alive:
+            if state.get("base"):
+                self.base = Segment.load(os.path.join(self.path, state["base"]), alive["base"])
+            if state.get("delta"):
+                self.delta = Segment.load(os.path.join(self.path, state["delta"]), alive["delta"])
+
+        for segment in (self.base, self.delta):
+            if segment is None:
+                continue
+            for doc, doc_id in enumerate(segment.doc_ids):
+                if segment.alive[doc]:
+                    self.locations[doc_id] = (segment, doc)
+            self.total_len += int(segment.doc_lens[segment.alive].sum())
+
+    def _current_version(self):
+        try:
+            return os.stat(self.state_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _reload(self, read):
+        """Re-read the saved index with read, then replay the unsaved changes"""
+        changes = self._changes
+        read()
+        for change in changes:
+            if change[0] == "add":
+                self._add_counts([change[1]], [change[2]])
+            elif change[0] == "delete":
+                self.delete([change[1]])
+            else:
+                self.clear()
+
+    def reload_if_changed(self):
+        """Pick up an index saved by another process (e.g. a CLI ingestion run)"""
+        with self._lock:
+            if self._current_version() != self._version:
+                self._reload(self._load)
+
+    def __len__(self):
+        return len(self.locations)
+
+    def add(self, chunk_ids, texts):
+        """Index chunks, replacing any previous version of the same ids"""
+        self._add_counts(chunk_ids, [Counter(tokenize(text)) for text in texts])
+
+    def _add_counts(self, chunk_ids, term_counts):
+        with self._lock:
+            self.delete(chunk_ids)
+            for chunk_id, counts in zip(chunk_ids, term_counts):
+                self.locations[chunk_id] = (None, len(self.pending))
+                self.pending.append((chunk_id, counts))
+                self.total_len += sum(counts.values())
+                self._changes.append(("add", chunk_id, counts))
+            self._dirty = True
+
+    def delete(self, chunk_ids):
+        with self._lock:
+            for chunk_id in chunk_ids:
+                location = self.locations.pop(chunk_id, None)
+                # Kept even if unknown here: another process may have added it
+                self._changes.append(("delete", chunk_id))
+                if location is None:
+                    continue
+                segment, doc = location
+                if segment is None:
+                    _, counts = self.pending[doc]
+                    self.pending[doc] = (chunk_id, None)
+                    self.total_len -= sum(counts.values())
+                else:
+                    segment.alive[doc] = False
+                    self.total_len -= int(segment.doc_lens[doc])
+                self._dirty = True
+
+    def clear(self):
+        with self._lock:
+            self.base, self.delta, self.pending = None, None, []
+            self.locations, self.total_len = {}, 0
+            self._changes = [("clear",)]
+            self._base_dirty = True
+            self._dirty = True
+
+    def _seal(self):
+        """Fold buffered additions into the delta segment"""
+        docs = [(chunk_id, counts) for chunk_id, counts in self.pending if counts is not None]
+        self.pending = []
+        if not docs:
+            return
+        segments = [segment for segment in (self.delta,) if segment is not None]
+        self.delta = Segment.merge(segments + [Segment.build(docs)])
+        self._relocate(self.delta)
+
+    def _relocate(self, segment):
+        for doc, doc_id in enumerate(segment.doc_ids):
+            self.locations[doc_id] = (segment, doc)
+
+    def search(self, query: str, k: int = 10, allowed=None):
+        """
+        Top-k (chunk_id, score) pairs for query by BM25, optionally only
+        among the chunk ids in allowed
+        """
+        with self._lock:
+            if self.pending:
+                self._seal()
+            if not self.locations or (allowed is not None and not allowed):
+                return []
+
+            segments = [segment for segment in (self.base, self.delta) if segment is not None]
+            n_docs = len(self.locations)
+            avg_len = self.total_len / n_docs or 1.0
+            terms = Counter(tokenize(query))
+
+            candidates = []
+            scores = {id(segment): np.zeros(len(segment.doc_ids), dtype=np.float32) for segment in segments}
+
+            for term, query_tf in terms.items():
+                lists = [(segment, segment.postings(term)) for segment in segments]
+                lists = [(segment, p) for segment, p in lists if p is not None]
+                # Like Lucene, df still counts deleted chunks until compaction
+                df = sum(len(docs) for _, (docs, _) in lists)
+                if not df or df > MAX_DF_RATIO * n_docs:
+                    continue
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                for segment, (docs, tfs) in lists:
+                    norm = self.k1 * (1 - self.b + self.b * segment.doc_lens[docs] / avg_len)
+                    scores[id(segment)][docs] += query_tf * idf * tfs * (self.k1 + 1) / (tfs + norm)
+
+            for segment in segments:
+                segment_scores = scores[id(segment)]
+                segment_scores[~segment.alive] = 0
+                if allowed is not None:
+                    # Segments are immutable, so each keeps its mask for the filter
+                    segment_scores[~allowed.derive(segment, segment.allowed_mask)] = 0
+                hits = np.flatnonzero(segment_scores)
+                if len(hits) > k:
+                    hits = hits[np.argpartition(segment_scores[hits], -k)[-k:]]
+                candidates.extend((float(segment_scores[doc]), segment.doc_ids[doc]) for doc in hits)
+
+            candidates.sort(reverse=True)
+            return [(chunk_id, score) for score, chunk_id in candidates[:k]]
+
+    def save(self):
+        """Persist the index, compacting segments when worthwhile"""
+        with self._lock, self._file_lock(exclusive=True):
+            if self._current_version() != self._version:
+                # Saved by another process since we loaded: build on its segments
+                self._reload(self._read)
+            if not self._dirty and self._version is not None:
+                return
+            self._seal()
+            base_alive = int(self.base.alive.sum()) if self.base is not None else 0
+            base_dead = len(self.base.doc_ids) - base_alive if self.base is not None else 0
+            delta_size = len(self.delta.doc_ids) if self.delta is not None else 0
+
+            if self.base is None or delta_size > COMPACT_RATIO * base_alive or base_dead > COMPACT_RATIO * base_alive:
+                segments = [segment for segment in (self.base, self.delta) if segment is not None]
+                self.base = Segment.merge(segments)
+                self.delta = None
+                self._relocate(self.base)
+                self._base_dirty = True
+
+            self.generation += 1
+            previous = self._read_state()
+            state = {
+                "generation": self.generation,
+                "base": previous.get("base") if not self._base_dirty else None,
+                "delta": None,
+                "alive": f"alive-{self.generation}.npz"
+            }
+            if self._base_dirty:
+                state["base"] = f"base-{self.generation}.npz"
+                self.base.save(os.path.join(self.path, state["base"]))
+            if self.delta is not None:
+                state["delta"] = f"delta-{self.generation}.npz"
+                self.delta.save(os.path.join(self.path, state["delta"]))
+            np.savez(
+                os.path.join(self.path, state["alive"]),
+                base=self.base.alive,
+                delta=self.delta.alive if self.delta is not None else np.empty(0, dtype=bool)
+            )
+
+            tmp_path = self.state_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_path)
+            self._base_dirty = False
+            self._dirty = False
+            self._changes = []
+            self._version = self._current_version()
+            self._remove_stale_files(state)
+
+    def _read_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _remove_stale_files(self, state):
+        current = {name for name in (state["base"], state["delta"], state["alive"]) if name}
+        for name in os.listdir(self.path):
+            if name.endswith(".npz") and name not in current:
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
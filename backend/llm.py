@@ -0,0 +1,359 @@
+import os
+import time
+import random
+import asyncio
+import hashlib
+import threading
+import httpx
+import ollama
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Configuration from environment variables with defaults
+# ollama (a real model server) or fake (deterministic stand-in for load testing)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "ollama")
+# Comma-separated Ollama endpoints; requests go to the one with the fewest in flight
+OLLAMA_HOSTS = os.getenv("OLLAMA_HOSTS", os.getenv("OLLAMA_HOST", "http://localhost:11434"))
+# Per-request timeout (for streams: longest wait between chunks)
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "120"))
+# How long Ollama keeps the model loaded after a request ("-1" = forever)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Consecutive failures before a host is taken out of rotation, and for how long
+OLLAMA_MAX_FAILURES = int(os.getenv("OLLAMA_MAX_FAILURES", "3"))
+OLLAMA_EJECT_SECONDS = float(os.getenv("OLLAMA_EJECT_SECONDS", "30"))
+# Background health checks of every host (0 disables them)
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+OLLAMA_HEALTH_TIMEOUT = float(os.getenv("OLLAMA_HEALTH_TIMEOUT", "2"))
+# Extra attempts on another host when a host fails before answering
+OLLAMA_RETRIES = int(os.getenv("OLLAMA_RETRIES", "1"))
+# Eject a host whose average latency is this many times the fastest host's (0 disables)
+OLLAMA_SLOW_FACTOR = float(os.getenv("OLLAMA_SLOW_FACTOR", "3"))
+# Fake backend: delay before the first token, decode speed and answer length
+FAKE_LLM_TTFT_MS = float(os.getenv("FAKE_LLM_TTFT_MS", "200"))
+FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "30"))
+FAKE_LLM_TOKENS = int(os.getenv("FAKE_LLM_TOKENS", "60"))
+
+FAKE_VOCABULARY = (
+    "the policy document states that employees customers must request approval within days of notice "
+    "according to section page records are reviewed by a manager before any change is applied"
+).split()
+
+
+class LLMClient:
+    """
+    Chat-completion backend used by RAGSystem.
+
+    Responses and stream chunks are shaped like Ollama's: a dict with
+    message.content, and on the final (or only) message done=True plus
+    eval_count / eval_duration (ns) for decode-speed metrics.
+    """
+
+    def chat(self, model, messages):
+        raise NotImplementedError
+
+    async def achat(self, model, messages):
+        raise NotImplementedError
+
+    async def astream(self, model, messages):
+        """Async iterator over stream chunks (one chunk unless overridden)"""
+        yield await self.achat(model, messages)
+
+    def status(self):
+        """Per-host state for /ready, if the backend has hosts"""
+        return None
+
+
+def keep_alive_value(value):
+    """Ollama accepts a number of seconds or a duration string such as 30m"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def is_host_failure(error):
+    """Errors that say something about the host rather than the request"""
+    if isinstance(error, ollama.ResponseError):
+        # 404: model not pulled on this host
+        return error.status_code == 404 or error.status_code >= 500
+    return isinstance(error, (ConnectionError, httpx.TransportError))
+
+
+class OllamaHost:
+    def __init__(self, url, timeout):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        # One client per host and kind, so HTTP connections are reused
+        self.client = ollama.Client(host=self.url, timeout=timeout)
+        self._async_client = None
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.latency = None
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            self._async_client = ollama.AsyncClient(host=self.url, timeout=self.timeout)
+        return self._async_client
+
+    def healthy(self, now=None):
+        return self.ejected_until <= (now or time.monotonic())
+
+
+class OllamaLLMClient(LLMClient):
+    """
+    Ollama client spread over several hosts.
+
+    Each request goes to the healthy host with the fewest requests in
+    flight (ties: lowest recent latency) over persistent connections. A
+    host that fails OLLAMA_MAX_FAILURES times in a row, fails a background
+    health check, or averages OLLAMA_SLOW_FACTOR times the latency of the
+    fastest host is ejected for OLLAMA_EJECT_SECONDS (extended while its
+    health checks keep failing). After that it gets traffic again, and one
+    more failure ejects it again. A request that fails before producing
+    output is retried on another host. When every host is ejected, all of
+    them are tried rather than none.
+    """
+
+    def __init__(self, hosts=OLLAMA_HOSTS, timeout=OLLAMA_TIMEOUT, keep_alive=OLLAMA_KEEP_ALIVE,
+                 max_failures=OLLAMA_MAX_FAILURES, eject_seconds=OLLAMA_EJECT_SECONDS,
+                 health_interval=OLLAMA_HEALTH_INTERVAL, health_timeout=OLLAMA_HEALTH_TIMEOUT,
+                 retries=OLLAMA_RETRIES, slow_factor=OLLAMA_SLOW_FACTOR):
+        if isinstance(hosts, str):
+            hosts = [host.strip() for host in hosts.split(",") if host.strip()]
+        if not hosts:
+            raise ValueError("No Ollama hosts configured (OLLAMA_HOSTS)")
+        self.hosts = [OllamaHost(url if "://" in url else f"http://{url}", timeout) for url in hosts]
+        self.keep_alive = keep_alive_value(keep_alive)
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.retries = retries
+        self.slow_factor = slow_factor
+        self._lock = threading.Lock()
+        self._health_thread = None
+
+    def _start_health_checks(self):
+        if self.health_interval <= 0 or self._health_thread is not None:
+            return
+        with self._lock:
+            if self._health_thread is None:
+                self._health_thread = threading.Thread(target=self._health_loop, name="ollama-health", daemon=True)
+                self._health_thread.start()
+
+    def _health_loop(self):
+        while True:
+            for host in self.hosts:
+                try:
+                    httpx.get(f"{host.url}/api/version", timeout=self.health_timeout).raise_for_status()
+                    ok = True
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    continue
+                with self._lock:
+                    if host.healthy():
+                        self._eject(host, "health check failed")
+                    else:
+                        # Keep a dead host out instead of letting its ejection expire
+                        host.ejected_until = max(host.ejected_until, time.monotonic() + self.eject_seconds)
+            time.sleep(self.health_interval)
+
+    def _eject(self, host, reason):
+        """Take host out of rotation; caller holds the lock"""
+        host.failures = max(host.failures, self.max_failures)
+        host.ejected_until = time.monotonic() + self.eject_seconds
+        # Measured afresh when it returns
+        host.latency = None
+        print(f"⚠ Ejecting Ollama host {host.url} for {self.eject_seconds:g}s: {reason}")
+
+    def _acquire(self, exclude=()):
+        self._start_health_checks()
+        with self._lock:
+            now = time.monotonic()
+            candidates = [host for host in self.hosts if host not in exclude]
+            healthy = [host for host in candidates if host.healthy(now)]
+            host = min(
+                healthy or candidates,
+                key=lambda h: (h.outstanding, h.latency if h.latency is not None else 0.0)
+            )
+            host.outstanding += 1
+            return host
+
+    def _release(self, host, seconds=None, error=None):
+        """Finish a request; without seconds or error (e.g. a cancelled stream) nothing is recorded"""
+        with self._lock:
+            host.outstanding -= 1
+            if error is not None:
+                host.errors += 1
+                if is_host_failure(error):
+                    host.failures += 1
+                    if host.failures >= self.max_failures and host.healthy():
+                        self._eject(host, error)
+            elif seconds is not None:
+                host.requests += 1
+                host.failures = 0
+                # Requests finishing after an ejection do not count towards its return
+                if host.healthy():
+                    host.latency = seconds if host.latency is None else 0.8 * host.latency + 0.2 * seconds
+                    self._check_slow(host)
+
+    def _check_slow(self, host):
+        """Eject host if it is much slower than the fastest other healthy host; caller holds the lock"""
+        if self.slow_factor <= 0:
+            return
+        others = [h.latency for h in self.hosts if h is not host and h.healthy() and h.latency is not None]
+        if others and host.latency > self.slow_factor * min(others):
+            self._eject(host, f"{host.latency:.2f}s average latency vs {min(others):.2f}s")
+
+    def _should_retry(self, error, attempt, tried):
+        return is_host_failure(error) and attempt < self.retries and len(tried) < len(self.hosts)
+
+    def chat(self, model, messages):
+        tried = []
+        for attempt in range(self.retries + 1):
+            host = self._acquire(tried)
+            tried.append(host)
+            start = time.perf_counter()
+            try:
+                response = host.client.chat(model=model, messages=messages, keep_alive=self.keep_alive)
+            except Exception as e:
+                self._release(host, error=e)
+                if self._should_retry(e, attempt, tried):
+                    continue
+                raise
+            self._release(host, time.perf_counter() - start)
+            return response
+
+    async def achat(self, model, messages):
+        tried = []
+        for attempt in range(self.retries + 1):
+            host = self._acquire(tried)
+            tried.append(host)
+            start = time.perf_counter()
+            try:
+                response = await host.async_client.chat(model=model, messages=messages, keep_alive=self.keep_alive)
+            except Exception as e:
+                self._release(host, error=e)
+                if self._should_retry(e, attempt, tried):
+                    continue
+                raise
+            except BaseException:
+                # Task cancelled
+                self._release(host)
+                raise
+            self._release(host, time.perf_counter() - start)
+            return response
+
+    async def astream(self, model, messages):
+        tried = []
+        for attempt in range(self.retries + 1):
+            host = self._acquire(tried)
+            tried.append(host)
+            start = time.perf_counter()
+            started = False
+            try:
+                stream = await host.async_client.chat(
+                    model=model, messages=messages, stream=True, keep_alive=self.keep_alive
+                )
+                async for part in stream:
+                    started = True
+                    yield part
+            except Exception as e:
+                self._release(host, error=e)
+                # Once tokens have been sent a retry would repeat them
+                if not started and self._should_retry(e, attempt, tried):
+                    continue
+                raise
+            except BaseException:
+                # Client disconnected (GeneratorExit) or task cancelled
+                self._release(host)
+                raise
+            self._release(host, time.perf_counter() - start)
+            return
+
+    def status(self):
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "url": host.url,
+                    "healthy": host.healthy(now),
+                    "outstanding": host.outstanding,
+                    "latency_seconds": round(host.latency, 3) if host.latency is not None else None,
+                    "requests": host.requests,
+                    "errors": host.errors
+                }
+                for host in self.hosts
+            ]
+
+
+class FakeLLMClient(LLMClient):
+    """
+    Offline stand-in with tunable latency.
+
+    The answer is `tokens` words picked deterministically from the prompt,
+    the first one after `ttft` seconds and the rest at `tokens_per_second`,
+    so measurements reflect the server's own overheads and concurrency
+    limits rather than a model.
+    """
+
+    def __init__(self, ttft=FAKE_LLM_TTFT_MS / 1000, tokens_per_second=FAKE_LLM_TOKENS_PER_SECOND,
+                 tokens=FAKE_LLM_TOKENS):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.tokens = tokens
+
+    def _words(self, messages):
+        prompt = messages[-1]["content"] if messages else ""
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+        return [rng.choice(FAKE_VOCABULARY) + " " for _ in range(self.tokens)]
+
+    def _token_interval(self):
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _final(self, model, content):
+        return {
+            "model": model,
+            "message": {"role": "assistant", "content": content},
+            "done": True,
+            "eval_count": self.tokens,
+            "eval_duration": int(self.tokens * self._token_interval() * 1e9)
+        }
+
+    def _duration(self):
+        return self.ttft + max(self.tokens - 1, 0) * self._token_interval()
+
+    def chat(self, model, messages):
+        time.sleep(self._duration())
+        return self._final(model, "".join(self._words(messages)).strip())
+
+    async def achat(self, model, messages):
+        await asyncio.sleep(self._duration())
+        return self._final(model, "".join(self._words(messages)).strip())
+
+    async def astream(self, model, messages):
+        interval = self._token_interval()
+        for i, word in enumerate(self._words(messages)):
+            await asyncio.sleep(self.ttft if i == 0 else interval)
+            yield {"model": model, "message": {"role": "assistant", "content": word}, "done": False}
+        yield self._final(model, "")
+
+
+def get_llm_client(kind=LLM_BACKEND) -> LLMClient:
+    """LLM client of the configured kind"""
+    if kind == "ollama":
+        return OllamaLLMClient()
+    if kind == "fake":
+        print(
+            f"⚠ Using the fake LLM backend ({FAKE_LLM_TTFT_MS:.0f} ms to first token, "
+            f"{FAKE_LLM_TOKENS_PER_SECOND:g} tokens/s)"
+        )
+        return FakeLLMClient()
+    raise ValueError(f"Unknown LLM_BACKEND: {kind}")
@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Configuration from environment variables with defaults
+# One JSON log line per request with its id, status, duration and stage timings
+LOG_REQUESTS = os.getenv("LOG_REQUESTS", "false").lower() == "true"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500)
+
+# Set per HTTP request by RequestMetricsMiddleware
+request_id = ContextVar("request_id", default=None)
+request_timings = ContextVar("request_timings", default=None)
+
+logger = logging.getLogger("documind.requests")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge:
+    """Gauge whose value is read from a callback at scrape time"""
+
+    def __init__(self, name, documentation, callback):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+
+    def render(self):
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {float(self.callback())}"
+        ]
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), series["counts"]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    lines.append(
+                        f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', le)])} {cumulative}"
+                    )
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {series['sum']}")
+                lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.register(Histogram(
+    "documind_http_request_seconds", "HTTP request latency", ("method", "route", "status")
+))
+STAGE_SECONDS = registry.register(Histogram(
+    "documind_stage_seconds", "Time spent in each query pipeline stage", ("stage",)
+))
+GENERATION_TOKENS_PER_SECOND = registry.register(Histogram(
+    "documind_generation_tokens_per_second", "Ollama decode speed per generation", buckets=RATE_BUCKETS
+))
+GENERATED_TOKENS = registry.register(Counter(
+    "documind_generated_tokens_total", "Tokens generated by Ollama"
+))
+CACHE_LOOKUPS = registry.register(Counter(
+    "documind_cache_lookups_total", "Answer cache lookups by result", ("result",)
+))
+EXTRACTIVE_ANSWERS = registry.register(Counter(
+    "documind_extractive_answers_total", "Extractive fast-path attempts: answered from a span or fell back to the LLM",
+    ("result",)
+))
+GENERATIONS_SHARED = registry.register(Counter(
+    "documind_generations_shared_total", "Queries answered by joining an identical in-flight generation"
+))
+GENERATIONS_CANCELLED = registry.register(Counter(
+    "documind_generations_cancelled_total", "Generations abandoned by every caller (deadline or disconnect)"
+))
+
+
+def record_stage(stage: str, seconds: float, timings=None):
+    """
+    Observe a pipeline stage duration and add it to timings (if given) and
+    to the current request's timings.
+    """
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+    current = request_timings.get()
+    if current is not None and current is not timings:
+        current[stage] = current.get(stage, 0.0) + seconds
+
+
+def record_generation(tokens: int, seconds: float, timings=None):
+    """Record generated token count and decode speed (tokens per second)"""
+    if tokens:
+        GENERATED_TOKENS.inc(tokens)
+    if tokens and seconds > 0:
+        rate = tokens / seconds
+        GENERATION_TOKENS_PER_SECOND.observe(rate)
+        if timings is not None:
+            timings["tokens_per_second"] = rate
+        current = request_timings.get()
+        if current is not None and current is not timings:
+            current["tokens_per_second"] = rate
+
+
+def merge_timings(source, timings=None):
+    """
+    Add stage timings recorded elsewhere (e.g. by a generation shared with
+    other requests) to timings and the current request's timings, without
+    observing them again.
+    """
+    current = request_timings.get()
+    targets = [timings] if timings is not None else []
+    if current is not None and current is not timings:
+        targets.append(current)
+    for target in targets:
+        for stage, value in source.items():
+            if stage == "tokens_per_second":
+                target[stage] = value
+            else:
+                target[stage] = target.get(stage, 0.0) + value
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware that assigns every HTTP request an id (the incoming
+    X-Request-ID header or a new one, echoed back in the response), times
+    it into documind_http_request_seconds and, with LOG_REQUESTS, logs one
+    JSON line including the stage timings recorded while serving it.
+    Streaming responses are timed until their last byte is sent.
+    """
+
+    def __init__(self, app, log_requests=LOG_REQUESTS):
+        self.app = app
+        self.log_requests = log_requests
+        if log_requests and not logger.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        rid = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex[:16]
+        timings = {}
+        id_token = request_id.set(rid)
+        timings_token = request_timings.set(timings)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", rid.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            duration = time.perf_counter() - start
+            route = scope.get("route")
+            # Route templates keep label cardinality bounded (e.g. /jobs/{job_id})
+            route_label = getattr(route, "path", None) or "unmatched"
+            REQUEST_SECONDS.observe(duration, method=scope["method"], route=route_label, status=status)
+            if self.log_requests:
+                logger.info(json.dumps({
+                    "request_id": rid,
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status,
+                    "seconds": round(duration, 4),
+                    "timings": {stage: round(value, 4) for stage, value in timings.items()}
+                }))
+            request_id.reset(id_token)
+            request_timings.reset(timings_token)
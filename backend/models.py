@@ -0,0 +1,59 @@
+import time
+import threading
+
+from backend.embedding_service import EMBEDDING_SERVICE_SOCKET, connect
+
+# sentence_transformers (and torch) are imported on first use: importing
+# them takes seconds, and the API should bind its port before that
+
+_models = {}
+_locks = {}
+_registry_lock = threading.Lock()
+
+# Seconds spent loading each model, keyed by "<kind>:<name>"
+load_seconds = {}
+
+
+def _get(kind: str, name: str, loader):
+    """Load a model once per process, even when several threads ask at once"""
+    key = f"{kind}:{name}"
+    model = _models.get(key)
+    if model is not None:
+        return model
+
+    with _registry_lock:
+        lock = _locks.setdefault(key, threading.Lock())
+    with lock:
+        if key not in _models:
+            start = time.perf_counter()
+            _models[key] = loader(name)
+            load_seconds[key] = time.perf_counter() - start
+    return _models[key]
+
+
+def _load_sentence_transformer(name):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(name)
+
+
+def _load_cross_encoder(name):
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(name)
+
+
+def get_embedding_model(name: str, local: bool = False):
+    """
+    Shared SentenceTransformer for ingestion and query embedding.
+
+    With EMBEDDING_SERVICE_SOCKET set this is a client of the embedding
+    service instead, so API workers do not each hold a copy of the model;
+    local=True always loads the model in this process.
+    """
+    if EMBEDDING_SERVICE_SOCKET and not local:
+        return _get("embedding-service", name, connect)
+    return _get("embedding", name, _load_sentence_transformer)
+
+
+def get_cross_encoder(name: str):
+    """Shared CrossEncoder for reranking"""
+    return _get("cross-encoder", name, _load_cross_encoder)
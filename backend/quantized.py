@@ -0,0 +1,349 @@
+import os
+import json
+import time
+import argparse
+import threading
+from dotenv import load_dotenv
+
+import numpy as np
+
+# Load environment variables
+load_dotenv()
+
+# Path configuration
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.join(BASE_DIR, "..")
+
+# Configuration from environment variables with defaults
+QUANTIZED_STORE_PATH = os.path.join(
+    PROJECT_ROOT,
+    os.getenv("QUANTIZED_STORE_PATH", os.path.join(os.getenv("CHROMA_DB_PATH", "chroma_db"), "quantized"))
+)
+# int8 (4x smaller than float32) or float16 (2x smaller, near-lossless)
+QUANTIZED_DTYPE = os.getenv("QUANTIZED_DTYPE", "int8")
+# Re-rank the best k * QUANTIZED_RESCORE_FACTOR candidates with the float32 vectors
+QUANTIZED_RESCORE = os.getenv("QUANTIZED_RESCORE", "true").lower() == "true"
+QUANTIZED_RESCORE_FACTOR = int(os.getenv("QUANTIZED_RESCORE_FACTOR", "4"))
+# Rows dequantized per step of a search; bounds the float32 scratch memory
+SEARCH_BLOCK_ROWS = int(os.getenv("QUANTIZED_BLOCK_ROWS", "65536"))
+
+DTYPES = {"int8": np.int8, "float16": np.float16}
+
+
+def collection_space(collection):
+    """Distance function of a Chroma collection: l2 (the default), cosine or ip"""
+    metadata = collection.metadata or {}
+    if "hnsw:space" in metadata:
+        return metadata["hnsw:space"]
+    configuration = getattr(collection, "configuration_json", None) or {}
+    return (configuration.get("hnsw") or {}).get("space", "l2")
+
+
+def space_distances(space, dots, norms, query_norms):
+    """Chroma-compatible distances from dot products and vector norms"""
+    if space == "cosine":
+        return 1.0 - dots / np.maximum(norms * query_norms, 1e-12)
+    if space == "ip":
+        return 1.0 - dots
+    # Squared L2, as Chroma and hnswlib report it
+    return np.maximum(norms ** 2 - 2.0 * dots + query_norms ** 2, 0.0)
+
+
+def distance_similarities(space, distances):
+    """
+    Cosine similarities from Chroma distances, assuming unit-length
+    embeddings as sentence-transformers models produce
+    """
+    distances = np.asarray(distances, dtype=np.float32)
+    if space in ("cosine", "ip"):
+        return 1.0 - distances
+    # Squared L2 between unit vectors is 2 - 2cos
+    return 1.0 - distances / 2.0
+
+
+def quantize(vectors, dtype):
+    """Quantize float32 rows; returns (codes, per-row scales)"""
+    if dtype == "float16":
+        return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+    # Symmetric per-row int8: the largest component maps to +/-127
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+class QuantizedVectorStore:
+    """
+    Read-only dense index over int8 or float16 embeddings.
+
+    Quantized codes, per-row scales and norms are .npy files opened as
+    memory maps, so several worker processes share one copy through the
+    page cache. Searches dequantize SEARCH_BLOCK_ROWS rows at a time, keep
+    the best candidates by approximate distance and, with rescoring,
+    recompute exact distances for those candidates from a float32 copy that
+    is only ever touched row by row. Distances follow the source Chroma
+    collection's space so results are interchangeable with Chroma's.
+
+    Built from a Chroma collection with build_from_collection(); a
+    state.json written last points at the current generation of files.
+    """
+
+    def __init__(self, path, state):
+        self.path = path
+        self.state = state
+        self.dtype = state["dtype"]
+        self.space = state["space"]
+        self.version = state.get("version")
+        self.rescore = QUANTIZED_RESCORE
+        self.rescore_factor = max(1, QUANTIZED_RESCORE_FACTOR)
+
+        prefix = os.path.join(path, f"{state['generation']}")
+        self.codes = np.load(f"{prefix}.codes.npy", mmap_mode="r")
+        self.scales = np.load(f"{prefix}.scales.npy", mmap_mode="r")
+        self.norms = np.load(f"{prefix}.norms.npy", mmap_mode="r")
+        self.full = np.load(f"{prefix}.full.npy", mmap_mode="r")
+        with open(f"{prefix}.ids.json", "r", encoding="utf-8") as f:
+            self.ids = json.load(f)
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+
+    @staticmethod
+    def state_path(path):
+        return os.path.join(path, "state.json")
+
+    @classmethod
+    def load(cls, path=QUANTIZED_STORE_PATH):
+        """Open the store at path, or return None if none was built"""
+        try:
+            with open(cls.state_path(path), "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        return cls(path, state)
+
+    @classmethod
+    def build_from_collection(cls, collection, path=QUANTIZED_STORE_PATH, dtype=QUANTIZED_DTYPE,
+                              version=None, batch_size=1000):
+        """
+        Copy every embedding out of a Chroma collection into a new
+        generation of store files and switch state.json to it. version is
+        recorded so callers can tell when the store has gone stale.
+        """
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported quantized dtype: {dtype}")
+        os.makedirs(path, exist_ok=True)
+        previous = cls._read_state(path)
+        generation = previous.get("generation", 0) + 1
+        prefix = os.path.join(path, f"{generation}")
+
+        total = collection.count()
+        ids, codes, scales, norms, full = [], None, None, None, None
+        offset = 0
+        while offset < total:
+            batch = collection.get(limit=batch_size, offset=offset, include=["embeddings"])
+            if not batch["ids"]:
+                break
+            vectors = np.asarray(batch["embeddings"], dtype=np.float32)
+            rows = min(len(vectors), total - offset)
+            vectors = vectors[:rows]
+            if codes is None:
+                dim = vectors.shape[1]
+                codes = np.lib.format.open_memmap(f"{prefix}.codes.npy", "w+", DTYPES[dtype], (total, dim))
+                scales = np.lib.format.open_memmap(f"{prefix}.scales.npy", "w+", np.float32, (total,))
+                norms = np.lib.format.open_memmap(f"{prefix}.norms.npy", "w+", np.float32, (total,))
+                full = np.lib.format.open_memmap(f"{prefix}.full.npy", "w+", np.float32, (total, dim))
+            batch_codes, batch_scales = quantize(vectors, dtype)
+            codes[offset:offset + rows] = batch_codes
+            scales[offset:offset + rows] = batch_scales
+            norms[offset:offset + rows] = np.linalg.norm(vectors, axis=1)
+            full[offset:offset + rows] = vectors
+            ids.extend(batch["ids"][:rows])
+            offset += rows
+
+        if codes is None:
+            # Empty collection: zero-row files keep load() uniform
+            for name, array_dtype, shape in (("codes", DTYPES[dtype], (0, 0)), ("scales", np.float32, (0,)),
+                                             ("norms", np.float32, (0,)), ("full", np.float32, (0, 0))):
+                np.save(f"{prefix}.{name}.npy", np.empty(shape, dtype=array_dtype))
+        else:
+            # Rows removed from the collection mid-build leave a short tail
+            for array in (codes, scales, norms, full):
+                array.flush()
+            if len(ids) < total:
+                for name in ("codes", "scales", "norms", "full"):
+                    data = np.load(f"{prefix}.{name}.npy", mmap_mode="r")[:len(ids)]
+                    np.save(f"{prefix}.{name}.tmp.npy", data)
+                    os.replace(f"{prefix}.{name}.tmp.npy", f"{prefix}.{name}.npy")
+
+        with open(f"{prefix}.ids.json", "w", encoding="utf-8") as f:
+            json.dump(ids, f)
+
+        state = {
+            "generation": generation,
+            "dtype": dtype,
+            "space": collection_space(collection),
+            "count": len(ids),
+            "version": version
+        }
+        tmp_path = cls.state_path(path) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, cls.state_path(path))
+        cls._remove_stale_files(path, generation)
+        return cls(path, state)
+
+    @classmethod
+    def _read_state(cls, path):
+        if not os.path.exists(cls.state_path(path)):
+            return {}
+        with open(cls.state_path(path), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _remove_stale_files(path, generation):
+        # Open memory maps of older generations stay valid after unlinking
+        for name in os.listdir(path):
+            if name != "state.json" and not name.startswith(f"{generation}."):
+                try:
+                    os.remove(os.path.join(path, name))
+                except OSError:
+                    pass
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        """Bytes searched per query (codes + scales + norms)"""
+        return self.codes.nbytes + self.scales.nbytes + self.norms.nbytes
+
+    def _allowed_rows(self, allowed):
+        rows = np.fromiter(
+            (self._rows[chunk_id] for chunk_id in allowed if chunk_id in self._rows), dtype=np.int64
+        )
+        rows.sort()
+        return rows
+
+    def search(self, queries, k: int, allowed=None):
+        """
+        Top-k (ids, distances) per query row, nearest first, optionally only
+        among the chunks of an AllowedChunks (backend/filters.py).
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        n_queries = len(queries)
+        rows = None
+        if allowed is not None:
+            # The store is immutable, so the rows are computed once per filter
+            rows = allowed.derive(self, self._allowed_rows)
+        n = len(self.ids) if rows is None else len(rows)
+        k = min(k, n)
+        if k <= 0:
+            return [[] for _ in range(n_queries)], [[] for _ in range(n_queries)]
+
+        candidates = min(n, k * self.rescore_factor) if self.rescore else k
+        query_norms = np.linalg.norm(queries, axis=1)
+        best_rows = np.empty((n_queries, 0), dtype=np.int64)
+        best = np.empty((n_queries, 0), dtype=np.float32)
+
+        for start in range(0, n, SEARCH_BLOCK_ROWS):
+            if rows is None:
+                block_rows = np.arange(start, min(n, start + SEARCH_BLOCK_ROWS))
+                codes = self.codes[start:start + SEARCH_BLOCK_ROWS]
+            else:
+                block_rows = rows[start:start + SEARCH_BLOCK_ROWS]
+                codes = self.codes[block_rows]
+            dots = (codes.astype(np.float32) @ queries.T) * self.scales[block_rows][:, None]
+            distances = space_distances(self.space, dots, self.norms[block_rows][:, None], query_norms[None, :]).T
+
+            merged_rows = np.concatenate([best_rows, np.broadcast_to(block_rows, distances.shape)], axis=1)
+            merged = np.concatenate([best, distances], axis=1)
+            if merged.shape[1] > candidates:
+                keep = np.argpartition(merged, candidates - 1, axis=1)[:, :candidates]
+                merged_rows = np.take_along_axis(merged_rows, keep, axis=1)
+                merged = np.take_along_axis(merged, keep, axis=1)
+            best_rows, best = merged_rows, merged
+
+        if self.rescore:
+            unique = np.unique(best_rows)
+            exact_dots = self.full[unique] @ queries.T
+            positions = np.searchsorted(unique, best_rows)
+            dots = exact_dots[positions, np.arange(n_queries)[:, None]]
+            best = space_distances(self.space, dots, self.norms[best_rows], query_norms[:, None])
+
+        order = np.argsort(best, axis=1, kind="stable")[:, :k]
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        best = np.take_along_axis(best, order, axis=1)
+        ids = [[self.ids[row] for row in query_rows] for query_rows in best_rows]
+        return ids, best.astype(float).tolist()
+
+
+class QuantizedStoreRefresher:
+    """
+    Keeps a QuantizedVectorStore in step with its Chroma collection.
+
+    current() returns the loaded store, and when the collection's version
+    (the ingestion manifest's mtime) no longer matches the store's, starts
+    one background rebuild and swaps the new store in once it is done.
+    Until then searches use the previous store.
+    """
+
+    def __init__(self, version_fn, path=QUANTIZED_STORE_PATH, dtype=QUANTIZED_DTYPE):
+        self.version_fn = version_fn
+        self.path = path
+        self.dtype = dtype
+        self.store = None
+        self._rebuilding = None
+        self._lock = threading.Lock()
+
+    def open(self, collection):
+        """Load the store, building it first if missing, stale or of another dtype"""
+        store = QuantizedVectorStore.load(self.path)
+        if store is None or store.version != self.version_fn() or store.dtype != self.dtype:
+            store = self.rebuild(collection)
+        self.store = store
+        return store
+
+    def rebuild(self, collection):
+        start = time.perf_counter()
+        store = QuantizedVectorStore.build_from_collection(
+            collection, self.path, self.dtype, version=self.version_fn()
+        )
+        print(f"✓ Quantized vector store built: {len(store)} vectors ({store.dtype}) "
+              f"in {time.perf_counter() - start:.2f}s")
+        return store
+
+    def current(self, collection):
+        store = self.store
+        if store is not None and store.version != self.version_fn():
+            with self._lock:
+                if self._rebuilding is None or not self._rebuilding.is_alive():
+                    self._rebuilding = threading.Thread(
+                        target=self._rebuild_in_background, args=(collection,),
+                        name="quantized-rebuild", daemon=True
+                    )
+                    self._rebuilding.start()
+        return store
+
+    def _rebuild_in_background(self, collection):
+        try:
+            self.store = self.rebuild(collection)
+        except Exception as e:
+            print(f"⚠ Warning: Could not rebuild quantized vector store: {e}")
+
+
+if __name__ == "__main__":
+    import chromadb
+    from backend.config import CHROMA_DB_PATH, COLLECTION_NAME, MANIFEST_PATH
+
+    parser = argparse.ArgumentParser(description="Build the quantized vector store from the Chroma collection")
+    parser.add_argument("--dtype", choices=sorted(DTYPES), default=QUANTIZED_DTYPE)
+    parser.add_argument("--path", default=QUANTIZED_STORE_PATH)
+    args = parser.parse_args()
+
+    collection = chromadb.PersistentClient(path=CHROMA_DB_PATH).get_collection(name=COLLECTION_NAME)
+    version = os.stat(MANIFEST_PATH).st_mtime_ns if os.path.exists(MANIFEST_PATH) else None
+
+    start = time.perf_counter()
+    store = QuantizedVectorStore.build_from_collection(collection, args.path, args.dtype, version=version)
+    float32_bytes = store.full.nbytes
+    print(f"Built {len(store)} vectors in {time.perf_counter() - start:.2f}s")
+    print(f"Search memory: {store.nbytes / 1e6:.1f} MB ({store.dtype}) vs {float32_bytes / 1e6:.1f} MB float32")
@@ -1,78 +1,439 @@
 import os
+import time
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
-import chromadb
-import ollama
+from backend.config import CHROMA_DB_PATH, COLLECTION_NAME, MANIFEST_PATH
+from backend.cache import SemanticCache
+from backend.embeddings import get_embedding_cache
+from backend.embedding_service import EMBEDDING_SERVICE_SOCKET
+from backend.models import get_embedding_model
+from backend.batching import MicroBatcher
+from backend.lexical import BM25Index
+from backend.rerank import Reranker, RERANK_ENABLED, RERANK_CANDIDATES, RESULT_KEYS
+from backend.context import build_context
+from backend.extractive import EXTRACTIVE_ENABLED, EXTRACTIVE_THRESHOLD, best_span, cosine_similarities
+from backend.llm import get_llm_client
+from backend.scheduler import DeadlineExceeded, GenerationScheduler, QueryQueueFull, generation_key, time_left
+from backend.metrics import CACHE_LOOKUPS, EXTRACTIVE_ANSWERS, record_generation, record_stage
+from backend.filters import SourceIndex, filters_key, normalize_filters
+from backend.vectorstores import ChromaVectorStore, open_vector_store
+from backend.quantized import collection_space, distance_similarities
 
 # Load environment variables
 load_dotenv()
 
-# Path configuration
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-PROJECT_ROOT = os.path.join(BASE_DIR, "..")
-
 # Configuration from environment variables with defaults
-CHROMA_DB_PATH = os.path.join(PROJECT_ROOT, os.getenv("CHROMA_DB_PATH", "chroma_db"))
 LLM_MODEL = os.getenv("LLM_MODEL", "llama2")
 TOP_K = int(os.getenv("TOP_K", "5"))
+# dense (vectors only), lexical (BM25 only) or hybrid (reciprocal-rank fusion of both)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Candidates taken from each retriever before fusion in hybrid mode
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
 
+# Concurrency limits for the async query pipeline
+MAX_INFLIGHT_QUERIES = int(os.getenv("MAX_INFLIGHT_QUERIES", "4"))
+MAX_QUEUED_QUERIES = int(os.getenv("MAX_QUEUED_QUERIES", "64"))
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "4"))
+# Concurrent Ollama generations per batch request (defaults to the in-flight limit)
+BATCH_PARALLELISM = int(os.getenv("BATCH_PARALLELISM", str(MAX_INFLIGHT_QUERIES)))
+
+NO_ANSWER = "I don't know. This information is not available in the documents."
+NOT_INITIALIZED = "Error: Vector database not initialized. Please ensure chroma_db exists and ingestion has been completed."
+
+
+def manifest_version():
+    """mtime of the ingestion manifest, or None if there is none"""
+    try:
+        return os.stat(MANIFEST_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
 
 class RAGSystem:
     def __init__(self):
-        # Load the persisted ChromaDB
-        try:
-            self.client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-            self.collection = self.client.get_collection(name="documind")
-            print(f"✓ ChromaDB loaded from {CHROMA_DB_PATH}")
-        except Exception as e:
-            print(f"⚠ Warning: Could not load ChromaDB: {e}")
-            self.client = None
-            self.collection = None
+        # Chroma, the models, the LLM client, the caches and the BM25 index
+        # are set up by load()/warm_up(), so importing this module stays cheap
+        self.client = None
+        self.collection = None
+        self.model = None
+        self.llm = None
+        self.embedding_cache = None
+        self.embed_batcher = None
+        self.retrieve_batcher = None
+        self.lexical_index = BM25Index()
+        self.retrieval_mode = RETRIEVAL_MODE
+        self.reranker = None
+        self.vector_store = None
+        self.ready = False
+        self.startup_timings = {}
+        self._load_lock = threading.Lock()
+        self._warmup = None
+        
+        # Encode + Chroma search run here so they never block the event loop;
+        # the scheduler bounds, orders and deduplicates concurrent generations
+        self.executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+        self.scheduler = GenerationScheduler(MAX_INFLIGHT_QUERIES, MAX_QUEUED_QUERIES)
         
-        # Load the same embedding model used during ingestion
+        # Answers are invalidated whenever ingestion rewrites its manifest
+        self.cache = SemanticCache(version_path=MANIFEST_PATH)
+        # Resolves metadata filters to chunk ids without scanning the collection
+        self.source_index = SourceIndex(MANIFEST_PATH)
+    
+    def load(self):
+        """
+        Open Chroma and load the models and BM25 index, recording how long
+        each step took in startup_timings. Safe to call repeatedly and from
+        several threads; only the first call does any work.
+        """
+        with self._load_lock:
+            if self.ready:
+                return
+            start = time.perf_counter()
+            
+            if self.llm is None:
+                self.llm = get_llm_client()
+                self.embedding_cache = get_embedding_cache(EMBEDDING_MODEL)
+                # Concurrent async queries share encoder passes and Chroma queries
+                self.embed_batcher = MicroBatcher(self.embed_queries, self.executor)
+                self.retrieve_batcher = MicroBatcher(self.retrieve_batch, self.executor)
+            
+            # Load the persisted ChromaDB
+            step = time.perf_counter()
+            try:
+                import chromadb
+                self.client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+                self.collection = self.client.get_collection(name=COLLECTION_NAME)
+                print(f"✓ ChromaDB loaded from {CHROMA_DB_PATH}")
+            except Exception as e:
+                print(f"⚠ Warning: Could not load ChromaDB: {e}")
+                self.client = None
+                self.collection = None
+            self.startup_timings["chroma"] = time.perf_counter() - step
+            
+            # Dense index searched in front of the collection (VECTOR_STORE)
+            if self.collection is not None:
+                step = time.perf_counter()
+                self.attach_collection(self.collection)
+                self.startup_timings["vector_store"] = time.perf_counter() - step
+            
+            # Load the same embedding model used during ingestion
+            step = time.perf_counter()
+            try:
+                self.model = get_embedding_model(EMBEDDING_MODEL)
+                if EMBEDDING_SERVICE_SOCKET:
+                    print(f"✓ Embedding service connected: {EMBEDDING_MODEL} at {EMBEDDING_SERVICE_SOCKET}")
+                else:
+                    print(f"✓ Embedding model loaded: {EMBEDDING_MODEL}")
+            except Exception as e:
+                print(f"✗ Error loading embedding model: {e}")
+                raise
+            self.startup_timings["embedding_model"] = time.perf_counter() - step
+            
+            # BM25 index built alongside the collection at ingestion time
+            step = time.perf_counter()
+            try:
+                self.lexical_index = BM25Index.load()
+                print(f"✓ Lexical index loaded: {len(self.lexical_index)} chunks")
+            except Exception as e:
+                print(f"⚠ Warning: Could not load lexical index: {e}")
+                self.lexical_index = BM25Index()
+            self.startup_timings["lexical_index"] = time.perf_counter() - step
+            
+            # Optional cross-encoder stage over an over-fetched candidate list
+            if RERANK_ENABLED:
+                step = time.perf_counter()
+                try:
+                    self.reranker = Reranker()
+                    print(f"✓ Reranker loaded: {self.reranker.model_name}")
+                except Exception as e:
+                    print(f"⚠ Warning: Could not load reranker, continuing without it: {e}")
+                self.startup_timings["reranker"] = time.perf_counter() - step
+            
+            self.startup_timings["total"] = time.perf_counter() - start
+            self.ready = True
+            print("✓ Warm-up finished: " + ", ".join(
+                f"{step} {seconds:.2f}s" for step, seconds in self.startup_timings.items()
+            ))
+    
+    def attach_collection(self, collection):
+        """Serve queries from collection through the configured vector store"""
         try:
-            self.model = SentenceTransformer(EMBEDDING_MODEL)
-            print(f"✓ Embedding model loaded: {EMBEDDING_MODEL}")
+            vector_store = open_vector_store(collection, version_fn=manifest_version)
+            if hasattr(vector_store, "open"):
+                vector_store.open()
+            if vector_store.name != "chroma":
+                print(f"✓ Vector store loaded: {vector_store.name}")
         except Exception as e:
-            print(f"✗ Error loading embedding model: {e}")
-            raise
+            print(f"⚠ Warning: Could not open vector store, falling back to Chroma: {e}")
+            vector_store = ChromaVectorStore(collection)
+        self.collection = collection
+        self.vector_store = vector_store
+    
+    async def warm_up(self):
+        """
+        Run load() on the thread pool. Concurrent callers share one warm-up;
+        a failed warm-up is retried by the next caller.
+        """
+        if self.ready:
+            return
+        if self._warmup is None or (self._warmup.done() and self._warmup.exception() is not None):
+            loop = asyncio.get_running_loop()
+            self._warmup = loop.run_in_executor(self.executor, self.load)
+        await asyncio.shield(self._warmup)
+    
+    def embed_query(self, question: str):
+        """Encode a question, reusing a cached embedding when available"""
+        return self.embedding_cache.encode([question], self.model, persist=False)[0]
+    
+    def encode_uncached(self, texts):
+        """Encode texts in one batched call, bypassing the embedding cache"""
+        return self.model.encode(texts, convert_to_numpy=True, show_progress_bar=False)
+    
+    def embed_queries(self, questions):
+        """Encode several questions in one batched encoder call"""
+        return list(self.embedding_cache.encode(questions, self.model, persist=False))
+    
+    def retrieve_batch(self, requests):
+        """
+        Retrieve chunks for (query_embedding, k, question, filters) requests.
+        
+        Dense retrieval is one multi-vector vector-store query per distinct
+        set of filters (usually one for the whole batch), with the filters
+        pushed down as a Chroma where clause or an allowed-id set. Its result is split into one single-query
+        result per request and, depending on retrieval_mode, fused with BM25
+        hits restricted to the same chunks.
+        """
+        mode = self.retrieval_mode
+        if mode != "dense":
+            try:
+                self.lexical_index.reload_if_changed()
+            except Exception as e:
+                print(f"⚠ Warning: Could not reload lexical index: {e}")
+            # Fall back to dense search until a lexical index has been built
+            if not len(self.lexical_index):
+                mode = "dense"
+        
+        if mode != "lexical":
+            self.vector_store.reload_if_changed()
+        
+        scopes = {}
+        for i, request in enumerate(requests):
+            scopes.setdefault(filters_key(request[3]), []).append(i)
+        if any(scopes):
+            self.source_index.refresh(self.collection)
+        
+        per_query = [None] * len(requests)
+        for indices in scopes.values():
+            where, allowed = self.source_index.resolve(requests[indices[0]][3])
+            
+            dense = None
+            if mode != "lexical":
+                n_results = max(requests[i][1] for i in indices)
+                if mode == "hybrid":
+                    n_results = max(n_results, HYBRID_CANDIDATES)
+                if allowed is not None:
+                    n_results = min(n_results, len(allowed))
+                if n_results:
+                    dense = self.vector_store.query([requests[i][0] for i in indices], n_results, where, allowed)
+                else:
+                    # Nothing matches the filters
+                    dense = {key: [[] for _ in indices] for key in RESULT_KEYS}
+            
+            for position, i in enumerate(indices):
+                _, k, question, _ = requests[i]
+                single = None
+                if dense is not None:
+                    single = {
+                        key: [dense[key][position]] if dense.get(key) is not None else None
+                        for key in RESULT_KEYS
+                    }
+                if mode == "dense":
+                    per_query[i] = {
+                        key: [value[0][:k]] if value is not None else None
+                        for key, value in single.items()
+                    }
+                else:
+                    per_query[i] = self._fuse(question, single, k, mode, allowed)
+        return per_query
     
-    def retrieve_context(self, question: str, k: int = None):
-        """Retrieve top-k relevant chunks from ChromaDB"""
+    def _fuse(self, question: str, dense, k: int, mode: str, allowed=None):
+        """
+        Rank chunks by BM25 alone (lexical) or by reciprocal-rank fusion of
+        BM25 and dense hits (hybrid), in Chroma's single-query result shape.
+        BM25 only considers chunk ids in allowed, if given.
+        """
+        lexical_ids = [
+            chunk_id for chunk_id, _ in self.lexical_index.search(
+                question, k if mode == "lexical" else max(k, HYBRID_CANDIDATES), allowed
+            )
+        ]
+        
+        known = {}
+        if dense is not None:
+            known = {
+                chunk_id: (document, metadata, distance)
+                for chunk_id, document, metadata, distance in zip(
+                    dense["ids"][0], dense["documents"][0], dense["metadatas"][0], dense["distances"][0]
+                )
+            }
+        
+        if mode == "lexical":
+            ranked = lexical_ids
+        else:
+            scores = {}
+            for ranking in (dense["ids"][0], lexical_ids):
+                for rank, chunk_id in enumerate(ranking):
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+            ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+        
+        # Lexical-only hits still need their text and metadata
+        missing = [chunk_id for chunk_id in ranked if chunk_id not in known]
+        if missing:
+            fetched = self.collection.get(ids=missing, include=["documents", "metadatas"])
+            for chunk_id, document, metadata in zip(fetched["ids"], fetched["documents"], fetched["metadatas"]):
+                known[chunk_id] = (document, metadata, None)
+        
+        ranked = [chunk_id for chunk_id in ranked if chunk_id in known]
+        return {
+            "ids": [ranked],
+            "documents": [[known[chunk_id][0] for chunk_id in ranked]],
+            "metadatas": [[known[chunk_id][1] for chunk_id in ranked]],
+            "distances": [[known[chunk_id][2] for chunk_id in ranked]]
+        }
+    
+    def candidate_k(self, k: int = None):
+        """Chunks to fetch from retrieval: over-fetch when reranking"""
+        k = k or TOP_K
+        return max(k, RERANK_CANDIDATES) if self.reranker else k
+    
+    def rerank_many(self, questions, results_list):
+        """Rerank retrieval results if a reranker is configured; returns (results, seconds)"""
+        if not self.reranker or not results_list:
+            return results_list, 0.0
+        start = time.perf_counter()
+        reranked = self.reranker.rerank_many(questions, results_list)
+        return reranked, time.perf_counter() - start
+    
+    def retrieve_context(self, question: str, k: int = None, query_embedding=None, filters=None):
+        """Retrieve top-k relevant chunks from ChromaDB (and the BM25 index)"""
+        self.load()
         if k is None:
             k = TOP_K
         
         # Generate query embedding
-        query_embedding = self.model.encode(question).tolist()
+        if query_embedding is None:
+            query_embedding = self.embed_query(question)
         
-        # Query ChromaDB for similar documents
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=k
-        )
-        
-        return results
+        return self.retrieve_batch([(query_embedding, k, question, normalize_filters(filters))])[0]
     
     def format_context(self, results):
-        """Format retrieved chunks into a single context string"""
+        """
+        Format retrieved chunks into a single context string: overlapping
+        chunks are merged, near-duplicates dropped and the result capped at
+        CONTEXT_TOKEN_BUDGET (see backend/context.py)
+        """
         if not results["documents"] or not results["documents"][0]:
             return ""
         
-        context_parts = []
-        documents = results["documents"][0]
-        metadatas = results["metadatas"][0]
+        context, _ = build_context(results)
+        return context
+    
+    def format_sources(self, results):
+        """Source/page/distance of each retrieved chunk, for clients"""
+        if not results["documents"] or not results["documents"][0]:
+            return []
+        
+        distances = (results.get("distances") or [[None] * len(results["documents"][0])])[0]
+        return [
+            {
+                "source": meta.get("source", "unknown"),
+                "page": meta.get("page", "unknown"),
+                "distance": distance
+            }
+            for meta, distance in zip(results["metadatas"][0], distances)
+        ]
+    
+    def search_hits(self, query_embedding, results, offset: int = 0):
+        """
+        Search hits for single-query retrieval results: chunk text, source,
+        page, rank, distance, rerank score and the cosine similarity of the
+        chunk to the query. The similarity comes from the distance the
+        vector store returned; only chunks found by BM25 alone have their
+        stored embeddings fetched, so nothing is re-encoded.
+        """
+        documents = (results.get("documents") or [[]])[0]
+        if not documents:
+            return []
         
-        for doc, meta in zip(documents, metadatas):
-            page = meta.get("page", "unknown")
-            context_parts.append(f"[Page {page}]\n{doc}")
+        count = len(documents)
+        ids = results["ids"][0]
+        distances = (results.get("distances") or [[None] * count])[0]
+        similarities = [None] * count
+        known = [i for i, distance in enumerate(distances) if distance is not None]
+        if known:
+            converted = distance_similarities(collection_space(self.collection), [distances[i] for i in known])
+            for i, similarity in zip(known, converted):
+                similarities[i] = similarity
+        missing = [i for i in range(count) if similarities[i] is None]
+        if missing:
+            stored = self.collection.get(ids=[ids[i] for i in missing], include=["embeddings"])
+            vectors = dict(zip(stored["ids"], stored["embeddings"]))
+            found = [i for i in missing if ids[i] in vectors]
+            if found:
+                computed = cosine_similarities(query_embedding, [vectors[ids[i]] for i in found])
+                for i, similarity in zip(found, computed):
+                    similarities[i] = similarity
         
-        return "\n\n".join(context_parts)
+        rerank_scores = (results.get("rerank_scores") or [[None] * count])[0]
+        return [
+            {
+                "id": chunk_id,
+                "text": document,
+                "source": meta.get("source", "unknown"),
+                "page": meta.get("page", "unknown"),
+                "rank": offset + i + 1,
+                "score": round(float(similarity), 4) if similarity is not None else None,
+                "distance": distance,
+                "rerank_score": rerank_score
+            }
+            for i, (chunk_id, document, meta, similarity, distance, rerank_score) in enumerate(zip(
+                ids, documents, results["metadatas"][0], similarities, distances, rerank_scores
+            ))
+        ]
     
-    def generate_answer(self, question: str, context: str):
-        """Generate answer using Ollama with strict prompt"""
-        # Strict prompt to prevent hallucinations
-        prompt = f"""You are a document assistant. Answer the question based ONLY on the provided context.
+    def extract_answer(self, query_embedding, results, timings=None, threshold: float = EXTRACTIVE_THRESHOLD):
+        """
+        Extractive fast path: the retrieved sentence span most similar to
+        the question, as (answer, similarity), or None when it falls short
+        of threshold and the LLM should answer instead.
+        
+        Spans are encoded with the model directly: they are one-off texts,
+        and the persistent embedding cache would keep every one forever.
+        """
+        start = time.perf_counter()
+        best = best_span(query_embedding, results, self.encode_uncached)
+        record_stage("extract", time.perf_counter() - start, timings)
+        if best is None or best[1] < threshold:
+            EXTRACTIVE_ANSWERS.inc(result="fallback")
+            return None
+        EXTRACTIVE_ANSWERS.inc(result="answered")
+        return best[0], best[1]
+    
+    async def aextract_answer(self, query_embedding, results, timings=None):
+        """extract_answer on the thread pool, keeping the event loop free"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, contextvars.copy_context().run, self.extract_answer, query_embedding, results, timings
+        )
+    
+    def build_prompt(self, question: str, context: str):
+        """Strict prompt to prevent hallucinations"""
+        return f"""You are a document assistant. Answer the question based ONLY on the provided context.
 
 Context:
 {context}
@@ -86,36 +447,551 @@ Instructions:
 - Do not make up information or use external knowledge
 
 Answer:"""
+    
+    @staticmethod
+    def record_generation_stats(response, timings=None):
+        """Record decode speed from Ollama's eval_count and eval_duration (ns)"""
+        tokens = response.get("eval_count") or 0
+        seconds = (response.get("eval_duration") or 0) / 1e9
+        record_generation(tokens, seconds, timings)
+    
+    def generate_answer(self, question: str, context: str, timings=None):
+        """Generate answer using Ollama with strict prompt"""
+        prompt = self.build_prompt(question, context)
+        
+        # Call the LLM (Ollama unless LLM_BACKEND says otherwise)
+        start = time.perf_counter()
+        response = self.llm.chat(
+            model=LLM_MODEL,
+            messages=[{
+                "role": "user",
+                "content": prompt
+            }]
+        )
+        record_stage("generate", time.perf_counter() - start, timings)
+        self.record_generation_stats(response, timings)
         
-        # Call Ollama LLM
-        response = ollama.chat(
+        return response["message"]["content"]
+    
+    async def agenerate_answer(self, question: str, context: str, timings=None):
+        """Generate answer with the async LLM client"""
+        prompt = self.build_prompt(question, context)
+        start = time.perf_counter()
+        response = await self.llm.achat(
             model=LLM_MODEL,
             messages=[{
                 "role": "user",
                 "content": prompt
             }]
         )
+        record_stage("generate", time.perf_counter() - start, timings)
+        self.record_generation_stats(response, timings)
         
         return response["message"]["content"]
     
-    def query(self, question: str):
-        """Full RAG pipeline: retrieve + generate"""
+    async def agenerate_scheduled(self, question: str, context: str, priority: str = "interactive",
+                                  deadline=None, queue_limit: bool = True, timings=None):
+        """
+        agenerate_answer through the generation scheduler: waits for a slot
+        in priority order and shares the generation with identical
+        in-flight prompts.
+        """
+        key = generation_key(LLM_MODEL, self.build_prompt(question, context))
+        return await self.scheduler.run(
+            key,
+            lambda generation_timings: self.agenerate_answer(question, context, generation_timings),
+            priority, deadline, queue_limit, timings
+        )
+    
+    def query(self, question: str, filters=None, extractive: bool = None):
+        """
+        Full RAG pipeline: retrieve + generate.
+        
+        With extractive (default EXTRACTIVE_ENABLED), a retrieved sentence
+        span similar enough to the question is returned as the answer
+        without calling the LLM. Extractive answers are not cached.
+        """
+        self.load()
         if not self.collection:
-            return "Error: Vector database not initialized. Please ensure chroma_db exists and ingestion has been completed."
+            return NOT_INITIALIZED
+        
+        filters = normalize_filters(filters)
+        scope = filters_key(filters)
+        cached = self.cache.get(question, scope)
+        if cached:
+            CACHE_LOOKUPS.inc(result="exact")
+            return cached["answer"]
         
-        # Step 1: Retrieve relevant context
-        results = self.retrieve_context(question)
+        start = time.perf_counter()
+        query_embedding = self.embed_query(question)
+        record_stage("embed", time.perf_counter() - start)
+        hit = self.cache.get_similar(query_embedding, scope)
+        if hit:
+            CACHE_LOOKUPS.inc(result="semantic")
+            return hit[0]["answer"]
+        CACHE_LOOKUPS.inc(result="miss")
+        
+        # Step 1: Retrieve relevant context (and rerank the candidates)
+        start = time.perf_counter()
+        results = self.retrieve_context(question, self.candidate_k(), query_embedding, filters)
+        record_stage("retrieve", time.perf_counter() - start)
+        results, rerank_seconds = self.rerank_many([question], [results])
+        results = results[0]
+        if self.reranker:
+            record_stage("rerank", rerank_seconds)
         
         # Step 2: Format context
+        start = time.perf_counter()
         context = self.format_context(results)
+        record_stage("format", time.perf_counter() - start)
         
         # Step 3: Generate answer (or return fallback if no context)
         if not context:
-            return "I don't know. This information is not available in the documents."
-        
-        answer = self.generate_answer(question, context)
+            answer = NO_ANSWER
+        else:
+            if EXTRACTIVE_ENABLED if extractive is None else extractive:
+                extracted = self.extract_answer(query_embedding, results)
+                if extracted:
+                    return extracted[0]
+            answer = self.generate_answer(question, context)
         
+        self.cache.put(question, query_embedding, answer, self.format_sources(results), scope)
         return answer
+    
+    async def _prepare(self, question: str, k: int = None, filters=None):
+        """
+        Cache lookups and retrieval for the async pipelines.
+        
+        Tries the exact cache, then embeds the question (micro-batched with
+        concurrent callers) for a semantic cache lookup, then runs a
+        micro-batched Chroma search and the optional rerank. Returns a dict
+        with the cache entry, cache type and similarity on a hit, or the
+        retrieval results and cache scope, plus the stage timings so far.
+        """
+        filters = normalize_filters(filters)
+        scope = filters_key(filters)
+        timings = {}
+        cached = self.cache.get(question, scope)
+        if cached:
+            CACHE_LOOKUPS.inc(result="exact")
+            return {"entry": cached, "cached": "exact", "similarity": 1.0, "timings": timings}
+        
+        start = time.perf_counter()
+        query_embedding = await self.embed_batcher.submit(question)
+        record_stage("embed", time.perf_counter() - start, timings)
+        hit = self.cache.get_similar(query_embedding, scope)
+        if hit:
+            CACHE_LOOKUPS.inc(result="semantic")
+            return {"entry": hit[0], "cached": "semantic", "similarity": hit[1], "timings": timings}
+        CACHE_LOOKUPS.inc(result="miss")
+        
+        start = time.perf_counter()
+        results = await self.retrieve_batcher.submit((query_embedding, self.candidate_k(k), question, filters))
+        record_stage("retrieve", time.perf_counter() - start, timings)
+        
+        if self.reranker:
+            loop = asyncio.get_running_loop()
+            reranked, rerank_seconds = await loop.run_in_executor(
+                self.executor, self.rerank_many, [question], [results]
+            )
+            record_stage("rerank", rerank_seconds, timings)
+            results = reranked[0]
+        return {"entry": None, "embedding": query_embedding, "results": results, "timings": timings, "scope": scope}
+    
+    def prepare_batch(self, questions, k: int = None, filters=None):
+        """
+        Cache lookups plus one batched encode and one multi-vector Chroma
+        query for a list of questions sharing the same filters.
+        
+        Returns (prepared, timings): one dict per question shaped like
+        _prepare's result, and the seconds spent embedding, retrieving and
+        reranking.
+        """
+        k = self.candidate_k(k)
+        filters = normalize_filters(filters)
+        scope = filters_key(filters)
+        prepared = [None] * len(questions)
+        timings = {"embed": 0.0, "retrieve": 0.0}
+        
+        pending = []
+        for i, question in enumerate(questions):
+            cached = self.cache.get(question, scope)
+            if cached:
+                CACHE_LOOKUPS.inc(result="exact")
+                prepared[i] = {"entry": cached, "cached": "exact", "similarity": 1.0}
+            else:
+                pending.append(i)
+        
+        start = time.perf_counter()
+        embeddings = self.embed_queries([questions[i] for i in pending]) if pending else []
+        record_stage("embed", time.perf_counter() - start, timings)
+        
+        to_retrieve = []
+        for i, embedding in zip(pending, embeddings):
+            hit = self.cache.get_similar(embedding, scope)
+            if hit:
+                CACHE_LOOKUPS.inc(result="semantic")
+                prepared[i] = {"entry": hit[0], "cached": "semantic", "similarity": hit[1]}
+            else:
+                CACHE_LOOKUPS.inc(result="miss")
+                to_retrieve.append((i, embedding))
+        
+        start = time.perf_counter()
+        results = (
+            self.retrieve_batch([(embedding, k, questions[i], filters) for i, embedding in to_retrieve])
+            if to_retrieve else []
+        )
+        record_stage("retrieve", time.perf_counter() - start, timings)
+        
+        results, rerank_seconds = self.rerank_many([questions[i] for i, _ in to_retrieve], results)
+        if self.reranker:
+            record_stage("rerank", rerank_seconds, timings)
+        
+        for (i, embedding), result in zip(to_retrieve, results):
+            prepared[i] = {"entry": None, "embedding": embedding, "results": result, "scope": scope}
+        
+        return prepared, timings
+    
+    @staticmethod
+    def _round_timings(timings):
+        return {key: round(value, 4) for key, value in timings.items()} or None
+    
+    def _batch_item(self, question, prepared, answer=None, generate_seconds=0.0, error=None):
+        """Per-question entry of a batch response"""
+        entry = prepared["entry"]
+        if entry:
+            return {
+                "question": question,
+                "answer": entry["answer"],
+                "sources": entry["sources"],
+                "cached": prepared["cached"],
+                "similarity": prepared["similarity"],
+                "timings": {"generate": 0.0}
+            }
+        return {
+            "question": question,
+            "answer": answer,
+            "sources": self.format_sources(prepared["results"]),
+            "error": error,
+            "timings": {"generate": round(generate_seconds, 4)}
+        }
+    
+    def query_batch(self, questions, parallelism: int = None, filters=None):
+        """
+        Answer many questions with one batched retrieval and up to
+        `parallelism` concurrent Ollama generations.
+        """
+        self.load()
+        if not self.collection:
+            return {"results": [{"question": q, "answer": NOT_INITIALIZED} for q in questions], "timings": {}}
+        
+        start = time.perf_counter()
+        prepared, timings = self.prepare_batch(questions, filters=filters)
+        
+        def answer_one(i):
+            item = prepared[i]
+            if item["entry"]:
+                return self._batch_item(questions[i], item)
+            
+            generate_start = time.perf_counter()
+            context = self.format_context(item["results"])
+            try:
+                answer = self.generate_answer(questions[i], context) if context else NO_ANSWER
+            except Exception as e:
+                return self._batch_item(questions[i], item, error=str(e))
+            
+            self.cache.put(questions[i], item["embedding"], answer, self.format_sources(item["results"]), item["scope"])
+            return self._batch_item(questions[i], item, answer, time.perf_counter() - generate_start)
+        
+        generate_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=parallelism or BATCH_PARALLELISM) as pool:
+            results = list(pool.map(answer_one, range(len(questions))))
+        timings["generate"] = time.perf_counter() - generate_start
+        timings["total"] = time.perf_counter() - start
+        
+        return {"results": results, "timings": self._round_timings(timings) or {}}
+    
+    async def aquery_batch(self, questions, parallelism: int = None, filters=None,
+                           priority: str = "batch", deadline=None):
+        """
+        Async query_batch for the API server.
+        
+        Retrieval for the whole batch runs as one call on the thread pool.
+        Generations use the shared MAX_INFLIGHT_QUERIES slots, at most
+        `parallelism` at a time for this batch, and wait for a slot rather
+        than failing with QueryQueueFull. Batch priority lets interactive
+        queries go first; questions still unanswered at the deadline get
+        an error entry.
+        """
+        await self.warm_up()
+        if not self.collection:
+            return {"results": [{"question": q, "answer": NOT_INITIALIZED} for q in questions], "timings": {}}
+        
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        # copy_context keeps the stage timings attached to this request's log line
+        prepared, timings = await loop.run_in_executor(
+            self.executor, contextvars.copy_context().run, self.prepare_batch, questions, None, filters
+        )
+        batch_slots = asyncio.Semaphore(parallelism or BATCH_PARALLELISM)
+        
+        async def answer_one(i):
+            item = prepared[i]
+            if item["entry"]:
+                return self._batch_item(questions[i], item)
+            
+            context = self.format_context(item["results"])
+            item_timings = {}
+            if not context:
+                answer = NO_ANSWER
+            else:
+                async with batch_slots:
+                    try:
+                        answer = await self.agenerate_scheduled(
+                            questions[i], context, priority, deadline, queue_limit=False, timings=item_timings
+                        )
+                    except Exception as e:
+                        return self._batch_item(questions[i], item, error=str(e) or type(e).__name__)
+            
+            self.cache.put(questions[i], item["embedding"], answer, self.format_sources(item["results"]), item["scope"])
+            return self._batch_item(questions[i], item, answer, item_timings.get("generate", 0.0))
+        
+        generate_start = time.perf_counter()
+        results = await asyncio.gather(*(answer_one(i) for i in range(len(questions))))
+        timings["generate"] = time.perf_counter() - generate_start
+        timings["total"] = time.perf_counter() - start
+        
+        return {"results": results, "timings": self._round_timings(timings) or {}}
+    
+    async def asearch(self, query: str, limit: int = 10, offset: int = 0, filters=None):
+        """
+        Retrieval without generation, for the /search endpoint.
+        
+        Ranks chunks as a query would (including the optional rerank) and
+        returns hits offset..offset+limit with search_hits() fields, the
+        offset of the next page (None on the last one) and stage timings.
+        Returns None if the vector database is not initialized.
+        """
+        await self.warm_up()
+        if not self.collection:
+            return None
+        
+        filters = normalize_filters(filters)
+        timings = {}
+        start = time.perf_counter()
+        step = time.perf_counter()
+        query_embedding = await self.embed_batcher.submit(query)
+        record_stage("embed", time.perf_counter() - step, timings)
+        
+        # One hit past the page tells whether there is a next one
+        k = offset + limit + 1
+        step = time.perf_counter()
+        results = await self.retrieve_batcher.submit(
+            (query_embedding, max(k, RERANK_CANDIDATES) if self.reranker else k, query, filters)
+        )
+        record_stage("retrieve", time.perf_counter() - step, timings)
+        
+        loop = asyncio.get_running_loop()
+        if self.reranker:
+            step = time.perf_counter()
+            reranked = await loop.run_in_executor(self.executor, self.reranker.rerank_many, [query], [results], k)
+            record_stage("rerank", time.perf_counter() - step, timings)
+            results = reranked[0]
+        
+        found = len(results["ids"][0])
+        page = {
+            key: [value[0][offset:offset + limit]] if value is not None else None
+            for key, value in results.items()
+        }
+        step = time.perf_counter()
+        hits = await loop.run_in_executor(self.executor, self.search_hits, query_embedding, page, offset)
+        record_stage("score", time.perf_counter() - step, timings)
+        timings["total"] = time.perf_counter() - start
+        
+        return {
+            "results": hits,
+            "next_offset": offset + limit if found > offset + limit else None,
+            "timings": self._round_timings(timings)
+        }
+    
+    async def acquire_slot(self, queue_limit: bool = True, priority: str = "interactive", deadline=None):
+        """
+        Wait for one of the MAX_INFLIGHT_QUERIES generation slots.
+        
+        Raises QueryQueueFull instead of waiting once MAX_QUEUED_QUERIES
+        callers are already in line, unless queue_limit is False, and
+        DeadlineExceeded if the deadline passes first.
+        """
+        await self.scheduler.acquire(priority, deadline, queue_limit)
+    
+    def release_slot(self):
+        self.scheduler.release()
+    
+    def slot_usage(self):
+        """(generations running, generations waiting for a slot)"""
+        return self.scheduler.usage()
+    
+    async def aquery(self, question: str, filters=None, priority: str = "interactive", deadline=None,
+                     extractive: bool = None):
+        """
+        Async RAG pipeline for the API server.
+        
+        Retrieval runs on the thread pool and generation on the async
+        Ollama client, so the event loop stays responsive. Only generation
+        holds one of the MAX_INFLIGHT_QUERIES slots, and concurrent
+        identical prompts share one generation. deadline is a
+        time.monotonic() value; DeadlineExceeded is raised once it passes.
+        extractive works as in query(). Returns a dict with the answer,
+        stage timings and, on a cache hit, the cache type and similarity,
+        or on an extractive answer its similarity as confidence.
+        """
+        await self.warm_up()
+        if not self.collection:
+            return {"answer": NOT_INITIALIZED}
+        
+        start = time.perf_counter()
+        prepared = await self._prepare(question, filters=filters)
+        timings = prepared["timings"]
+        entry = prepared["entry"]
+        if entry:
+            timings["total"] = time.perf_counter() - start
+            return {
+                "answer": entry["answer"],
+                "cached": prepared["cached"],
+                "similarity": prepared["similarity"],
+                "timings": self._round_timings(timings)
+            }
+        
+        results = prepared["results"]
+        step = time.perf_counter()
+        context = self.format_context(results)
+        record_stage("format", time.perf_counter() - step, timings)
+        
+        if not context:
+            answer = NO_ANSWER
+        else:
+            if EXTRACTIVE_ENABLED if extractive is None else extractive:
+                extracted = await self.aextract_answer(prepared["embedding"], results, timings)
+                if extracted:
+                    timings["total"] = time.perf_counter() - start
+                    return {
+                        "answer": extracted[0],
+                        "extractive": True,
+                        "confidence": round(extracted[1], 4),
+                        "timings": self._round_timings(timings)
+                    }
+            time_left(deadline)
+            answer = await self.agenerate_scheduled(question, context, priority, deadline, timings=timings)
+        
+        self.cache.put(question, prepared["embedding"], answer, self.format_sources(results), prepared["scope"])
+        timings["total"] = time.perf_counter() - start
+        return {"answer": answer, "timings": self._round_timings(timings)}
+    
+    async def astream_query(self, question: str, filters=None, priority: str = "interactive", deadline=None,
+                            extractive: bool = None):
+        """
+        Streaming RAG pipeline yielding (event, data) pairs.
+        
+        Emits ("sources", [...]) as soon as retrieval finishes, so they can
+        be shown while the query waits for a generation slot, then one
+        ("token", text) per Ollama stream chunk, then ("done", {"answer":
+        ..., "timings": {...}}). A full queue raises QueryQueueFull before
+        the sources; once they are out, QueryQueueFull or DeadlineExceeded
+        can still be raised while waiting for the slot. A cached answer
+        is emitted as a single token. The slot is held until the stream is
+        exhausted or closed. Like a cached answer, an extractive answer
+        (see query()) is a single token. Streams are not shared between callers, and
+        the deadline only bounds the wait for a slot: once tokens flow the
+        client can see progress and close the stream itself.
+        """
+        await self.warm_up()
+        if not self.collection:
+            yield "token", NOT_INITIALIZED
+            yield "done", {"answer": NOT_INITIALIZED}
+            return
+        
+        start = time.perf_counter()
+        prepared = await self._prepare(question, filters=filters)
+        timings = prepared["timings"]
+        entry = prepared["entry"]
+        if entry:
+            timings["total"] = time.perf_counter() - start
+            yield "sources", entry["sources"]
+            yield "token", entry["answer"]
+            yield "done", {
+                "answer": entry["answer"],
+                "cached": prepared["cached"],
+                "similarity": prepared["similarity"],
+                "timings": self._round_timings(timings)
+            }
+            return
+        
+        results = prepared["results"]
+        query_embedding = prepared["embedding"]
+        scope = prepared["scope"]
+        sources = self.format_sources(results)
+        step = time.perf_counter()
+        context = self.format_context(results)
+        record_stage("format", time.perf_counter() - step, timings)
+        
+        if not context:
+            self.cache.put(question, query_embedding, NO_ANSWER, sources, scope)
+            timings["total"] = time.perf_counter() - start
+            yield "sources", sources
+            yield "token", NO_ANSWER
+            yield "done", {"answer": NO_ANSWER, "timings": self._round_timings(timings)}
+            return
+        
+        if EXTRACTIVE_ENABLED if extractive is None else extractive:
+            extracted = await self.aextract_answer(query_embedding, results, timings)
+            if extracted:
+                timings["total"] = time.perf_counter() - start
+                yield "sources", sources
+                yield "token", extracted[0]
+                yield "done", {
+                    "answer": extracted[0],
+                    "extractive": True,
+                    "confidence": round(extracted[1], 4),
+                    "timings": self._round_timings(timings)
+                }
+                return
+        
+        # Turn a full queue away while the client can still get a 429
+        self.scheduler.check_queue()
+        yield "sources", sources
+        
+        step = time.perf_counter()
+        await self.acquire_slot(priority=priority, deadline=deadline)
+        record_stage("queue", time.perf_counter() - step, timings)
+        try:
+            step = time.perf_counter()
+            stream = self.llm.astream(
+                model=LLM_MODEL,
+                messages=[{
+                    "role": "user",
+                    "content": self.build_prompt(question, context)
+                }]
+            )
+            
+            answer_parts = []
+            async for part in stream:
+                token = part["message"]["content"]
+                if token:
+                    if not answer_parts:
+                        record_stage("first_token", time.perf_counter() - step, timings)
+                    answer_parts.append(token)
+                    yield "token", token
+                if part.get("done"):
+                    # Only the final chunk carries eval_count / eval_duration
+                    self.record_generation_stats(part, timings)
+            record_stage("generate", time.perf_counter() - step, timings)
+            
+            answer = "".join(answer_parts)
+            self.cache.put(question, query_embedding, answer, sources, scope)
+            timings["total"] = time.perf_counter() - start
+            yield "done", {"answer": answer, "timings": self._round_timings(timings)}
+        finally:
+            self.release_slot()
 
 
 # Singleton instance
@@ -0,0 +1,64 @@
+import os
+from dotenv import load_dotenv
+
+import numpy as np
+
+from backend.models import get_cross_encoder
+
+# Load environment variables
+load_dotenv()
+
+# Configuration from environment variables with defaults
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Chunks fetched from retrieval and scored by the cross-encoder
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "50"))
+# Chunks kept after reranking and passed to the LLM
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "3"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+
+RESULT_KEYS = ("ids", "documents", "metadatas", "distances")
+
+
+class Reranker:
+    """Scores (question, chunk) pairs with a small CPU cross-encoder"""
+
+    def __init__(self, model_name=RERANK_MODEL, top_n=RERANK_TOP_N, batch_size=RERANK_BATCH_SIZE):
+        self.model_name = model_name
+        self.top_n = top_n
+        self.batch_size = batch_size
+        self.model = get_cross_encoder(model_name)
+
+    def rerank_many(self, questions, results_list, top_n: int = None):
+        """
+        Rerank several single-query retrieval results with one batched
+        predict() call and keep the top_n chunks of each, best first.
+        Kept chunks carry their cross-encoder score in "rerank_scores".
+        """
+        top_n = top_n or self.top_n
+        pairs, spans = [], []
+        for question, results in zip(questions, results_list):
+            documents = results["documents"][0]
+            spans.append((len(pairs), len(documents)))
+            pairs.extend((question, document) for document in documents)
+
+        scores = np.asarray(
+            self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+            if pairs else [],
+            dtype=np.float32
+        )
+
+        reranked = []
+        for (start, count), results in zip(spans, results_list):
+            chunk_scores = scores[start:start + count]
+            order = np.argsort(-chunk_scores, kind="stable")[:top_n]
+            ranked = {
+                key: [[results[key][0][i] for i in order]] if results.get(key) is not None else None
+                for key in RESULT_KEYS
+            }
+            ranked["rerank_scores"] = [[float(chunk_scores[i]) for i in order]]
+            reranked.append(ranked)
+        return reranked
+
+    def rerank(self, question: str, results, top_n: int = None):
+        return self.rerank_many([question], [results], top_n)[0]
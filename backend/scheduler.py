@@ -0,0 +1,211 @@
+import os
+import time
+import heapq
+import asyncio
+import hashlib
+import itertools
+import contextvars
+from dotenv import load_dotenv
+
+from backend.metrics import GENERATIONS_CANCELLED, GENERATIONS_SHARED, merge_timings, record_stage
+
+# Load environment variables
+load_dotenv()
+
+# Configuration from environment variables with defaults
+# Identical in-flight prompts share one generation instead of each running their own
+GENERATION_DEDUP = os.getenv("GENERATION_DEDUP", "true").lower() == "true"
+
+# Waiting generations are served by class first, then earliest deadline
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+
+class QueryQueueFull(Exception):
+    """Raised when more queries are waiting than MAX_QUEUED_QUERIES allows"""
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a query's deadline passes before its answer is ready"""
+
+
+def generation_key(model: str, prompt: str):
+    """Identity of a generation: the same model and prompt give the same answer"""
+    return hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+def time_left(deadline):
+    """Seconds left until a time.monotonic() deadline (None for no deadline)"""
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("Deadline passed before generation finished")
+    return remaining
+
+
+class _Generation:
+    """A generation task and the callers waiting for its answer"""
+
+    def __init__(self, priority, deadline):
+        self.priority = priority
+        self.deadline = deadline
+        self.subscribers = 0
+        self.timings = {}
+        self.waiter = None
+        self.task = None
+
+
+class GenerationScheduler:
+    """
+    Hands out a fixed number of generation slots to waiting callers.
+
+    Waiters are ordered by priority class ("interactive" before "batch"),
+    then by earliest deadline, then by arrival. run() additionally
+    coalesces calls with the same key into one generation task shared by
+    all of them; the task is cancelled as soon as its last caller gives up
+    (deadline passed or client disconnected), which frees the slot and
+    aborts the LLM request. Must be used from one event loop.
+    """
+
+    def __init__(self, slots: int, max_queued: int, dedup: bool = GENERATION_DEDUP):
+        self.slots = max(1, slots)
+        self.max_queued = max_queued
+        self.dedup = dedup
+        self._running = 0
+        self._waiting = 0
+        self._queue = []
+        self._order = itertools.count()
+        self._inflight = {}
+
+    def usage(self):
+        """(generations running, generations waiting for a slot)"""
+        return self._running, self._waiting
+
+    def check_queue(self):
+        if self._running >= self.slots and self._waiting >= self.max_queued:
+            raise QueryQueueFull(f"{self._waiting} queries already waiting")
+
+    def _push(self, future, priority, deadline):
+        entry = (PRIORITIES[priority], float("inf") if deadline is None else deadline, next(self._order), future)
+        heapq.heappush(self._queue, entry)
+
+    async def acquire(self, priority: str = "interactive", deadline=None, queue_limit: bool = True, generation=None):
+        """
+        Wait for a generation slot.
+
+        Raises QueryQueueFull instead of waiting once max_queued callers
+        are already in line (unless queue_limit is False), and
+        DeadlineExceeded if deadline passes first. A shared generation
+        waits without a deadline of its own but is queued by its callers'
+        earliest one (its callers time out individually).
+        """
+        if self._running < self.slots and not self._waiting:
+            self._running += 1
+            return
+        if queue_limit:
+            self.check_queue()
+
+        future = asyncio.get_running_loop().create_future()
+        self._push(future, priority, deadline if generation is None else generation.deadline)
+        self._waiting += 1
+        if generation is not None:
+            generation.waiter = future
+        try:
+            await asyncio.wait_for(future, time_left(deadline))
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # Granted just as the caller gave up: pass the slot on
+                self.release()
+            else:
+                future.cancel()
+                self._waiting -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                raise DeadlineExceeded("Deadline passed while waiting for a generation slot") from None
+            raise
+        finally:
+            if generation is not None:
+                generation.waiter = None
+
+    def release(self):
+        """Give the slot to the next live waiter, or free it"""
+        while self._queue:
+            future = heapq.heappop(self._queue)[-1]
+            # Entries of waiters that gave up, or were re-queued with a higher priority
+            if future.done():
+                continue
+            future.set_result(None)
+            self._waiting -= 1
+            return
+        self._running -= 1
+
+    async def run(self, key, generate, priority: str = "interactive", deadline=None,
+                  queue_limit: bool = True, timings=None):
+        """
+        Await generate(timings) holding a slot, sharing the generation with
+        concurrent calls for the same key (None never shares).
+
+        The queue wait and the stages generate records are added to
+        timings for every caller. Raises DeadlineExceeded once deadline
+        passes; the generation carries on only while other callers still
+        want it.
+        """
+        generation = self._inflight.get(key) if self.dedup and key is not None else None
+        if generation is None:
+            if queue_limit:
+                self.check_queue()
+            generation = _Generation(priority, deadline)
+            # A fresh context keeps the shared task's stages out of the first
+            # caller's request log; each caller merges them in below
+            generation.task = contextvars.Context().run(asyncio.ensure_future, self._generate(generation, generate))
+            generation.task.add_done_callback(lambda task: self._finished(key, generation))
+            if self.dedup and key is not None:
+                self._inflight[key] = generation
+        else:
+            GENERATIONS_SHARED.inc()
+            self._promote(generation, priority, deadline)
+
+        generation.subscribers += 1
+        try:
+            result = await asyncio.wait_for(asyncio.shield(generation.task), time_left(deadline))
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("Deadline passed before generation finished") from None
+        finally:
+            generation.subscribers -= 1
+            if not generation.subscribers and not generation.task.done():
+                GENERATIONS_CANCELLED.inc()
+                self._finished(key, generation)
+                generation.task.cancel()
+
+        merge_timings(generation.timings, timings)
+        return result
+
+    async def _generate(self, generation, generate):
+        start = time.perf_counter()
+        await self.acquire(generation.priority, queue_limit=False, generation=generation)
+        record_stage("queue", time.perf_counter() - start, generation.timings)
+        try:
+            return await generate(generation.timings)
+        finally:
+            self.release()
+
+    def _promote(self, generation, priority, deadline):
+        """Move a shared generation up the queue for a more urgent caller"""
+        more_urgent = PRIORITIES[priority] < PRIORITIES[generation.priority]
+        earlier = deadline is not None and (generation.deadline is None or deadline < generation.deadline)
+        if not (more_urgent or earlier):
+            return
+        if more_urgent:
+            generation.priority = priority
+        if earlier:
+            generation.deadline = deadline
+        if generation.waiter is not None and not generation.waiter.done():
+            # The old entry stays in the heap and is skipped once this one is served
+            self._push(generation.waiter, generation.priority, generation.deadline)
+
+    def _finished(self, key, generation):
+        if self._inflight.get(key) is generation:
+            del self._inflight[key]
+        task = generation.task
+        # Retrieve the exception so a failure nobody waited for is not logged as unhandled
+        if task.done() and not task.cancelled():
+            task.exception()
@@ -1,9 +1,101 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Union
 from pydantic import BaseModel
 
 
+class QueryFilters(BaseModel):
+    sources: Optional[List[str]] = None
+    page_from: Optional[int] = None
+    page_to: Optional[int] = None
+    ingested_after: Optional[datetime] = None
+    ingested_before: Optional[datetime] = None
+
+
 class QueryRequest(BaseModel):
     question: str
+    filters: Optional[QueryFilters] = None
+    # "interactive" or "batch"; batch queries wait while interactive ones are queued
+    priority: str = "interactive"
+    # Give up (504) if no answer within this many milliseconds
+    timeout_ms: Optional[int] = None
+    # Answer with a retrieved sentence span when confident (default EXTRACTIVE_ENABLED)
+    extractive: Optional[bool] = None
 
 
 class QueryResponse(BaseModel):
     answer: str
+    cached: Optional[str] = None
+    similarity: Optional[float] = None
+    extractive: Optional[bool] = None
+    confidence: Optional[float] = None
+    timings: Optional[Dict[str, float]] = None
+
+
+class Source(BaseModel):
+    source: str
+    page: Union[int, str]
+    distance: Optional[float] = None
+
+
+class BatchQueryRequest(BaseModel):
+    questions: List[str]
+    parallelism: Optional[int] = None
+    filters: Optional[QueryFilters] = None
+    priority: str = "batch"
+    timeout_ms: Optional[int] = None
+
+
+class BatchQueryResult(BaseModel):
+    question: str
+    answer: Optional[str] = None
+    sources: List[Source] = []
+    cached: Optional[str] = None
+    similarity: Optional[float] = None
+    error: Optional[str] = None
+    timings: Dict[str, float] = {}
+
+
+class BatchQueryResponse(BaseModel):
+    results: List[BatchQueryResult]
+    timings: Dict[str, float] = {}
+
+
+class SearchRequest(BaseModel):
+    query: str
+    limit: int = 10
+    offset: int = 0
+    filters: Optional[QueryFilters] = None
+
+
+class SearchHit(BaseModel):
+    id: str
+    text: str
+    source: str
+    page: Union[int, str]
+    rank: int
+    score: Optional[float] = None
+    distance: Optional[float] = None
+    rerank_score: Optional[float] = None
+
+
+class SearchResponse(BaseModel):
+    query: str
+    offset: int
+    limit: int
+    next_offset: Optional[int] = None
+    results: List[SearchHit]
+    timings: Dict[str, float] = {}
+
+
+class JobStatus(BaseModel):
+    id: str
+    filename: str
+    status: str
+    stage: Optional[str] = None
+    progress: Dict[str, int] = {}
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    queue_seconds: Optional[float] = None
+    run_seconds: Optional[float] = None
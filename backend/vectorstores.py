@@ -0,0 +1,531 @@
+import os
+import json
+import time
+import argparse
+import threading
+from dotenv import load_dotenv
+
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:  # optional: only needed for VECTOR_STORE=hnsw
+    hnswlib = None
+
+from backend.quantized import QuantizedStoreRefresher, collection_space, space_distances
+
+# Load environment variables
+load_dotenv()
+
+# Path configuration
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.join(BASE_DIR, "..")
+
+# Configuration from environment variables with defaults
+# chroma (Chroma's HNSW index), hnsw (in-process hnswlib index with tunable
+# parameters) or quantized (memory-mapped int8/float16 copy)
+VECTOR_STORE = os.getenv("VECTOR_STORE", "chroma")
+HNSW_INDEX_PATH = os.path.join(
+    PROJECT_ROOT,
+    os.getenv("HNSW_INDEX_PATH", os.path.join(os.getenv("CHROMA_DB_PATH", "chroma_db"), "hnsw"))
+)
+# Graph degree and build-time candidate list: higher = better recall, slower build
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+# Search-time candidate list: the main recall/latency knob
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+# Filtered searches over at most this many chunks are answered exactly
+HNSW_BRUTE_FORCE_LIMIT = int(os.getenv("HNSW_BRUTE_FORCE_LIMIT", "10000"))
+
+RESULT_KEYS = ("ids", "documents", "metadatas", "distances")
+
+
+class VectorStore:
+    """
+    Nearest-neighbour search over chunk embeddings, shared by ingestion and
+    serving.
+
+    The Chroma collection stays the record of chunk texts, metadata and
+    embeddings for every backend: writes go to it first and then to the
+    backend's own index, and search hits are resolved to documents by id.
+    Subclasses implement search() and, when they keep their own index,
+    the _index_* hooks, save() and reload_if_changed().
+    """
+
+    name = None
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def add(self, ids, embeddings, documents, metadatas):
+        """Upsert chunks with their embeddings"""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        self.collection.upsert(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings.tolist())
+        self._index_add(ids, embeddings)
+
+    def delete(self, ids):
+        if ids:
+            self.collection.delete(ids=ids)
+            self._index_delete(ids)
+
+    def clear(self, batch_size=1000):
+        """Delete every chunk without dropping the collection"""
+        while True:
+            ids = self.collection.get(limit=batch_size, include=[])["ids"]
+            if not ids:
+                break
+            self.collection.delete(ids=ids)
+        self._index_clear()
+
+    def count(self):
+        return self.collection.count()
+
+    def _index_add(self, ids, embeddings):
+        pass
+
+    def _index_delete(self, ids):
+        pass
+
+    def _index_clear(self):
+        pass
+
+    def save(self):
+        """Persist the backend's own index, if it has one"""
+
+    def reload_if_changed(self):
+        """Pick up an index saved by another process (e.g. a CLI ingestion run)"""
+
+    def search(self, embeddings, k: int, allowed=None):
+        """Top-k (ids, distances) per query row, nearest first, optionally only among allowed ids"""
+        raise NotImplementedError
+
+    def query(self, embeddings, n_results: int, where=None, allowed=None):
+        """
+        Multi-query search in Chroma's result shape. where is Chroma's
+        metadata filter; other backends filter through the equivalent set
+        of allowed chunk ids instead.
+        """
+        ids, distances = self.search(np.stack(embeddings), n_results, allowed)
+        wanted = sorted({chunk_id for row in ids for chunk_id in row})
+        known = {}
+        if wanted:
+            fetched = self.collection.get(ids=wanted, include=["documents", "metadatas"])
+            known = {
+                chunk_id: (document, metadata)
+                for chunk_id, document, metadata in zip(fetched["ids"], fetched["documents"], fetched["metadatas"])
+            }
+
+        result = {key: [] for key in RESULT_KEYS}
+        for row_ids, row_distances in zip(ids, distances):
+            # Chunks deleted from Chroma but still in a stale index are skipped
+            hits = [(chunk_id, distance) for chunk_id, distance in zip(row_ids, row_distances) if chunk_id in known]
+            result["ids"].append([chunk_id for chunk_id, _ in hits])
+            result["documents"].append([known[chunk_id][0] for chunk_id, _ in hits])
+            result["metadatas"].append([known[chunk_id][1] for chunk_id, _ in hits])
+            result["distances"].append([distance for _, distance in hits])
+        return result
+
+
+class ChromaVectorStore(VectorStore):
+    """Chroma's own persistent HNSW index, with filters pushed into where"""
+
+    name = "chroma"
+
+    def query(self, embeddings, n_results: int, where=None, allowed=None):
+        return self.collection.query(
+            query_embeddings=[np.asarray(embedding).tolist() for embedding in embeddings],
+            n_results=n_results,
+            where=where
+        )
+
+    def search(self, embeddings, k: int, allowed=None):
+        if allowed is not None and not allowed:
+            return [[] for _ in embeddings], [[] for _ in embeddings]
+        results = self.collection.query(
+            query_embeddings=np.asarray(embeddings).tolist(),
+            ids=allowed.ids.tolist() if allowed is not None else None,
+            n_results=k,
+            include=["distances"]
+        )
+        return results["ids"], results["distances"]
+
+
+class QuantizedVectorStoreBackend(VectorStore):
+    """
+    Searches the memory-mapped int8/float16 store (backend/quantized.py).
+    Writes only go to Chroma; the store is rebuilt from it in the
+    background once the ingestion manifest changes.
+    """
+
+    name = "quantized"
+
+    def __init__(self, collection, version_fn=lambda: None):
+        super().__init__(collection)
+        self.refresher = QuantizedStoreRefresher(version_fn)
+
+    def open(self):
+        self.refresher.open(self.collection)
+
+    def search(self, embeddings, k: int, allowed=None):
+        store = self.refresher.current(self.collection) or self.refresher.open(self.collection)
+        return store.search(embeddings, k, allowed)
+
+
+class HNSWVectorStore(VectorStore):
+    """
+    In-process hnswlib graph index with configurable M, ef_construction and
+    ef_search.
+
+    Maintained incrementally by ingestion (deleted chunks are tombstoned and
+    their slots reused), persisted as generations of index files behind a
+    state.json written last, and rebuilt from the Chroma collection when no
+    index exists yet or its size disagrees with the collection. Filtered searches over few chunks are exact; larger
+    ones use hnswlib's filter callback.
+    """
+
+    name = "hnsw"
+
+    def __init__(self, collection, path=HNSW_INDEX_PATH, m=HNSW_M,
+                 ef_construction=HNSW_EF_CONSTRUCTION, ef_search=HNSW_EF_SEARCH):
+        if hnswlib is None:
+            raise ImportError("VECTOR_STORE=hnsw requires hnswlib (pip install hnswlib)")
+        super().__init__(collection)
+        self.path = path
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.space = collection_space(collection)
+        self.index = None
+        self.labels = {}
+        self.chunk_ids = {}
+        self.next_label = 0
+        self.generation = 0
+        self._dirty = False
+        self._version = None
+        self._lock = threading.RLock()
+
+        # Build (or resync) from Chroma if the collection changed without this index
+        self._load()
+        if len(self.labels) != collection.count():
+            self.rebuild()
+
+    @property
+    def state_path(self):
+        return os.path.join(self.path, "state.json")
+
+    def _current_version(self):
+        try:
+            return os.stat(self.state_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load(self):
+        with self._lock:
+            self.index, self.labels, self.chunk_ids, self.next_label = None, {}, {}, 0
+            self._version = self._current_version()
+            if self._version is None:
+                return
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            self.generation = state["generation"]
+            if state.get("index") is None:
+                return
+            with open(os.path.join(self.path, state["labels"]), "r", encoding="utf-8") as f:
+                self.labels = json.load(f)
+            self.chunk_ids = {label: chunk_id for chunk_id, label in self.labels.items()}
+            self.next_label = state["next_label"]
+            self.index = hnswlib.Index(space=self.space, dim=state["dim"])
+            self.index.load_index(os.path.join(self.path, state["index"]), allow_replace_deleted=True)
+            self.index.set_ef(self.ef_search)
+
+    def reload_if_changed(self):
+        with self._lock:
+            if not self._dirty and self._current_version() != self._version:
+                self._load()
+
+    def rebuild(self, batch_size=1000):
+        """Index every embedding in the collection from scratch"""
+        with self._lock:
+            self._index_clear()
+            offset = 0
+            while True:
+                batch = self.collection.get(limit=batch_size, offset=offset, include=["embeddings"])
+                if not batch["ids"]:
+                    break
+                self._index_add(batch["ids"], np.asarray(batch["embeddings"], dtype=np.float32))
+                offset += len(batch["ids"])
+            self.save()
+
+    def _index_add(self, ids, embeddings):
+        with self._lock:
+            if self.index is None:
+                self.index = hnswlib.Index(space=self.space, dim=embeddings.shape[1])
+                self.index.init_index(
+                    max_elements=max(1024, len(ids)), ef_construction=self.ef_construction,
+                    M=self.m, allow_replace_deleted=True
+                )
+                self.index.set_ef(self.ef_search)
+            # Re-added ids replace their previous vector
+            self._index_delete([chunk_id for chunk_id in ids if chunk_id in self.labels])
+
+            needed = self.index.get_current_count() + len(ids)
+            if needed > self.index.get_max_elements():
+                self.index.resize_index(max(needed, 2 * self.index.get_max_elements()))
+
+            labels = np.arange(self.next_label, self.next_label + len(ids))
+            self.next_label += len(ids)
+            self.index.add_items(embeddings, labels, replace_deleted=True)
+            for chunk_id, label in zip(ids, labels.tolist()):
+                self.labels[chunk_id] = label
+                self.chunk_ids[label] = chunk_id
+            self._dirty = True
+
+    def _index_delete(self, ids):
+        with self._lock:
+            for chunk_id in ids:
+                label = self.labels.pop(chunk_id, None)
+                if label is None:
+                    continue
+                del self.chunk_ids[label]
+                self.index.mark_deleted(label)
+                self._dirty = True
+
+    def _index_clear(self):
+        with self._lock:
+            self.index, self.labels, self.chunk_ids, self.next_label = None, {}, {}, 0
+            self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(self.path, exist_ok=True)
+            self.generation += 1
+            state = {"generation": self.generation, "index": None}
+            if self.index is not None:
+                state.update(
+                    index=f"index-{self.generation}.bin",
+                    labels=f"labels-{self.generation}.json",
+                    dim=self.index.dim,
+                    next_label=self.next_label,
+                    m=self.m,
+                    ef_construction=self.ef_construction
+                )
+                self.index.save_index(os.path.join(self.path, state["index"]))
+                with open(os.path.join(self.path, state["labels"]), "w", encoding="utf-8") as f:
+                    json.dump(self.labels, f)
+
+            tmp_path = self.state_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_path)
+            self._dirty = False
+            self._version = self._current_version()
+
+            current = {state["index"], state.get("labels")}
+            for name in os.listdir(self.path):
+                if name != "state.json" and name not in current:
+                    try:
+                        os.remove(os.path.join(self.path, name))
+                    except OSError:
+                        pass
+
+    def set_ef(self, ef_search: int):
+        with self._lock:
+            self.ef_search = ef_search
+            if self.index is not None:
+                self.index.set_ef(ef_search)
+
+    def _exact(self, queries, labels, k):
+        vectors = np.asarray(self.index.get_items(labels), dtype=np.float32)
+        distances = space_distances(
+            self.space, queries @ vectors.T, np.linalg.norm(vectors, axis=1)[None, :],
+            np.linalg.norm(queries, axis=1)[:, None]
+        )
+        order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        return labels[order], np.take_along_axis(distances, order, axis=1)
+
+    def _candidates(self, allowed):
+        """hnswlib labels of the allowed chunks, as an array and a set"""
+        labels = self.labels
+        candidates = np.array([labels[chunk_id] for chunk_id in allowed if chunk_id in labels], dtype=np.int64)
+        return candidates, set(candidates.tolist())
+
+    def search(self, embeddings, k: int, allowed=None):
+        queries = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        empty = [[] for _ in range(len(queries))], [[] for _ in range(len(queries))]
+        with self._lock:
+            if self.index is None or not self.labels:
+                return empty
+
+            if allowed is None:
+                k = min(k, len(self.labels))
+                try:
+                    labels, distances = self.index.knn_query(queries, k=k)
+                except RuntimeError:
+                    # Too few reachable neighbours (e.g. many tombstones): search exactly
+                    labels, distances = self._exact(queries, np.array(list(self.chunk_ids)), k)
+            else:
+                # Labels change with every add or delete, so they key the cached candidates
+                candidates, candidate_set = allowed.derive(
+                    self, self._candidates, state=(self.generation, self.next_label, len(self.labels))
+                )
+                if not len(candidates):
+                    return empty
+                k = min(k, len(candidates))
+                if len(candidates) <= HNSW_BRUTE_FORCE_LIMIT:
+                    labels, distances = self._exact(queries, candidates, k)
+                else:
+                    try:
+                        labels, distances = self.index.knn_query(
+                            queries, k=k, filter=lambda label: label in candidate_set
+                        )
+                    except RuntimeError:
+                        labels, distances = self._exact(queries, candidates, k)
+
+            ids = [[self.chunk_ids[int(label)] for label in row] for row in labels]
+        return ids, np.asarray(distances, dtype=float).tolist()
+
+
+def open_vector_store(collection, kind=VECTOR_STORE, version_fn=None):
+    """Vector store of the configured kind over a Chroma collection"""
+    if kind == "hnsw":
+        return HNSWVectorStore(collection)
+    if kind == "quantized":
+        return QuantizedVectorStoreBackend(collection, version_fn or (lambda: None))
+    if kind == "chroma":
+        return ChromaVectorStore(collection)
+    raise ValueError(f"Unknown VECTOR_STORE: {kind}")
+
+
+def load_embeddings(collection, batch_size=1000):
+    """All (ids, float32 embeddings) of a collection"""
+    ids, vectors = [], []
+    offset = 0
+    while True:
+        batch = collection.get(limit=batch_size, offset=offset, include=["embeddings"])
+        if not batch["ids"]:
+            break
+        ids.extend(batch["ids"])
+        vectors.append(np.asarray(batch["embeddings"], dtype=np.float32))
+        offset += len(batch["ids"])
+    return ids, np.concatenate(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
+
+
+def measure(search, queries, truth, k):
+    """Recall@k against exact neighbours and per-query latency of search(query) -> ids"""
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        found = search(query)
+        latencies.append(time.perf_counter() - start)
+        hits += len(set(found[:k]) & expected)
+    latencies = np.array(latencies) * 1000
+    return {
+        "recall": round(hits / (k * len(queries)), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "qps": round(len(queries) / (latencies.sum() / 1000), 1)
+    }
+
+
+def compare_backends(collection, queries, k=5, m_values=(HNSW_M,), ef_values=(HNSW_EF_SEARCH,),
+                     ef_construction=HNSW_EF_CONSTRUCTION, dtypes=("int8", "float16")):
+    """
+    Recall@k and latency of each backend and parameter setting against
+    exact float32 search over the collection's own embeddings. Indexes are
+    built in temporary directories; the serving indexes are not touched.
+    The hnsw rows are skipped when hnswlib is not installed.
+    """
+    import tempfile
+    from backend.quantized import QuantizedVectorStore
+
+    if hnswlib is None:
+        print("⚠ hnswlib is not installed (pip install hnswlib), skipping the hnsw rows")
+        m_values = ()
+
+    ids, vectors = load_embeddings(collection)
+    space = collection_space(collection)
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    exact = space_distances(
+        space, queries @ vectors.T, np.linalg.norm(vectors, axis=1)[None, :],
+        np.linalg.norm(queries, axis=1)[:, None]
+    )
+    truth = [{ids[i] for i in np.argsort(row, kind="stable")[:k]} for row in exact]
+
+    rows = []
+    chroma = ChromaVectorStore(collection)
+    rows.append({"backend": "chroma", "params": {}, **measure(
+        lambda query: chroma.search(query[None, :], k)[0][0], queries, truth, k
+    )})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for m in m_values:
+            start = time.perf_counter()
+            store = HNSWVectorStore(collection, os.path.join(tmp, f"hnsw-{m}"), m=m, ef_construction=ef_construction)
+            build_seconds = round(time.perf_counter() - start, 3)
+            for ef in ef_values:
+                store.set_ef(ef)
+                rows.append({
+                    "backend": "hnsw",
+                    "params": {"M": m, "ef_construction": ef_construction, "ef_search": ef},
+                    "build_seconds": build_seconds,
+                    **measure(lambda query: store.search(query, k)[0][0], queries, truth, k)
+                })
+
+        for dtype in dtypes:
+            start = time.perf_counter()
+            store = QuantizedVectorStore.build_from_collection(collection, os.path.join(tmp, f"quantized-{dtype}"), dtype)
+            build_seconds = round(time.perf_counter() - start, 3)
+            for rescore in (False, True):
+                store.rescore = rescore
+                rows.append({
+                    "backend": "quantized",
+                    "params": {"dtype": dtype, "rescore": rescore},
+                    "build_seconds": build_seconds,
+                    **measure(lambda query: store.search(query, k)[0][0], queries, truth, k)
+                })
+    return rows
+
+
+if __name__ == "__main__":
+    import chromadb
+    from backend.config import CHROMA_DB_PATH, COLLECTION_NAME
+
+    parser = argparse.ArgumentParser(description="Compare recall and latency of the vector store backends")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200,
+                        help="Number of stored chunk embeddings sampled as queries")
+    parser.add_argument("--questions", help="File with one question per line, embedded as queries instead")
+    parser.add_argument("--m", type=int, nargs="+", default=[8, 16, 32], help="HNSW M values")
+    parser.add_argument("--ef", type=int, nargs="+", default=[16, 32, 64, 128, 256], help="HNSW ef_search values")
+    parser.add_argument("--ef-construction", type=int, default=HNSW_EF_CONSTRUCTION)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    collection = chromadb.PersistentClient(path=CHROMA_DB_PATH).get_collection(name=COLLECTION_NAME)
+
+    if args.questions:
+        from backend.models import get_embedding_model
+
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+        model = get_embedding_model(os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2"))
+        queries = model.encode(questions, convert_to_numpy=True, show_progress_bar=False)
+    else:
+        _, vectors = load_embeddings(collection)
+        rng = np.random.default_rng(0)
+        queries = vectors[rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)]
+
+    rows = compare_backends(
+        collection, queries, args.k, args.m, args.ef, args.ef_construction
+    )
+    print(f"{collection.count()} vectors, {len(queries)} queries, recall@{args.k} vs exact float32 search\n")
+    print(f"{'backend':<10} {'params':<44} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8} {'qps':>9}")
+    for row in rows:
+        params = ", ".join(f"{key}={value}" for key, value in row["params"].items())
+        print(f"{row['backend']:<10} {params:<44} {row['recall']:>7.3f} {row['p50_ms']:>8.3f} "
+              f"{row['p95_ms']:>8.3f} {row['qps']:>9.1f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"k": args.k, "queries": len(queries), "results": rows}, f, indent=2)
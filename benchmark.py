@@ -0,0 +1,510 @@
+"""
+Performance Benchmark for DocuMind Enterprise
+
+Generates a synthetic PDF corpus, measures ingestion throughput
+(extract_text, chunk_pages, store_embeddings) and query latency / QPS under
+concurrency against the FastAPI app, with a local Ollama stub so it runs
+offline. Results are written as JSON that can be compared between commits.
+
+Usage:
+    python benchmark.py --docs 20 --pages 10 --output results.json
+    python benchmark.py --output new.json --compare results.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Bump when the result layout changes so old files are not compared blindly
+RESULTS_VERSION = 1
+
+SYLLABLES = ["ka", "lo", "mi", "ren", "ta", "vo", "sul", "dri", "pe", "nor", "qua", "zel", "bi", "fen", "tor", "ux"]
+FILLER = (
+    "the a of to and in for on with by is are was be this that each all any under within after before "
+    "employee customer manager request report policy process record account period notice review team"
+).split()
+
+
+# ---------------------------------------------------------------------------
+# Synthetic corpus
+# ---------------------------------------------------------------------------
+
+def make_term(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def generate_corpus(directory, docs, pages, words_per_page, seed=0):
+    """
+    Write `docs` PDFs of `pages` pages each and return (paths, questions).
+
+    Every page mixes filler text with one fact sentence about a made-up
+    term, and each fact yields a question, so queries have real matches.
+    The same seed always produces the same corpus.
+    """
+    import fitz  # PyMuPDF
+
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths, questions = [], []
+
+    for d in range(docs):
+        doc = fitz.open()
+        for p in range(pages):
+            term = make_term(rng)
+            days = rng.randint(2, 90)
+            fact = f"The {term} policy requires {days} days of notice before approval."
+            words = [rng.choice(FILLER) for _ in range(words_per_page)]
+            words.insert(rng.randint(0, len(words)), fact)
+            questions.append(f"What does the {term} policy require?")
+
+            page = doc.new_page()
+            rect = fitz.Rect(50, 50, page.rect.width - 50, page.rect.height - 50)
+            page.insert_textbox(rect, " ".join(words), fontsize=9)
+        path = os.path.join(directory, f"synthetic_{d:04d}.pdf")
+        doc.save(path)
+        doc.close()
+        paths.append(path)
+
+    rng.shuffle(questions)
+    return paths, questions
+
+
+# ---------------------------------------------------------------------------
+# Ollama stub
+# ---------------------------------------------------------------------------
+
+class OllamaStub:
+    """
+    Minimal HTTP server speaking Ollama's /api/chat protocol (plus
+    /api/version for health checks).
+
+    Answers after `latency` seconds with `tokens` tokens (streamed evenly
+    over the same time when stream=true), and reports eval_count /
+    eval_duration like the real server.
+    """
+
+    def __init__(self, latency=0.0, tokens=20, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.tokens = tokens
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # Headers and body are separate writes; avoid delayed-ACK stalls
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path != "/api/version":
+                    self.send_error(404)
+                    return
+                payload = b'{"version": "stub"}'
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path != "/api/chat":
+                    self.send_error(404)
+                    return
+                stub.handle_chat(self, body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self._thread = None
+
+    def final_message(self, content):
+        return {
+            "model": "stub",
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "message": {"role": "assistant", "content": content},
+            "done": True,
+            "done_reason": "stop",
+            "eval_count": self.tokens,
+            "eval_duration": int(self.latency * 1e9)
+        }
+
+    def handle_chat(self, handler, body):
+        words = [f"token{i} " for i in range(self.tokens)]
+        if not body.get("stream", True):
+            time.sleep(self.latency)
+            payload = json.dumps(self.final_message("".join(words))).encode()
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/json")
+            handler.send_header("Content-Length", str(len(payload)))
+            handler.end_headers()
+            handler.wfile.write(payload)
+            return
+
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/x-ndjson")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+
+        def write_line(message):
+            line = json.dumps(message).encode() + b"\n"
+            handler.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+            handler.wfile.flush()
+
+        delay = self.latency / max(self.tokens, 1)
+        for word in words:
+            time.sleep(delay)
+            write_line({"model": "stub", "message": {"role": "assistant", "content": word}, "done": False})
+        write_line(self.final_message(""))
+        handler.wfile.write(b"0\r\n\r\n")
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# ---------------------------------------------------------------------------
+# Measurements
+# ---------------------------------------------------------------------------
+
+def percentiles(values_ms):
+    if not values_ms:
+        return None
+    p50, p95, p99 = np.percentile(values_ms, [50, 95, 99])
+    return {
+        "p50": round(float(p50), 3),
+        "p95": round(float(p95), 3),
+        "p99": round(float(p99), 3),
+        "mean": round(float(np.mean(values_ms)), 3)
+    }
+
+
+def bench_ingestion(pdf_paths):
+    """Time extraction, chunking and embedding + storage as separate stages"""
+    from ingestion.ingest import EMBEDDING_MODEL, extract_text, chunk_pages, store_embeddings
+    from backend.models import get_embedding_model
+
+    start = time.perf_counter()
+    extracted = [(path, extract_text(path)) for path in pdf_paths]
+    extract_seconds = time.perf_counter() - start
+    num_pages = sum(len(pages) for _, pages in extracted)
+
+    start = time.perf_counter()
+    chunks = []
+    for path, pages in extracted:
+        chunks.extend(chunk_pages(pages, source=os.path.basename(path)))
+    chunk_seconds = time.perf_counter() - start
+
+    # Model loading is reported separately so it does not skew throughput
+    start = time.perf_counter()
+    get_embedding_model(EMBEDDING_MODEL)
+    model_load_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    store_embeddings(chunks)
+    store_seconds = time.perf_counter() - start
+
+    return {
+        "documents": len(pdf_paths),
+        "pages": num_pages,
+        "chunks": len(chunks),
+        "model_load_seconds": round(model_load_seconds, 3),
+        "extract": {
+            "seconds": round(extract_seconds, 3),
+            "pages_per_second": round(num_pages / max(extract_seconds, 1e-9), 1)
+        },
+        "chunk": {
+            "seconds": round(chunk_seconds, 3),
+            "chunks_per_second": round(len(chunks) / max(chunk_seconds, 1e-9), 1)
+        },
+        "store_embeddings": {
+            "seconds": round(store_seconds, 3),
+            "chunks_per_second": round(len(chunks) / max(store_seconds, 1e-9), 1)
+        }
+    }
+
+
+class APIServer:
+    """Runs the FastAPI app with uvicorn on a background thread"""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        import uvicorn
+        from backend.app import app
+
+        if not port:
+            with socket.socket() as s:
+                s.bind((host, 0))
+                port = s.getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        self.server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+        self._thread = None
+
+    def start(self, timeout=600):
+        import requests
+
+        self._thread = threading.Thread(target=self.server.run, daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if requests.get(f"{self.url}/ready", timeout=5).status_code == 200:
+                    return self
+            except requests.ConnectionError:
+                pass
+            time.sleep(0.1)
+        raise RuntimeError("API did not become ready in time")
+
+    def stop(self):
+        self.server.should_exit = True
+        self._thread.join(timeout=10)
+
+
+def run_load(url, questions, concurrency, num_requests, endpoint="/query"):
+    """
+    Send num_requests queries from `concurrency` threads, each issuing its
+    next request as soon as the previous one returns.
+    """
+    import requests
+
+    local = threading.local()
+    latencies, stages, errors = [], {}, 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        question = questions[i % len(questions)]
+        start = time.perf_counter()
+        try:
+            response = session.post(f"{url}{endpoint}", json={"question": question}, timeout=300)
+            ok = response.status_code == 200
+            timings = (response.json().get("timings") or {}) if ok else {}
+        except requests.RequestException:
+            ok, timings = False, {}
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with lock:
+            if not ok:
+                errors += 1
+                return
+            latencies.append(elapsed_ms)
+            for stage, seconds in timings.items():
+                if stage != "tokens_per_second":
+                    stages.setdefault(stage, []).append(seconds * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(num_requests)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "requests": num_requests,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "qps": round(len(latencies) / max(elapsed, 1e-9), 2),
+        "latency_ms": percentiles(latencies),
+        "stages_ms": {stage: percentiles(values) for stage, values in sorted(stages.items())}
+    }
+
+
+def bench_queries(questions, concurrency_levels, num_requests, warmup_requests):
+    server = APIServer().start()
+    try:
+        run_load(server.url, questions, 1, warmup_requests)
+        return [run_load(server.url, questions, c, num_requests) for c in concurrency_levels]
+    finally:
+        server.stop()
+
+
+# ---------------------------------------------------------------------------
+# Results
+# ---------------------------------------------------------------------------
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    from backend import rag, vectorstores
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "embedding_model": rag.EMBEDDING_MODEL,
+        "retrieval_mode": rag.RETRIEVAL_MODE,
+        "vector_store": vectorstores.VECTOR_STORE,
+        "top_k": rag.TOP_K,
+        "max_inflight_queries": rag.MAX_INFLIGHT_QUERIES
+    }
+
+
+def flatten(results):
+    """Comparable metrics as {dotted.name: (value, higher_is_better)}"""
+    metrics = {}
+
+    def walk(node, prefix):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                walk(value, f"{prefix}.{key}" if prefix else key)
+        elif isinstance(node, (int, float)) and not isinstance(node, bool):
+            if prefix.endswith(("per_second", ".qps")):
+                metrics[prefix] = (node, True)
+            elif ".latency_ms." in prefix and not prefix.endswith(".mean"):
+                metrics[prefix] = (node, False)
+
+    walk(results.get("ingestion", {}), "ingestion")
+    for level in results.get("query", []):
+        walk(level, f"query.c{level['concurrency']}")
+    return metrics
+
+
+def compare(baseline, current, max_regression):
+    """Print per-metric changes and return the names of regressed metrics"""
+    old, new = flatten(baseline), flatten(current)
+    regressions = []
+    print(f"\n{'metric':<45} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name in sorted(old.keys() & new.keys()):
+        (before, higher_is_better), (after, _) = old[name], new[name]
+        if not before:
+            continue
+        change = (after - before) / before
+        worse = -change if higher_is_better else change
+        flag = ""
+        if worse > max_regression:
+            regressions.append(name)
+            flag = "  ✗"
+        print(f"{name:<45} {before:>12} {after:>12} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DocuMind ingestion and query performance")
+    parser.add_argument("--docs", type=int, default=10, help="Synthetic PDFs to generate")
+    parser.add_argument("--pages", type=int, default=10, help="Pages per PDF")
+    parser.add_argument("--words", type=int, default=300, help="Words per page")
+    parser.add_argument("--seed", type=int, default=0, help="Corpus random seed")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated client concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Queries per concurrency level")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured queries before the first level")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds the Ollama stub takes per answer")
+    parser.add_argument("--llm-tokens", type=int, default=20, help="Tokens in each stub answer")
+    parser.add_argument("--answer-cache", action="store_true", help="Keep the answer cache enabled")
+    parser.add_argument("--embedding-cache", action="store_true", help="Keep the persistent embedding cache enabled")
+    parser.add_argument("--workdir", help="Directory for the corpus and index (default: a temporary directory)")
+    parser.add_argument("--keep", action="store_true", help="Do not delete the work directory afterwards")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Relative slowdown that counts as a regression (exit code 1)")
+    args = parser.parse_args()
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="documind-bench-"))
+    stub = OllamaStub(latency=args.llm_latency, tokens=args.llm_tokens).start()
+
+    # Must be set before backend / ingestion modules read their configuration
+    os.environ["CHROMA_DB_PATH"] = os.path.join(workdir, "chroma_db")
+    os.environ["OLLAMA_HOST"] = stub.url
+    os.environ["WARMUP_ON_STARTUP"] = "true"
+    if not args.answer_cache:
+        os.environ["CACHE_ENABLED"] = "false"
+    if not args.embedding_cache:
+        os.environ["EMBEDDING_CACHE_ENABLED"] = "false"
+    sys.path.insert(0, PROJECT_ROOT)
+
+    try:
+        print(f"Generating {args.docs} PDF(s) x {args.pages} page(s) in {workdir}...")
+        pdf_paths, questions = generate_corpus(
+            os.path.join(workdir, "pdfs"), args.docs, args.pages, args.words, args.seed
+        )
+
+        print("Benchmarking ingestion...")
+        ingestion = bench_ingestion(pdf_paths)
+        print(
+            f"✓ {ingestion['pages']} pages, {ingestion['chunks']} chunks: "
+            f"extract {ingestion['extract']['pages_per_second']} pages/s, "
+            f"chunk {ingestion['chunk']['chunks_per_second']} chunks/s, "
+            f"store_embeddings {ingestion['store_embeddings']['chunks_per_second']} chunks/s"
+        )
+
+        levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+        print(f"Benchmarking /query at concurrency {levels}...")
+        query = bench_queries(questions, levels, args.requests, args.warmup)
+        for level in query:
+            latency = level["latency_ms"] or {}
+            print(
+                f"✓ c={level['concurrency']}: {level['qps']} QPS, p50 {latency.get('p50')} ms, "
+                f"p95 {latency.get('p95')} ms, p99 {latency.get('p99')} ms, {level['errors']} error(s)"
+            )
+
+        results = {
+            "version": RESULTS_VERSION,
+            "config": {
+                "docs": args.docs,
+                "pages": args.pages,
+                "words": args.words,
+                "seed": args.seed,
+                "requests": args.requests,
+                "llm_latency": args.llm_latency,
+                "llm_tokens": args.llm_tokens,
+                "answer_cache": args.answer_cache,
+                "embedding_cache": args.embedding_cache
+            },
+            "environment": environment(),
+            "ingestion": ingestion,
+            "query": query
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Results written to {args.output}")
+    finally:
+        stub.stop()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != results["config"]:
+            print("⚠ Baseline was run with a different configuration")
+        regressions = compare(baseline, results, args.max_regression)
+        if regressions:
+            print(f"\n✗ {len(regressions)} metric(s) regressed by more than {args.max_regression:.0%}")
+            sys.exit(1)
+        print("\n✓ No regressions")
+
+
+if __name__ == "__main__":
+    main()
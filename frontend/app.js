@@ -98,6 +98,35 @@ const addMessage = (role, text) => {
   if (empty) empty.remove();
   chat.appendChild(node);
   chat.scrollTop = chat.scrollHeight;
+  return node;
+};
+
+// Parse a Server-Sent Events response body, calling onEvent(event, data)
+// for each event as soon as it arrives
+const readEventStream = async (response, onEvent) => {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const raw = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let event = "message";
+      let data = "";
+      raw.split("\n").forEach((line) => {
+        if (line.startsWith("event: ")) event = line.slice(7);
+        else if (line.startsWith("data: ")) data += line.slice(6);
+      });
+      onEvent(event, data ? JSON.parse(data) : null);
+    }
+  }
 };
 
 const recordLatency = (ms) => {
@@ -122,7 +151,7 @@ const sendQuestion = async (question) => {
   const start = performance.now();
 
   try {
-    const response = await fetch(`${getApiBase()}/query`, {
+    const response = await fetch(`${getApiBase()}/query/stream`, {
       method: "POST",
       headers: {
         "Content-Type": "application/json",
@@ -131,17 +160,34 @@ const sendQuestion = async (question) => {
       signal: AbortSignal.timeout(60000)
     });
 
-    const elapsed = performance.now() - start;
-    recordLatency(elapsed);
-
     if (!response.ok) {
+      recordLatency(performance.now() - start);
       const detail = await response.text();
       addMessage("bot", `⚠️ Error ${response.status}: ${detail}`);
       metricStatus.textContent = `Error ${response.status}`;
     } else {
-      const data = await response.json();
-      addMessage("bot", data.answer || "No answer returned.");
-      metricStatus.textContent = "Answered";
+      // Render tokens into the bubble as they are generated
+      const bubble = addMessage("bot", "…").querySelector(".bubble");
+      let answer = "";
+      let failed = false;
+      metricStatus.textContent = "Searching…";
+
+      await readEventStream(response, (event, data) => {
+        if (event === "sources") {
+          metricStatus.textContent = "Generating…";
+        } else if (event === "token") {
+          answer += data;
+          bubble.textContent = answer;
+          chat.scrollTop = chat.scrollHeight;
+        } else if (event === "error") {
+          failed = true;
+          bubble.textContent = `⚠️ ${data.detail}`;
+        }
+      });
+
+      recordLatency(performance.now() - start);
+      if (!failed && !answer) bubble.textContent = "No answer returned.";
+      metricStatus.textContent = failed ? "Error" : "Answered";
     }
   } catch (error) {
     addMessage("bot", `❌ Connection error: ${error.message || error}`);
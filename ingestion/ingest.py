@@ -1,80 +1,476 @@
 import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from dotenv import load_dotenv
 import fitz  # PyMuPDF
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from sentence_transformers import SentenceTransformer
 import chromadb
 
+# Load environment variables
+load_dotenv()
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.join(BASE_DIR, "..")
-PDF_PATH = os.path.join(PROJECT_ROOT, "data", "pdfs", "sample.pdf")
-CHROMA_DB_PATH = os.path.join(PROJECT_ROOT, "chroma_db")
+
+# Allow `python ingestion/ingest.py` to import the shared backend modules
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.abspath(PROJECT_ROOT))
+
+from backend.embeddings import get_embedding_cache  # noqa: E402
+from backend.models import get_embedding_model  # noqa: E402
+from backend.lexical import BM25Index  # noqa: E402
+from backend.vectorstores import open_vector_store  # noqa: E402
+from backend.config import (  # noqa: E402
+    CHROMA_DB_PATH, CHUNK_SEPARATORS, COLLECTION_NAME, MANIFEST_PATH, PDF_DIR, load_manifest
+)
+
+PDF_PATH = os.path.join(PDF_DIR, "sample.pdf")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+# Number of chunks encoded per SentenceTransformer forward pass
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+# Number of chunks written per Chroma upsert() call (one SQLite transaction each)
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "1000"))
+# Processes used for PDF extraction and chunking (0 = one per CPU core)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0")) or os.cpu_count() or 1
+# Files at least this large are extracted page by page in the writer instead
+# of being chunked whole in a worker process and sent back in one piece
+STREAM_MIN_MB = float(os.getenv("INGEST_STREAM_MIN_MB", "16"))
+
+
+def iter_pages(pdf_path):
+    """Yield {"page", "text"} one page at a time, keeping only that page in memory"""
+    with fitz.open(pdf_path) as doc:
+        for page_num, page in enumerate(doc):
+            yield {
+                "page": page_num + 1,
+                "text": page.get_text()
+            }
 
 
 def extract_text(pdf_path):
-    doc = fitz.open(pdf_path)
-    pages = []
+    return list(iter_pages(pdf_path))
 
-    for page_num, page in enumerate(doc):
-        text = page.get_text()
-        pages.append({
-            "page": page_num + 1,
-            "text": text
-        })
 
-    return pages
+def chunk_id(source, page, text):
+    """Stable chunk id derived from source file, page and chunk content"""
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+    return f"{source}:{page}:{digest}"
 
 
-def chunk_pages(pages):
+def iter_chunks(pages, source="sample.pdf"):
+    """Split an iterable of pages lazily, yielding chunks as each page is read"""
+    # Paragraphs, then sentences, then lines: chunks end where the extractive splitter cuts
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=700,
-        chunk_overlap=120
+        chunk_overlap=120,
+        separators=CHUNK_SEPARATORS,
+        is_separator_regex=True
     )
 
-    chunks = []
-
     for page in pages:
+        # Ids embed the page, so repeats only need tracking within a page
+        seen = {}
         page_chunks = splitter.split_text(page["text"])
         for chunk in page_chunks:
-            chunks.append({
+            cid = chunk_id(source, page["page"], chunk)
+            # Identical text repeated on the same page gets an ordinal suffix
+            occurrence = seen.get(cid, 0)
+            seen[cid] = occurrence + 1
+            if occurrence:
+                cid = f"{cid}:{occurrence}"
+
+            yield {
+                "id": cid,
                 "text": chunk,
                 "metadata": {
                     "page": page["page"],
-                    "source": "sample.pdf"
+                    "source": source
                 }
-            })
+            }
+
+
+def chunk_pages(pages, source="sample.pdf"):
+    return list(iter_chunks(pages, source))
+
+
+def batched(items, size):
+    """Yield successive slices of at most `size` items"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def write_chunks(vector_store, model, chunks, embed_batch_size=EMBED_BATCH_SIZE, write_batch_size=WRITE_BATCH_SIZE,
+                 lexical_index=None):
+    """Embed chunks in batches and upsert them into the vector store (and BM25 index)"""
+    embedding_cache = get_embedding_cache(EMBEDDING_MODEL)
+
+    # Encode a whole write batch at once (the encoder splits it into
+    # embed_batch_size forward passes, skipping texts already in the
+    # embedding cache) and store it with a single upsert()
+    for batch in batched(chunks, write_batch_size):
+        texts = [chunk["text"] for chunk in batch]
+        embeddings = embedding_cache.encode(texts, model, batch_size=embed_batch_size)
+
+        vector_store.add(
+            [chunk["id"] for chunk in batch],
+            embeddings,
+            texts,
+            [chunk["metadata"] for chunk in batch]
+        )
+        if lexical_index is not None:
+            lexical_index.add([chunk["id"] for chunk in batch], texts)
+
 
-    return chunks
+def delete_chunks(vector_store, lexical_index, ids):
+    """Remove chunks from the vector store and the BM25 index"""
+    if ids:
+        vector_store.delete(ids)
+        lexical_index.delete(ids)
 
 
-def store_embeddings(chunks):
+def store_embeddings(chunks, embed_batch_size=EMBED_BATCH_SIZE, write_batch_size=WRITE_BATCH_SIZE):
     client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
     
     # Delete existing collection if it exists
     try:
-        client.delete_collection(name="documind")
+        client.delete_collection(name=COLLECTION_NAME)
     except:
         pass
     
-    collection = client.create_collection(name="documind")
+    # The manifest no longer describes the collection after a full rebuild
+    if os.path.exists(MANIFEST_PATH):
+        os.remove(MANIFEST_PATH)
 
-    model = SentenceTransformer("all-MiniLM-L6-v2")
+    collection = client.create_collection(name=COLLECTION_NAME)
+    vector_store = open_vector_store(collection)
+    vector_store.clear()
 
-    for i, chunk in enumerate(chunks):
-        embedding = model.encode(chunk["text"]).tolist()
+    model = get_embedding_model(EMBEDDING_MODEL)
+    lexical_index = BM25Index()
+    lexical_index.clear()
 
-        collection.add(
-            ids=[str(i)],
-            documents=[chunk["text"]],
-            metadatas=[chunk["metadata"]],
-            embeddings=[embedding]
-        )
+    write_chunks(vector_store, model, chunks, embed_batch_size, write_batch_size, lexical_index)
+    vector_store.save()
+    lexical_index.save()
 
     return collection
 
 
+def file_sha256(path):
+    """SHA-256 of a file's contents, read in 1 MB blocks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def save_manifest(manifest):
+    """Atomically write the ingestion manifest next to the Chroma database"""
+    os.makedirs(CHROMA_DB_PATH, exist_ok=True)
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def list_pdfs(pdf_dir=PDF_DIR):
+    """All PDF files directly inside pdf_dir, in a stable order"""
+    if not os.path.isdir(pdf_dir):
+        return []
+    return sorted(
+        os.path.join(pdf_dir, name)
+        for name in os.listdir(pdf_dir)
+        if name.lower().endswith(".pdf")
+    )
+
+
+def prepare_file(pdf_path, source, known_sha256=None, stream=False):
+    """
+    Hash, extract and chunk one PDF. Runs inside a worker process.
+
+    Returns chunks=None when the content hash matches known_sha256, so
+    touched-but-unchanged files never get extracted. With stream=True,
+    chunks is a generator that reads pages as it is consumed and counts
+    them into result["pages"].
+    """
+    stat = os.stat(pdf_path)
+    result = {
+        "source": source,
+        "path": pdf_path,
+        "sha256": file_sha256(pdf_path),
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+        "pages": 0,
+        "chunks": None
+    }
+    if result["sha256"] == known_sha256:
+        return result
+
+    def pages():
+        for page in iter_pages(pdf_path):
+            result["pages"] += 1
+            yield page
+
+    result["chunks"] = iter_chunks(pages(), source=source)
+    if not stream:
+        result["chunks"] = list(result["chunks"])
+    return result
+
+
+def iter_prepared(tasks, workers=INGEST_WORKERS, stream_min_bytes=STREAM_MIN_MB * (1 << 20)):
+    """
+    Run prepare_file over tasks in a process pool, yielding results as they
+    complete. At most 2 * workers files are in flight so extracted chunks
+    never pile up faster than the writer can consume them.
+
+    Files of at least stream_min_bytes (and every file when there is no
+    pool) are prepared afterwards in this process with streaming chunk
+    generators, so a large document is never held in memory as a whole.
+    """
+    pooled, streamed = [], []
+    for task in tasks:
+        if workers > 1 and os.path.getsize(task[0]) < stream_min_bytes:
+            pooled.append(task)
+        else:
+            streamed.append(task)
+    if len(pooled) <= 1:
+        pooled, streamed = [], pooled + streamed
+
+    pending = iter(pooled)
+    if pooled:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            in_flight = set()
+            for task in pending:
+                in_flight.add(executor.submit(prepare_file, *task))
+                if len(in_flight) >= 2 * workers:
+                    break
+
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+                    task = next(pending, None)
+                    if task is not None:
+                        in_flight.add(executor.submit(prepare_file, *task))
+
+    for task in streamed:
+        yield prepare_file(*task, stream=True)
+
+
+def backfill_lexical_index(collection, lexical_index, batch_size=WRITE_BATCH_SIZE):
+    """Index every chunk already in the collection (for collections built before BM25)"""
+    offset = 0
+    while True:
+        page = collection.get(limit=batch_size, offset=offset, include=["documents"])
+        if not page["ids"]:
+            break
+        lexical_index.add(page["ids"], page["documents"])
+        offset += len(page["ids"])
+    lexical_index.save()
+
+
+def backfill_manifest(collection, pdf_paths, batch_size=WRITE_BATCH_SIZE):
+    """
+    Manifest for a collection ingested before manifests existed, listing each
+    source's chunk ids from the chunk metadata. The entries have no size,
+    mtime or hash, so every file is re-chunked once and its old chunks are
+    replaced only after the new ones are stored.
+    """
+    paths = {os.path.basename(path): os.path.abspath(path) for path in pdf_paths}
+    files = {}
+    offset = 0
+    while True:
+        page = collection.get(limit=batch_size, offset=offset, include=["metadatas"])
+        if not page["ids"]:
+            break
+        for chunk_id, metadata in zip(page["ids"], page["metadatas"]):
+            source = (metadata or {}).get("source")
+            if source is None:
+                continue
+            if source not in files:
+                files[source] = {
+                    "path": paths.get(source, os.path.abspath(os.path.join(PDF_DIR, source))),
+                    "sha256": None,
+                    "mtime": None,
+                    "size": None,
+                    "ingested_at": None,
+                    "chunk_ids": []
+                }
+            files[source]["chunk_ids"].append(chunk_id)
+        offset += len(page["ids"])
+    return {"version": 1, "files": files}
+
+
+def ingest_incremental(pdf_paths, rebuild=False, workers=INGEST_WORKERS,
+                       embed_batch_size=EMBED_BATCH_SIZE, write_batch_size=WRITE_BATCH_SIZE,
+                       collection=None, model=None, lexical_index=None, progress=None, vector_store=None):
+    """
+    Bring the collection up to date with the given PDFs.
+
+    Files whose size/mtime (or, failing that, SHA-256) match the manifest are
+    skipped entirely. Changed files are hashed, extracted and chunked across
+    a process pool (large files page by page in this process, see
+    iter_prepared), and the results stream into a single writer that embeds
+    only chunks with new ids and deletes chunks that disappeared once the
+    new ones are stored. Files recorded in the manifest that no longer exist
+    on disk have their chunks removed. A collection without a manifest is
+    updated in place from a manifest rebuilt out of its metadata (see
+    backfill_manifest), so it keeps serving while its files are re-chunked;
+    only rebuild starts from an empty collection.
+
+    The BM25 lexical index and the configured vector store's own index (see
+    VECTOR_STORE) are kept in step with the collection. A live collection
+    or vector store, embedding model and lexical index (e.g. the API
+    server's) can be passed in so that new chunks are visible to it
+    immediately and no second model is loaded. progress, if given, is called as progress(stage, stats)
+    after each file is extracted and after each batch is embedded.
+    """
+    manifest = None if rebuild else load_manifest()
+
+    if vector_store is not None:
+        collection = vector_store.collection
+
+    if collection is None:
+        client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+        if rebuild:
+            try:
+                client.delete_collection(name=COLLECTION_NAME)
+            except Exception:
+                pass
+        collection = client.get_or_create_collection(name=COLLECTION_NAME)
+    if vector_store is None:
+        vector_store = open_vector_store(collection)
+    if rebuild:
+        vector_store.clear(write_batch_size)
+
+    if lexical_index is None:
+        lexical_index = BM25Index.load()
+
+    if rebuild:
+        manifest = {"version": 1, "files": {}}
+        lexical_index.clear()
+    else:
+        if manifest is None:
+            manifest = backfill_manifest(collection, pdf_paths, write_batch_size)
+        if not len(lexical_index) and collection.count():
+            backfill_lexical_index(collection, lexical_index, write_batch_size)
+
+    files = manifest["files"]
+    stats = {
+        "files_total": len(pdf_paths),
+        "files_unchanged": 0,
+        "files_updated": 0,
+        "files_removed": 0,
+        "pages": 0,
+        "chunks_embedded": 0,
+        "chunks_deleted": 0
+    }
+
+    for source, entry in list(files.items()):
+        if not os.path.exists(entry["path"]):
+            delete_chunks(vector_store, lexical_index, entry["chunk_ids"])
+            stats["chunks_deleted"] += len(entry["chunk_ids"])
+            stats["files_removed"] += 1
+            del files[source]
+
+    tasks = []
+    for pdf_path in pdf_paths:
+        pdf_path = os.path.abspath(pdf_path)
+        source = os.path.basename(pdf_path)
+        stat = os.stat(pdf_path)
+        entry = files.get(source)
+
+        if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            stats["files_unchanged"] += 1
+            continue
+        tasks.append((pdf_path, source, entry["sha256"] if entry else None))
+
+    # Chunks from several files are buffered into full write batches; a
+    # file's manifest entry is only committed, and its stale chunks deleted,
+    # once its chunks are stored
+    buffer = []
+    buffered_entries = {}
+    buffered_stale = []
+
+    def flush():
+        nonlocal model
+        if buffer:
+            if model is None:
+                model = get_embedding_model(EMBEDDING_MODEL)
+            write_chunks(vector_store, model, buffer, embed_batch_size, write_batch_size, lexical_index)
+            stats["chunks_embedded"] += len(buffer)
+            buffer.clear()
+            if progress:
+                progress("embedded", stats)
+        if buffered_entries:
+            delete_chunks(vector_store, lexical_index, buffered_stale)
+            buffered_stale.clear()
+            files.update(buffered_entries)
+            buffered_entries.clear()
+            # Persist after every flush so an interrupted run resumes where it stopped
+            vector_store.save()
+            lexical_index.save()
+            save_manifest(manifest)
+
+    for result in iter_prepared(tasks, workers):
+        source = result["source"]
+        entry = files.get(source)
+
+        if result["chunks"] is None:
+            entry.update(path=result["path"], mtime=result["mtime"], size=result["size"])
+            stats["files_unchanged"] += 1
+            continue
+
+        # Chunks may be a generator reading the PDF page by page: write batches
+        # are flushed as they fill, so only ids are kept for the whole file
+        old_ids = set(entry["chunk_ids"]) if entry else set()
+        new_ids = []
+        for chunk in result["chunks"]:
+            new_ids.append(chunk["id"])
+            if chunk["id"] not in old_ids:
+                buffer.append(chunk)
+                if len(buffer) >= write_batch_size:
+                    flush()
+        stale_ids = list(old_ids - set(new_ids))
+        buffered_stale.extend(stale_ids)
+
+        buffered_entries[source] = {
+            "path": result["path"],
+            "sha256": result["sha256"],
+            "mtime": result["mtime"],
+            "size": result["size"],
+            "ingested_at": time.time(),
+            "chunk_ids": new_ids
+        }
+        stats["files_updated"] += 1
+        stats["pages"] += result["pages"]
+        stats["chunks_deleted"] += len(stale_ids)
+        if progress:
+            progress("extracted", stats)
+
+    flush()
+    vector_store.save()
+    lexical_index.save()
+    save_manifest(manifest)
+    return collection, stats
+
+
+def report_throughput(num_chunks, num_pages, elapsed):
+    """Print ingestion throughput for a completed run"""
+    elapsed = max(elapsed, 1e-9)
+    print(f"Ingested {num_chunks} chunks from {num_pages} pages in {elapsed:.2f}s")
+    print(f"Throughput: {num_chunks / elapsed:.1f} chunks/sec, {num_pages / elapsed:.1f} pages/sec")
+
+
 # 🔴 THIS FUNCTION WAS MISSING OR NOT DEFINED PROPERLY
 def search(collection, query):
-    model = SentenceTransformer("all-MiniLM-L6-v2")
+    model = get_embedding_model(EMBEDDING_MODEL)
     query_embedding = model.encode(query).tolist()
 
     results = collection.query(
@@ -86,15 +482,24 @@ def search(collection, query):
 
 
 if __name__ == "__main__":
-    print("Starting PDF ingestion...")
-    pages = extract_text(PDF_PATH)
-    print(f"Extracted {len(pages)} pages from PDF")
-    
-    chunks = chunk_pages(pages)
-    print(f"Created {len(chunks)} chunks")
-    
-    collection = store_embeddings(chunks)
+    parser = argparse.ArgumentParser(description="Ingest PDFs into the DocuMind knowledge base")
+    parser.add_argument("pdfs", nargs="*", help="PDF files to ingest (default: every PDF in --dir)")
+    parser.add_argument("--dir", default=PDF_DIR, help="Directory scanned when no files are given")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="Extraction processes")
+    parser.add_argument("--rebuild", action="store_true", help="Drop the collection and re-embed everything")
+    args = parser.parse_args()
+
+    pdf_paths = args.pdfs or list_pdfs(args.dir)
+    print(f"Starting PDF ingestion of {len(pdf_paths)} file(s) with {args.workers} worker(s)...")
+    start = time.perf_counter()
+    collection, stats = ingest_incremental(pdf_paths, rebuild=args.rebuild, workers=args.workers)
+    print(
+        f"Files: {stats['files_updated']} updated, {stats['files_unchanged']} unchanged, "
+        f"{stats['files_removed']} removed"
+    )
+    print(f"Chunks: {stats['chunks_embedded']} embedded, {stats['chunks_deleted']} deleted")
     print("Embeddings stored successfully in 'chroma_db' directory")
+    report_throughput(stats["chunks_embedded"], stats["pages"], time.perf_counter() - start)
 
     results = search(collection, "refund policy")
 
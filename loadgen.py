@@ -0,0 +1,186 @@
+"""
+Load Generator for DocuMind Enterprise
+
+Drives POST /query at a fixed target rate (open loop: requests are sent on
+schedule whether or not earlier ones have finished) and reports achieved
+throughput, tail latency and the server's generation queue depth sampled
+from /metrics.
+
+Run the API with LLM_BACKEND=fake to measure the server's own overheads and
+concurrency limits without a model:
+
+    LLM_BACKEND=fake FAKE_LLM_TTFT_MS=150 python -m uvicorn backend.app:app
+    python loadgen.py --rps 20 --duration 30 --questions questions.txt
+"""
+
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+
+import httpx
+import numpy as np
+
+DEFAULT_QUESTIONS = [
+    "What is the vacation policy?",
+    "Who approves refund requests?",
+    "How many days of notice are required?",
+    "What are the eligibility criteria?",
+    "How are expense reports reviewed?"
+]
+
+
+def parse_gauges(text, names):
+    """Values of unlabelled gauges from a Prometheus text exposition"""
+    values = {}
+    for line in text.splitlines():
+        name, _, value = line.partition(" ")
+        if name in names:
+            values[name] = float(value)
+    return values
+
+
+async def sample_queue(client, url, interval, samples, stop):
+    """Poll /metrics until stop is set, appending (running, waiting) pairs"""
+    names = ("documind_generations_running", "documind_generations_waiting")
+    while not stop.is_set():
+        try:
+            response = await client.get(f"{url}/metrics")
+            gauges = parse_gauges(response.text, names)
+            samples.append((gauges.get(names[0], 0.0), gauges.get(names[1], 0.0)))
+        except httpx.HTTPError:
+            pass
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+def summarize(values):
+    if not values:
+        return None
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "p50": round(float(p50), 2),
+        "p95": round(float(p95), 2),
+        "p99": round(float(p99), 2),
+        "max": round(float(np.max(values)), 2),
+        "mean": round(float(np.mean(values)), 2)
+    }
+
+
+async def run(url, questions, rps, duration, poisson=False, unique=False, timeout=120.0,
+              metrics_interval=0.5, seed=0):
+    """
+    Send round(rps * duration) queries on schedule and collect results.
+
+    With poisson=True inter-arrival times are exponential (bursty) rather
+    than evenly spaced. unique=True appends the request number to each
+    question so the answer cache never hits.
+    """
+    rng = random.Random(seed)
+    total = max(1, round(rps * duration))
+    latencies, statuses, lags = [], Counter(), []
+    samples, stop = [], asyncio.Event()
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        sampler = asyncio.create_task(sample_queue(client, url, metrics_interval, samples, stop))
+
+        async def send(i):
+            question = questions[i % len(questions)]
+            if unique:
+                question = f"{question} (#{i})"
+            start = time.perf_counter()
+            try:
+                response = await client.post(f"{url}/query", json={"question": question})
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            statuses[status] += 1
+            if status == 200:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        tasks = []
+        begin = time.perf_counter()
+        due = 0.0
+        for i in range(total):
+            delay = begin + due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # How far the client itself fell behind schedule
+            lags.append(max(0.0, -delay) * 1000)
+            tasks.append(asyncio.create_task(send(i)))
+            due += rng.expovariate(rps) if poisson else 1.0 / rps
+        send_seconds = time.perf_counter() - begin
+
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - begin
+        stop.set()
+        await sampler
+
+    running = [sample[0] for sample in samples]
+    waiting = [sample[1] for sample in samples]
+    return {
+        "target_rps": rps,
+        "offered_rps": round(total / max(send_seconds, 1e-9), 2),
+        "requests": total,
+        "succeeded": statuses.get(200, 0),
+        "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(statuses.get(200, 0) / max(elapsed, 1e-9), 2),
+        "latency_ms": summarize(latencies),
+        "schedule_lag_ms": summarize(lags),
+        "generations_running": summarize(running),
+        "queue_depth": summarize(waiting)
+    }
+
+
+def print_report(report):
+    print(f"Target {report['target_rps']} rps, offered {report['offered_rps']} rps, "
+          f"{report['requests']} requests in {report['seconds']}s")
+    print(f"Throughput: {report['throughput_rps']} rps ({report['succeeded']} succeeded)")
+    print("Statuses: " + ", ".join(f"{status}={count}" for status, count in report["statuses"].items()))
+    for key, label in (("latency_ms", "Latency (ms)"), ("queue_depth", "Queue depth"),
+                       ("generations_running", "Generations running")):
+        stats = report[key]
+        if stats:
+            print(f"{label}: p50 {stats['p50']}, p95 {stats['p95']}, p99 {stats['p99']}, max {stats['max']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive /query at a target request rate")
+    parser.add_argument("--url", default="http://localhost:8000", help="API base URL")
+    parser.add_argument("--rps", type=float, default=10.0, help="Target requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to send requests for")
+    parser.add_argument("--questions", help="File with one question per line (default: a built-in set)")
+    parser.add_argument("--poisson", action="store_true", help="Exponential inter-arrival times")
+    parser.add_argument("--unique", action="store_true", help="Make every question unique to bypass the answer cache")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for --poisson")
+    parser.add_argument("--json", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+        if not questions:
+            sys.exit(f"No questions in {args.questions}")
+
+    report = asyncio.run(run(
+        args.url.rstrip("/"), questions, args.rps, args.duration,
+        poisson=args.poisson, unique=args.unique, timeout=args.timeout, seed=args.seed
+    ))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
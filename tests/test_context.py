@@ -0,0 +1,83 @@
+import backend.rerank as rerank
+from backend.context import build_context, estimate_tokens
+
+
+def results(chunks):
+    """Single-query retrieval results from (text, source, page) tuples"""
+    return {
+        "ids": [[f"{source}:{page}:{i}" for i, (_, source, page) in enumerate(chunks)]],
+        "documents": [[text for text, _, _ in chunks]],
+        "metadatas": [[{"source": source, "page": page} for _, source, page in chunks]],
+        "distances": [[0.1 * i for i in range(len(chunks))]]
+    }
+
+
+class KeywordCrossEncoder:
+    """Scores a pair by how often the question's words occur in the chunk"""
+
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        self.calls.append(len(pairs))
+        return [sum(document.lower().count(word) for word in question.lower().split()) for question, document in pairs]
+
+
+def test_overlapping_chunks_are_stitched_and_duplicates_dropped():
+    first = "Employees accrue twenty vacation days per year, starting from their first month of service."
+    second = "starting from their first month of service. Unused days carry over until the end of March."
+    context, stats = build_context(results([
+        (first, "policy.pdf", 2),
+        ("Expense reports are due within thirty days of purchase.", "expenses.pdf", 1),
+        (second, "policy.pdf", 2),
+        # Same text on another page adds nothing
+        (first, "policy.pdf", 7),
+    ]))
+
+    assert context == (
+        "[policy.pdf, Page 2]\n"
+        "Employees accrue twenty vacation days per year, starting from their first month of service. "
+        "Unused days carry over until the end of March.\n\n"
+        "[expenses.pdf, Page 1]\nExpense reports are due within thirty days of purchase."
+    )
+    assert stats == {"chunks": 4, "passages": 3, "deduplicated": 1, "selected": 2, "tokens": stats["tokens"]}
+
+
+def test_token_budget_keeps_best_passages_and_truncates_the_last():
+    chunks = [(f"Passage {i} " + "word " * 100, f"doc{i}.pdf", 1) for i in range(5)]
+    cost = estimate_tokens(chunks[0][0].strip()) + 8
+    context, stats = build_context(results(chunks), token_budget=2 * cost + 60)
+
+    assert stats["selected"] == 3
+    assert stats["tokens"] <= 2 * cost + 60
+    assert "[doc0.pdf, Page 1]" in context and "[doc1.pdf, Page 1]" in context
+    assert context.endswith(" …")
+    assert "doc3.pdf" not in context
+
+    # Not enough room left to be worth truncating
+    _, stats = build_context(results(chunks), token_budget=2 * cost + 20)
+    assert stats["selected"] == 2
+
+
+def test_reranker_keeps_top_n_per_question_in_one_batch(monkeypatch):
+    model = KeywordCrossEncoder()
+    monkeypatch.setattr(rerank, "get_cross_encoder", lambda name: model)
+    reranker = rerank.Reranker(top_n=2)
+    vacation = results([
+        ("Expense reports are due monthly.", "expenses.pdf", 1),
+        ("Vacation days: twenty vacation days per year.", "policy.pdf", 2),
+        ("Vacation requests need approval.", "policy.pdf", 3),
+    ])
+    badges = results([
+        ("Badges must be worn at all times.", "security.pdf", 1),
+        ("Visitors are escorted.", "security.pdf", 2),
+    ])
+
+    ranked = reranker.rerank_many(["vacation", "badges"], [vacation, badges])
+
+    assert model.calls == [5]
+    assert ranked[0]["ids"] == [["policy.pdf:2:1", "policy.pdf:3:2"]]
+    assert ranked[0]["rerank_scores"] == [[2.0, 1.0]]
+    assert ranked[0]["distances"] == [[0.1, 0.2]]
+    assert ranked[1]["documents"] == [["Badges must be worn at all times.", "Visitors are escorted."]]
+    assert reranker.rerank("badges", results([]))["ids"] == [[]]
@@ -0,0 +1,64 @@
+import json
+import asyncio
+
+import pytest
+
+from backend.app import app
+from backend.metrics import GENERATIONS_CANCELLED
+from backend.rag import rag_system
+
+
+def cancelled_count():
+    return GENERATIONS_CANCELLED._values.get((), 0.0)
+
+
+async def post_and_disconnect(path, body, disconnect_after):
+    """Send one POST through the ASGI app, disconnecting after a delay; returns the status"""
+    data = json.dumps(body).encode("utf-8")
+    messages = [{"type": "http.request", "body": data, "more_body": False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(disconnect_after)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(data)).encode())],
+        "client": ("127.0.0.1", 12345), "server": ("testserver", 80)
+    }
+    await app(scope, receive, send)
+    return next(message["status"] for message in sent if message["type"] == "http.response.start")
+
+
+@pytest.fixture
+def slow_generation(monkeypatch):
+    """aquery whose generation would take 30s, run through the real scheduler"""
+    started = []
+
+    async def aquery(question, filters=None, priority="interactive", deadline=None, extractive=None):
+        async def generate(timings):
+            started.append(question)
+            await asyncio.sleep(30)
+            return "never"
+        answer = await rag_system.scheduler.run(question, generate, priority, deadline)
+        return {"answer": answer}
+
+    monkeypatch.setattr(rag_system, "aquery", aquery)
+    return started
+
+
+def test_query_disconnect_cancels_generation(slow_generation):
+    before = cancelled_count()
+    status = asyncio.run(post_and_disconnect("/query", {"question": "slow question"}, 0.2))
+
+    assert status == 499
+    assert slow_generation == ["slow question"]
+    assert cancelled_count() == before + 1
+    assert rag_system.scheduler.usage() == (0, 0)
@@ -0,0 +1,61 @@
+import sys
+import hashlib
+import subprocess
+from pathlib import Path
+
+import numpy as np
+
+from backend.embeddings import EmbeddingCache
+
+
+class CountingModel:
+    """Deterministic embeddings, counting the texts it is asked to encode"""
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, show_progress_bar=False):
+        self.encoded.extend(texts)
+        seeds = [int(hashlib.md5(text.encode()).hexdigest()[:8], 16) for text in texts]
+        return np.stack([np.random.default_rng(seed).standard_normal(8).astype(np.float32) for seed in seeds])
+
+
+TESTS_DIR = Path(__file__).parent
+
+# Run in a separate process: creates the cache files and stores two embeddings
+WRITER = """
+import sys
+sys.path.insert(0, {root!r})
+sys.path.insert(0, {tests!r})
+from backend.embeddings import EmbeddingCache
+from test_embeddings import CountingModel
+EmbeddingCache("test-model", cache_dir={cache_dir!r}).encode(["first chunk", "second chunk"], CountingModel())
+"""
+
+
+def test_cache_created_by_another_process_is_readable(tmp_path):
+    # Opened before any cache files exist, so it starts without a dimension
+    cache = EmbeddingCache("test-model", cache_dir=str(tmp_path))
+    assert cache.dim is None
+
+    script = WRITER.format(root=str(TESTS_DIR.parent), tests=str(TESTS_DIR), cache_dir=str(tmp_path))
+    subprocess.run([sys.executable, "-c", script], check=True)
+
+    model = CountingModel()
+    vectors = cache.encode(["second chunk", "first chunk"], model)
+
+    assert model.encoded == []
+    assert cache.dim == 8
+    assert cache.stats["disk_hits"] == 2
+    np.testing.assert_array_equal(vectors, CountingModel().encode(["second chunk", "first chunk"]))
+
+
+def test_query_embeddings_are_not_persisted(tmp_path):
+    cache = EmbeddingCache("test-model", cache_dir=str(tmp_path))
+    model = CountingModel()
+    cache.encode(["a question"], model, persist=False)
+    cache.encode(["a question"], model, persist=False)
+
+    assert model.encoded == ["a question"]
+    assert EmbeddingCache("test-model", cache_dir=str(tmp_path)).encode(["a question"], model).shape == (1, 8)
+    assert model.encoded == ["a question", "a question"]
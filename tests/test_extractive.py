@@ -0,0 +1,38 @@
+import textwrap
+
+from backend.extractive import candidate_spans, split_sentences
+from ingestion.ingest import iter_chunks
+
+SENTENCES = [
+    "Employees accrue twenty vacation days per year, starting from their first month of service.",
+    "Unused days carry over until the end of March of the following year.",
+    "Requests need approval from a manager at least two weeks ahead.",
+    "Leave taken under policy No. 12 is paid at the full daily rate.",
+]
+# One paragraph with hard line breaks, as PDF text extraction produces
+PAGE = "Leave Policy\n\n" + textwrap.fill(" ".join(SENTENCES * 5), 60)
+
+
+def test_sentences_split_where_chunks_end():
+    sentences = set(split_sentences(PAGE))
+    chunks = [chunk["text"] for chunk in iter_chunks([{"page": 1, "text": PAGE}], source="policy.pdf")]
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        # Every sentence of a chunk is a whole sentence of the page
+        assert set(split_sentences(chunk)) <= sentences
+    assert sentences == set(SENTENCES) | {"Leave Policy"}
+
+
+def test_candidate_spans_join_consecutive_sentences():
+    results = {"documents": [[
+        "Employees accrue twenty vacation days. Unused days carry over until March.\n\nSee HR.",
+        "Employees accrue twenty vacation days."
+    ]]}
+
+    assert candidate_spans(results, max_sentences=2) == [
+        ("Employees accrue twenty vacation days.", 0),
+        ("Unused days carry over until March.", 0),
+        ("Employees accrue twenty vacation days. Unused days carry over until March.", 0),
+        ("Unused days carry over until March. See HR.", 0),
+    ]
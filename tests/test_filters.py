@@ -0,0 +1,88 @@
+import os
+import json
+from datetime import datetime, timezone
+
+from backend.filters import SourceIndex, normalize_filters
+
+# Ingested 2024-01-10 and 2024-03-01 (UTC)
+JANUARY = datetime(2024, 1, 10, tzinfo=timezone.utc).timestamp()
+MARCH = datetime(2024, 3, 1, tzinfo=timezone.utc).timestamp()
+
+
+def write_manifest(path, files):
+    manifest = {"version": 1, "files": {
+        source: {"path": source, "chunk_ids": [f"{source}:{page}:{i:04x}" for i, page in enumerate(pages)],
+                 "ingested_at": ingested_at}
+        for source, (pages, ingested_at) in files.items()
+    }}
+    path.write_text(json.dumps(manifest))
+
+
+def matching(index, **filters):
+    where, allowed = index.resolve(normalize_filters(filters))
+    return where, sorted(allowed)
+
+
+def test_normalize_filters_drops_unset_fields():
+    assert normalize_filters(None) is None
+    assert normalize_filters({"sources": None, "page_from": None}) is None
+    assert normalize_filters({"sources": ["b.pdf", "a.pdf", "b.pdf"], "page_to": 3}) == {
+        "sources": ["a.pdf", "b.pdf"], "page_to": 3
+    }
+    assert normalize_filters({"ingested_after": datetime(2024, 1, 10, tzinfo=timezone.utc)}) == {
+        "ingested_after": JANUARY
+    }
+
+
+def test_source_and_page_filters(tmp_path):
+    manifest = tmp_path / "ingest_manifest.json"
+    write_manifest(manifest, {"policy.pdf": ([1, 2, 3, 12], JANUARY), "expenses.pdf": ([1, 5], MARCH)})
+    index = SourceIndex(str(manifest))
+    index.refresh()
+
+    assert index.sources() == ["expenses.pdf", "policy.pdf"]
+    assert matching(index, sources=["policy.pdf"]) == (
+        {"source": {"$in": ["policy.pdf"]}},
+        ["policy.pdf:12:0003", "policy.pdf:1:0000", "policy.pdf:2:0001", "policy.pdf:3:0002"]
+    )
+    where, allowed = matching(index, page_from=2, page_to=5)
+    assert where == {"$and": [{"page": {"$gte": 2}}, {"page": {"$lte": 5}}]}
+    assert allowed == ["expenses.pdf:5:0001", "policy.pdf:2:0001", "policy.pdf:3:0002"]
+    # Unknown sources match nothing rather than everything
+    assert matching(index, sources=["missing.pdf"]) == ({"source": {"$in": []}}, [])
+    assert index.resolve(None) == (None, None)
+
+
+def test_date_filters_select_whole_files(tmp_path):
+    manifest = tmp_path / "ingest_manifest.json"
+    write_manifest(manifest, {"policy.pdf": ([1, 2], JANUARY), "expenses.pdf": ([1], MARCH),
+                              "legacy.pdf": ([1], None)})
+    index = SourceIndex(str(manifest))
+    index.refresh()
+
+    february = datetime(2024, 2, 1, tzinfo=timezone.utc)
+    assert matching(index, ingested_after=february) == (
+        {"source": {"$in": ["expenses.pdf"]}}, ["expenses.pdf:1:0000"]
+    )
+    assert matching(index, ingested_before=february, page_from=2) == (
+        {"$and": [{"source": {"$in": ["policy.pdf"]}}, {"page": {"$gte": 2}}]}, ["policy.pdf:2:0001"]
+    )
+
+    # Reloaded when the manifest changes
+    mtime = manifest.stat().st_mtime_ns
+    write_manifest(manifest, {"policy.pdf": ([1, 2], MARCH)})
+    os.utime(manifest, ns=(mtime, mtime + 1_000_000_000))
+    index.refresh()
+    assert matching(index, ingested_after=february)[1] == ["policy.pdf:1:0000", "policy.pdf:2:0001"]
+
+
+def test_naive_datetimes_are_utc(tmp_path):
+    manifest = tmp_path / "ingest_manifest.json"
+    write_manifest(manifest, {"policy.pdf": ([1], JANUARY)})
+    index = SourceIndex(str(manifest))
+    index.refresh()
+
+    # Ingestion times are Unix timestamps, so a bound without a timezone must not depend on the server's
+    assert normalize_filters({"ingested_after": datetime(2024, 1, 10)}) == {"ingested_after": JANUARY}
+    assert matching(index, ingested_after=datetime(2024, 1, 10, 0, 0, 1))[1] == []
+    assert matching(index, ingested_before=datetime(2024, 1, 10))[1] == ["policy.pdf:1:0000"]
@@ -0,0 +1,139 @@
+import re
+import hashlib
+
+import fitz
+import chromadb
+import numpy as np
+import pytest
+
+import backend.config as config
+import ingestion.ingest as ingest
+from backend.embeddings import PassthroughCache
+from backend.lexical import BM25Index
+from backend.vectorstores import ChromaVectorStore
+
+
+class WordHashModel:
+    """Bag-of-words embeddings: texts sharing words are close"""
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, show_progress_bar=False):
+        self.encoded.extend(texts)
+        vectors = np.zeros((len(texts), 64), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                vectors[row, int(hashlib.md5(word.encode()).hexdigest(), 16) % 64] += 1.0
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def write_pdf(path, text):
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), text)
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """Empty collection and lexical index, with the manifest kept under tmp_path"""
+    manifest_path = str(tmp_path / "chroma" / "ingest_manifest.json")
+    monkeypatch.setattr(config, "MANIFEST_PATH", manifest_path)
+    monkeypatch.setattr(ingest, "MANIFEST_PATH", manifest_path)
+    monkeypatch.setattr(ingest, "CHROMA_DB_PATH", str(tmp_path / "chroma"))
+    monkeypatch.setattr(ingest, "get_embedding_cache", PassthroughCache)
+    collection = chromadb.PersistentClient(path=str(tmp_path / "chroma")).get_or_create_collection("documind")
+    return collection, BM25Index(path=str(tmp_path / "lexical"))
+
+
+def run(store, pdf_paths, progress=None, model=None):
+    collection, lexical_index = store
+    return ingest.ingest_incremental(
+        pdf_paths, workers=1, collection=collection, vector_store=ChromaVectorStore(collection),
+        model=model or WordHashModel(), lexical_index=lexical_index, progress=progress
+    )[1]
+
+
+def sources(collection):
+    return sorted({metadata["source"] for metadata in collection.get(include=["metadatas"])["metadatas"]})
+
+
+def test_upload_without_manifest_keeps_existing_chunks_searchable(tmp_path, store):
+    collection, lexical_index = store
+    policy = write_pdf(tmp_path / "policy.pdf", "Employees accrue twenty vacation days per year.")
+    expenses = write_pdf(tmp_path / "expenses.pdf", "Expense reports are due within thirty days.")
+    uploaded = write_pdf(tmp_path / "security.pdf", "Badges must be worn inside the office at all times.")
+    # Ingested before manifests existed: positional ids and no manifest file
+    for position, path in enumerate([policy, expenses]):
+        text = ingest.extract_text(path)[0]["text"]
+        collection.add(
+            ids=[str(position)], documents=[text], metadatas=[{"source": path.rsplit("/", 1)[1], "page": 1}],
+            embeddings=WordHashModel().encode([text]).tolist()
+        )
+
+    def top_hits(stage, stats):
+        dense = collection.query(query_embeddings=WordHashModel().encode(["vacation days"]).tolist(), n_results=1)
+        lexical = lexical_index.search("vacation", 1)
+        hits.append((dense["metadatas"][0][0]["source"], lexical[0][0] if lexical else None))
+
+    hits = []
+    stats = run(store, [policy, expenses, uploaded], progress=top_hits)
+
+    assert len(hits) == 4
+    assert all(source == "policy.pdf" and chunk_id is not None for source, chunk_id in hits)
+    assert stats["files_updated"] == 3
+    assert sources(collection) == ["expenses.pdf", "policy.pdf", "security.pdf"]
+    assert not {"0", "1"} & set(collection.get(include=[])["ids"])
+    assert collection.count() == len(lexical_index) == 3
+    manifest = config.load_manifest()
+    assert manifest["files"]["policy.pdf"]["chunk_ids"][0].startswith("policy.pdf:1:")
+    assert manifest["files"]["policy.pdf"]["sha256"] == ingest.file_sha256(policy)
+
+
+def test_reingest_only_touches_changed_files(tmp_path, store):
+    collection, lexical_index = store
+    policy = write_pdf(tmp_path / "policy.pdf", "Employees accrue twenty vacation days per year.")
+    expenses = write_pdf(tmp_path / "expenses.pdf", "Expense reports are due within thirty days.")
+    first = run(store, [policy, expenses])
+    assert (first["files_updated"], first["chunks_embedded"]) == (2, 2)
+    expenses_ids = config.load_manifest()["files"]["expenses.pdf"]["chunk_ids"]
+
+    # Unchanged files are skipped without being read
+    model = WordHashModel()
+    again = run(store, [policy, expenses], model=model)
+    assert (again["files_unchanged"], again["files_updated"], again["chunks_embedded"]) == (2, 0, 0)
+    assert model.encoded == []
+
+    # Rewritten with the same bytes: the hash matches, nothing is re-chunked
+    (tmp_path / "policy.pdf").write_bytes((tmp_path / "policy.pdf").read_bytes())
+    model = WordHashModel()
+    touched = run(store, [policy, expenses], model=model)
+    assert (touched["files_unchanged"], touched["files_updated"], touched["chunks_embedded"]) == (2, 0, 0)
+    assert model.encoded == []
+
+    # Same text in a new PDF: the file is re-chunked but its chunk ids are unchanged
+    write_pdf(tmp_path / "policy.pdf", "Employees accrue twenty vacation days per year.")
+    model = WordHashModel()
+    resaved = run(store, [policy, expenses], model=model)
+    assert (resaved["files_updated"], resaved["chunks_embedded"], resaved["chunks_deleted"]) == (1, 0, 0)
+    assert model.encoded == []
+
+    # Changed, added and removed files
+    write_pdf(tmp_path / "policy.pdf", "Employees accrue twenty-five vacation days per year.")
+    security = write_pdf(tmp_path / "security.pdf", "Badges must be worn inside the office at all times.")
+    (tmp_path / "expenses.pdf").unlink()
+    model = WordHashModel()
+    stats = run(store, [policy, security], model=model)
+
+    assert stats["files_updated"] == 2
+    assert stats["files_removed"] == 1
+    assert stats["chunks_embedded"] == 2
+    assert stats["chunks_deleted"] == 2
+    assert len(model.encoded) == 2
+    assert sources(collection) == ["policy.pdf", "security.pdf"]
+    assert not set(expenses_ids) & set(collection.get(include=[])["ids"])
+    assert "twenty-five" in collection.get(where={"source": "policy.pdf"})["documents"][0]
+    assert collection.count() == len(lexical_index) == 2
+    assert sorted(config.load_manifest()["files"]) == ["policy.pdf", "security.pdf"]
@@ -0,0 +1,157 @@
+import sys
+import subprocess
+from pathlib import Path
+
+import numpy as np
+
+from backend.filters import AllowedChunks
+from backend.lexical import BM25Index, tokenize
+from backend.rag import RAGSystem, RRF_K
+
+DOCS = {
+    "hr-1": "Employees accrue twenty vacation days per year under policy HR-101.",
+    "hr-2": "Vacation requests need manager approval two weeks ahead.",
+    "fin-1": "Expense reports are due within thirty days of purchase.",
+    "fin-2": "Travel expenses above the limit need finance approval.",
+    "it-1": "Laptops are replaced every three years by the IT department.",
+    "it-2": "Passwords expire every ninety days and must not be reused.",
+    "sec-1": "Badges must be worn inside the office at all times.",
+    "sec-2": "Visitors sign in at reception and are escorted at all times.",
+}
+
+
+def build(tmp_path, name, docs):
+    index = BM25Index(path=str(tmp_path / name))
+    index.add(list(docs), list(docs.values()))
+    return index
+
+
+def test_tokenize_indexes_identifiers_whole_and_by_parts():
+    assert tokenize("See policy HR-101 for the details") == ["see", "policy", "hr-101", "hr", "101", "details"]
+
+
+def test_search_ranks_by_bm25_within_allowed(tmp_path):
+    index = build(tmp_path, "index", DOCS)
+
+    assert [chunk_id for chunk_id, _ in index.search("vacation days", 2)] == ["hr-1", "hr-2"]
+    assert index.search("hr 101", 1)[0][0] == "hr-1"
+    allowed = AllowedChunks([(np.array(["hr-2", "fin-1"], dtype=object), np.array([True, True]))])
+    assert [chunk_id for chunk_id, _ in index.search("vacation days", 5, allowed)] == ["hr-2", "fin-1"]
+    assert index.search("vacation", 5, AllowedChunks([])) == []
+
+
+def test_segments_merge_to_the_same_scores_as_a_fresh_build(tmp_path):
+    index = BM25Index(path=str(tmp_path / "index"))
+    ids = list(DOCS)
+    # Sealed into the base, then a delta, with deletions in both
+    index.add(ids[:5], [DOCS[chunk_id] for chunk_id in ids[:5]])
+    index.save()
+    index.add(ids[5:], [DOCS[chunk_id] for chunk_id in ids[5:]])
+    index.delete(["fin-2", "sec-2"])
+    index.save()
+    index.add(["hr-2"], ["Vacation requests need manager approval one week ahead."])
+    index.save()
+
+    live = {chunk_id: text for chunk_id, text in DOCS.items() if chunk_id not in ("fin-2", "sec-2")}
+    live["hr-2"] = "Vacation requests need manager approval one week ahead."
+    fresh = build(tmp_path, "fresh", live)
+    reloaded = BM25Index.load(str(tmp_path / "index"))
+
+    assert len(index) == len(reloaded) == len(fresh) == 6
+    for query in ("vacation approval", "expenses", "every days", "times"):
+        expected = fresh.search(query, 10)
+        for candidate in (index, reloaded):
+            found = candidate.search(query, 10)
+            assert [chunk_id for chunk_id, _ in found] == [chunk_id for chunk_id, _ in expected], query
+            np.testing.assert_allclose([score for _, score in found], [score for _, score in expected], rtol=1e-5)
+
+
+def test_compaction_folds_delta_and_deletions_into_the_base(tmp_path):
+    index = build(tmp_path, "index", DOCS)
+    index.save()
+    for i in range(20):
+        index.add([f"new-{i}"], [f"Quarterly report number {i} for the finance team."])
+        index.delete([f"new-{i - 1}"])
+        index.save()
+        assert len(list((tmp_path / "index").glob("*.npz"))) <= 3
+
+    assert index.delta is None or len(index.delta.doc_ids) <= 0.1 * len(index.base.doc_ids) + 1
+    assert len(index.base.doc_ids) - int(index.base.alive.sum()) <= 0.1 * int(index.base.alive.sum()) + 1
+    assert [chunk_id for chunk_id, _ in BM25Index.load(str(tmp_path / "index")).search("quarterly", 5)] == ["new-19"]
+
+
+TESTS_DIR = Path(__file__).parent
+
+# Run in separate processes: each adds its own chunks over many small saves
+WRITER = """
+import sys
+sys.path.insert(0, {root!r})
+from backend.lexical import BM25Index
+index = BM25Index.load({path!r})
+for i in range(30):
+    index.add(["{name}-" + str(i)], ["{name} quarterly report number " + str(i)])
+    index.save()
+"""
+
+
+def test_concurrent_saves_keep_every_writers_chunks(tmp_path):
+    path = str(tmp_path / "index")
+    stale = build(tmp_path, "index", DOCS)
+    stale.save()
+    stale.delete(["sec-2"])
+
+    writers = [
+        subprocess.Popen([sys.executable, "-c", WRITER.format(root=str(TESTS_DIR.parent), path=path, name=name)])
+        for name in ("alpha", "beta")
+    ]
+    assert [writer.wait() for writer in writers] == [0, 0]
+    # Loaded before the writers ran: saving rebases its deletion on their index
+    stale.save()
+
+    index = BM25Index.load(path)
+    assert len(stale) == len(index) == len(DOCS) - 1 + 60
+    assert "sec-2" not in index.locations
+    assert {chunk_id for chunk_id, _ in index.search("beta quarterly", 100)} >= {f"beta-{i}" for i in range(30)}
+    # One base and at most one delta, however many saves
+    assert len(list((tmp_path / "index").glob("*.npz"))) <= 3
+
+
+class Collection:
+    """Chunk texts for hits that only BM25 found"""
+
+    def get(self, ids, include):
+        return {"ids": ids, "documents": [DOCS[chunk_id] for chunk_id in ids],
+                "metadatas": [{"source": chunk_id} for chunk_id in ids]}
+
+
+def test_hybrid_fusion_ranks_by_reciprocal_rank(tmp_path):
+    rag = RAGSystem()
+    rag.lexical_index = build(tmp_path, "index", DOCS)
+    rag.collection = Collection()
+    dense_ids = ["hr-2", "it-1", "sec-1"]
+    dense = {
+        "ids": [dense_ids],
+        "documents": [[DOCS[chunk_id] for chunk_id in dense_ids]],
+        "metadatas": [[{"source": chunk_id} for chunk_id in dense_ids]],
+        "distances": [[0.1, 0.2, 0.3]]
+    }
+    lexical_ids = [chunk_id for chunk_id, _ in rag.lexical_index.search("vacation days", 20)]
+    assert lexical_ids[:2] == ["hr-1", "hr-2"]
+
+    scores = {}
+    for ranking in (dense_ids, lexical_ids):
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    expected = sorted(scores, key=scores.get, reverse=True)[:3]
+
+    fused = rag._fuse("vacation days", dense, 3, "hybrid")
+    # Found by both rankers, then the top hit of each
+    assert fused["ids"][0] == expected == ["hr-2", "hr-1", "it-1"]
+    assert fused["documents"][0] == [DOCS[chunk_id] for chunk_id in expected]
+    # Lexical-only hits have no dense distance
+    assert [distance is None for distance in fused["distances"][0]] == [
+        chunk_id not in dense_ids for chunk_id in expected
+    ]
+
+    lexical = rag._fuse("vacation days", None, 2, "lexical")
+    assert lexical["ids"][0] == ["hr-1", "hr-2"]
@@ -0,0 +1,79 @@
+import chromadb
+import numpy as np
+import pytest
+
+import backend.quantized as quantized
+from backend.quantized import QuantizedStoreRefresher, QuantizedVectorStore, quantize
+
+
+def make_collection(tmp_path, space, count=200, dim=32):
+    rng = np.random.default_rng(11)
+    vectors = rng.standard_normal((count, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    collection = chromadb.PersistentClient(path=str(tmp_path / "chroma")).get_or_create_collection(
+        f"documind-{space}", metadata={"hnsw:space": space}
+    )
+    collection.add(
+        ids=[f"chunk-{i}" for i in range(count)], embeddings=vectors.tolist(),
+        documents=[f"text {i}" for i in range(count)]
+    )
+    return collection, vectors
+
+
+def test_int8_codes_stay_within_half_a_step():
+    vectors = np.random.default_rng(3).standard_normal((50, 16)).astype(np.float32)
+    vectors[0] = 0.0
+    codes, scales = quantize(vectors, "int8")
+
+    assert codes.dtype == np.int8 and np.abs(codes).max() == 127
+    assert np.all(np.abs(codes * scales[:, None] - vectors) <= scales[:, None] / 2 + 1e-6)
+    codes, scales = quantize(vectors, "float16")
+    assert codes.dtype == np.float16 and np.all(scales == 1.0)
+
+
+@pytest.mark.parametrize("space", ["cosine", "l2", "ip"])
+@pytest.mark.parametrize("dtype", ["int8", "float16"])
+def test_rescored_results_match_chroma(tmp_path, space, dtype):
+    collection, vectors = make_collection(tmp_path, space)
+    store = QuantizedVectorStore.build_from_collection(collection, str(tmp_path / "quantized"), dtype)
+    store.rescore = True
+    queries = vectors[:10] + 0.1
+
+    ids, distances = store.search(queries, 5)
+    expected = collection.query(query_embeddings=queries.tolist(), n_results=5, include=["distances"])
+
+    assert ids == expected["ids"]
+    np.testing.assert_allclose(distances, expected["distances"], atol=1e-4)
+
+
+def test_blocked_search_and_reload_give_the_same_results(tmp_path, monkeypatch):
+    collection, vectors = make_collection(tmp_path, "cosine")
+    path = str(tmp_path / "quantized")
+    store = QuantizedVectorStore.build_from_collection(collection, path, "int8")
+    queries = vectors[[3, 99]]
+    expected = store.search(queries, 8)
+
+    monkeypatch.setattr(quantized, "SEARCH_BLOCK_ROWS", 7)
+    assert store.search(queries, 8) == expected
+    assert QuantizedVectorStore.load(path).search(queries, 8) == expected
+    # int8 codes are a quarter of the float32 embeddings
+    assert store.codes.nbytes * 4 == store.full.nbytes
+
+
+def test_refresher_rebuilds_in_background_when_stale(tmp_path):
+    collection, vectors = make_collection(tmp_path, "cosine")
+    version = [1]
+    refresher = QuantizedStoreRefresher(lambda: version[0], str(tmp_path / "quantized"), "int8")
+    first = refresher.open(collection)
+    assert (len(first), first.version) == (200, 1)
+    assert refresher.current(collection) is first
+
+    collection.delete(ids=[f"chunk-{i}" for i in range(50)])
+    version[0] = 2
+    # Keeps serving the old store until the rebuild is done
+    assert refresher.current(collection) is first
+    refresher._rebuilding.join()
+    assert (len(refresher.store), refresher.store.version) == (150, 2)
+    assert not {f"chunk-{i}" for i in range(50)} & set(refresher.store.search(vectors[:1], 150)[0][0])
+    # The first generation's files are removed
+    assert not [p.name for p in (tmp_path / "quantized").iterdir() if p.name.startswith("1.")]
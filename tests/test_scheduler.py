@@ -0,0 +1,128 @@
+import time
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.app import app
+from backend.metrics import GENERATIONS_SHARED
+from backend.rag import rag_system
+from backend.scheduler import DeadlineExceeded, GenerationScheduler, QueryQueueFull
+
+
+async def settle():
+    """Let every ready task run until it blocks"""
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def blocking(started, name, gate):
+    """generate() that records its start, then waits for gate"""
+    async def generate(timings):
+        started.append(name)
+        await gate.wait()
+        return name
+    return generate
+
+
+def test_higher_priority_admitted_first():
+    async def scenario():
+        scheduler = GenerationScheduler(1, 10)
+        started, gate = [], asyncio.Event()
+        tasks = [asyncio.ensure_future(scheduler.run("busy", blocking(started, "busy", gate)))]
+        await settle()
+        soon = time.monotonic() + 30
+        for name, priority, deadline in [
+            ("batch-1", "batch", None), ("batch-2", "batch", soon), ("interactive", "interactive", None),
+            ("interactive-soon", "interactive", soon)
+        ]:
+            tasks.append(asyncio.ensure_future(scheduler.run(name, blocking(started, name, gate), priority, deadline)))
+            await settle()
+        assert started == ["busy"]
+        assert scheduler.usage() == (1, 4)
+
+        gate.set()
+        await asyncio.gather(*tasks)
+        return started, scheduler.usage()
+
+    started, usage = asyncio.run(scenario())
+    assert started == ["busy", "interactive-soon", "interactive", "batch-2", "batch-1"]
+    assert usage == (0, 0)
+
+
+def test_duplicate_requests_share_one_generation():
+    async def scenario():
+        scheduler = GenerationScheduler(2, 10)
+        started, gate = [], asyncio.Event()
+        generate = blocking(started, "answer", gate)
+        tasks = [asyncio.ensure_future(scheduler.run("same prompt", generate)) for _ in range(5)]
+        await settle()
+        gate.set()
+        return await asyncio.gather(*tasks), started, scheduler.usage()
+
+    shared = GENERATIONS_SHARED._values.get((), 0.0)
+    results, started, usage = asyncio.run(scenario())
+
+    assert results == ["answer"] * 5
+    assert started == ["answer"]
+    assert GENERATIONS_SHARED._values.get((), 0.0) == shared + 4
+    assert usage == (0, 0)
+
+
+def test_expired_deadline_releases_slot():
+    async def scenario():
+        scheduler = GenerationScheduler(1, 10)
+        started, gate = [], asyncio.Event()
+        # Times out while running: its generation is cancelled and the slot freed
+        with pytest.raises(DeadlineExceeded):
+            await scheduler.run("slow", blocking(started, "slow", gate), deadline=time.monotonic() + 0.05)
+        await settle()
+        assert scheduler.usage() == (0, 0)
+
+        # Times out while waiting behind another generation
+        busy = asyncio.ensure_future(scheduler.run("busy", blocking(started, "busy", gate)))
+        await settle()
+        with pytest.raises(DeadlineExceeded):
+            await scheduler.run("queued", blocking(started, "queued", gate), deadline=time.monotonic() + 0.05)
+        await settle()
+        assert scheduler.usage() == (1, 0)
+
+        gate.set()
+        await busy
+        after = await scheduler.run("next", blocking(started, "next", gate))
+        return started, after, scheduler.usage()
+
+    started, after, usage = asyncio.run(scenario())
+    assert started == ["slow", "busy", "next"]
+    assert after == "next"
+    assert usage == (0, 0)
+
+
+def test_full_queue_rejects_new_generations():
+    async def scenario():
+        scheduler = GenerationScheduler(1, 1)
+        started, gate = [], asyncio.Event()
+        tasks = [asyncio.ensure_future(scheduler.run(name, blocking(started, name, gate))) for name in ("a", "b")]
+        await settle()
+        with pytest.raises(QueryQueueFull):
+            await scheduler.run("c", blocking(started, "c", gate))
+        # Joining a generation that is already queued needs no new place in line
+        shared = asyncio.ensure_future(scheduler.run("b", blocking(started, "b", gate)))
+        await settle()
+        gate.set()
+        return await asyncio.gather(*tasks, shared), started
+
+    results, started = asyncio.run(scenario())
+    assert results == ["a", "b", "b"]
+    assert started == ["a", "b"]
+
+
+def test_full_queue_returns_429(monkeypatch):
+    async def aquery(question, filters=None, priority="interactive", deadline=None, extractive=None):
+        raise QueryQueueFull("64 queries already waiting")
+
+    monkeypatch.setattr(rag_system, "aquery", aquery)
+    response = TestClient(app).post("/query", json={"question": "anything"})
+
+    assert response.status_code == 429
+    assert "64 queries already waiting" in response.json()["detail"]
@@ -0,0 +1,96 @@
+import json
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from backend.app import app
+from backend.rag import RAGSystem, rag_system
+from backend.scheduler import GenerationScheduler
+
+RESULTS = {
+    "ids": [["policy.pdf:3:0"]],
+    "documents": [["Employees accrue twenty vacation days per year."]],
+    "metadatas": [[{"source": "policy.pdf", "page": 3}]],
+    "distances": [[0.25]]
+}
+
+
+class StreamingLLM:
+    async def astream(self, model, messages):
+        for token in ("Twenty ", "days."):
+            yield {"message": {"content": token}}
+        yield {"message": {"content": ""}, "done": True}
+
+
+class NoCache:
+    def put(self, *args):
+        pass
+
+
+def retrieved(rag, monkeypatch):
+    """rag answering every question from RESULTS with a fake LLM"""
+    async def warm_up():
+        pass
+
+    async def prepare(question, filters=None):
+        return {"entry": None, "embedding": [0.0], "results": RESULTS, "timings": {}, "scope": None}
+
+    monkeypatch.setattr(rag, "warm_up", warm_up)
+    monkeypatch.setattr(rag, "_prepare", prepare)
+    monkeypatch.setattr(rag, "collection", object())
+    monkeypatch.setattr(rag, "llm", StreamingLLM())
+    monkeypatch.setattr(rag, "cache", NoCache())
+    monkeypatch.setattr(rag, "scheduler", GenerationScheduler(1, 1))
+    return rag
+
+
+def events(response):
+    """(event, data) pairs of a Server-Sent Events body"""
+    pairs = []
+    for block in response.text.strip().split("\n\n"):
+        event, data = block.split("\n")
+        pairs.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return pairs
+
+
+def test_sources_are_sent_before_waiting_for_a_slot(monkeypatch):
+    rag = retrieved(RAGSystem(), monkeypatch)
+
+    async def scenario():
+        await rag.scheduler.acquire()
+        stream = rag.astream_query("How many vacation days?", extractive=False)
+        first = await asyncio.wait_for(stream.__anext__(), 1)
+        waiting = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        assert rag.slot_usage() == (1, 1)
+
+        rag.scheduler.release()
+        rest = [await waiting] + [event async for event in stream]
+        return first, rest, rag.slot_usage()
+
+    first, rest, usage = asyncio.run(scenario())
+    assert first == ("sources", [{"source": "policy.pdf", "page": 3, "distance": 0.25}])
+    assert [event for event, _ in rest] == ["token", "token", "done"]
+    assert rest[-1][1]["answer"] == "Twenty days."
+    assert usage == (0, 0)
+
+
+def test_stream_reports_full_queue_and_passed_deadline(monkeypatch):
+    rag = retrieved(rag_system, monkeypatch)
+    client = TestClient(app)
+    body = {"question": "How many vacation days?", "extractive": False}
+
+    # One generation running and no room to queue
+    monkeypatch.setattr(rag, "scheduler", GenerationScheduler(1, 0))
+    asyncio.run(rag.scheduler.acquire())
+    response = client.post("/query/stream", json=body)
+    assert response.status_code == 429
+
+    # Sources are already out when the deadline passes in the queue
+    monkeypatch.setattr(rag, "scheduler", GenerationScheduler(1, 1))
+    asyncio.run(rag.scheduler.acquire())
+    response = client.post("/query/stream", json=dict(body, timeout_ms=50))
+    assert response.status_code == 200
+    assert [event for event, _ in events(response)] == ["sources", "error"]
+    assert events(response)[1][1]["status"] == 504
@@ -0,0 +1,119 @@
+import json
+import asyncio
+import threading
+import hashlib
+
+import pytest
+
+import backend.app as api
+from backend.app import app
+
+BOUNDARY = "documind-test-boundary"
+
+
+def multipart_body(filename, content):
+    return (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        "Content-Type: application/pdf\r\n\r\n"
+    ).encode() + content + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+async def post_upload(body, chunk_bytes=4096, content_length=True):
+    """POST body to /upload in chunks; returns (status, json response, chunks the app read)"""
+    chunks = [body[i:i + chunk_bytes] for i in range(0, len(body), chunk_bytes)]
+    read = 0
+    sent = []
+
+    async def receive():
+        nonlocal read
+        read += 1
+        return {"type": "http.request", "body": chunks[read - 1], "more_body": read < len(chunks)}
+
+    async def send(message):
+        sent.append(message)
+
+    headers = [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())]
+    if content_length:
+        headers.append((b"content-length", str(len(body)).encode()))
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/upload", "raw_path": b"/upload", "query_string": b"", "root_path": "",
+        "headers": headers, "client": ("127.0.0.1", 12345), "server": ("testserver", 80)
+    }
+    await app(scope, receive, send)
+    status = next(message["status"] for message in sent if message["type"] == "http.response.start")
+    payload = b"".join(message.get("body", b"") for message in sent if message["type"] == "http.response.body")
+    return status, json.loads(payload), read
+
+
+@pytest.fixture
+def submitted(monkeypatch):
+    """Filenames queued for ingestion"""
+    filenames = []
+    monkeypatch.setattr(api.ingestion_queue, "submit", lambda filename: filenames.append(filename) or {"id": "job"})
+    return filenames
+
+
+@pytest.fixture
+def pdf_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(api, "PDF_DIR", str(tmp_path))
+    monkeypatch.setattr(api, "MAX_UPLOAD_MB", 0.5)
+    monkeypatch.setattr(api, "find_ingested", lambda sha256: None)
+    return tmp_path
+
+
+def test_upload_streams_file_to_disk(pdf_dir, submitted):
+    content = b"%PDF-1.4 " + bytes(range(256)) * 1000
+    status, response, _ = asyncio.run(post_upload(multipart_body("../report.pdf", content)))
+
+    assert status == 200
+    assert response["filename"] == "report.pdf"
+    assert response["sha256"] == hashlib.sha256(content).hexdigest()
+    assert (pdf_dir / "report.pdf").read_bytes() == content
+    assert submitted == ["report.pdf"]
+    assert [path.name for path in pdf_dir.iterdir()] == ["report.pdf"]
+
+
+@pytest.mark.parametrize("content_length", [True, False])
+def test_oversized_upload_rejected_while_arriving(pdf_dir, content_length):
+    body = multipart_body("big.pdf", b"x" * (4 << 20))
+    status, _, read = asyncio.run(post_upload(body, content_length=content_length))
+
+    assert status == 413
+    # Declared sizes are rejected before the body is read, others just past the limit
+    if content_length:
+        assert read == 0
+    else:
+        assert (1 << 19) // 4096 <= read <= (1 << 19) // 4096 + 2
+    assert list(pdf_dir.iterdir()) == []
+
+
+def test_non_pdf_upload_rejected(pdf_dir):
+    status, response, _ = asyncio.run(post_upload(multipart_body("notes.txt", b"hello")))
+
+    assert status == 400
+    assert response["detail"] == "Only PDF files are supported"
+    assert list(pdf_dir.iterdir()) == []
+
+
+def test_file_operations_run_off_the_event_loop(pdf_dir, submitted, monkeypatch):
+    threads = []
+
+    def recorded(name, func):
+        def wrapper(*args, **kwargs):
+            threads.append((name, threading.current_thread() is threading.main_thread()))
+            return func(*args, **kwargs)
+        return wrapper
+
+    monkeypatch.setattr(api, "open", recorded("open", open), raising=False)
+    monkeypatch.setattr(api, "write_block", recorded("write", api.write_block))
+    monkeypatch.setattr(api, "discard_part", recorded("discard", api.discard_part))
+    monkeypatch.setattr(api.os, "replace", recorded("replace", api.os.replace))
+
+    assert asyncio.run(post_upload(multipart_body("report.pdf", b"%PDF-1.4 report")))[0] == 200
+    assert asyncio.run(post_upload(multipart_body("big.pdf", b"x" * (4 << 20)), content_length=False))[0] == 413
+
+    assert {name for name, _ in threads} == {"open", "write", "replace", "discard"}
+    assert not any(on_main_thread for _, on_main_thread in threads)
+    assert [path.name for path in pdf_dir.iterdir()] == ["report.pdf"]
@@ -0,0 +1,93 @@
+import chromadb
+import numpy as np
+import pytest
+
+from backend.filters import AllowedChunks
+from backend.quantized import QuantizedVectorStore
+from backend.vectorstores import ChromaVectorStore, HNSWVectorStore, compare_backends, hnswlib
+
+K = 5
+
+
+@pytest.fixture
+def collection(tmp_path):
+    """300 random unit vectors over three sources, ten pages each"""
+    rng = np.random.default_rng(7)
+    vectors = rng.standard_normal((300, 32)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    collection = chromadb.PersistentClient(path=str(tmp_path / "chroma")).get_or_create_collection(
+        "documind", metadata={"hnsw:space": "cosine"}
+    )
+    collection.add(
+        ids=[f"chunk-{i}" for i in range(300)],
+        embeddings=vectors.tolist(),
+        documents=[f"text {i}" for i in range(300)],
+        metadatas=[{"source": f"doc{i % 3}.pdf", "page": i // 3 % 10 + 1} for i in range(300)]
+    )
+    return collection, vectors
+
+
+def exact_top_k(vectors, query, candidates, k=K):
+    """Ids of the k candidate rows nearest to query by cosine distance"""
+    order = sorted(candidates, key=lambda i: -float(vectors[i] @ query))
+    return [f"chunk-{i}" for i in order[:k]]
+
+
+def allowed_pages(page_to):
+    """AllowedChunks for doc1.pdf pages 1..page_to, built like SourceIndex does"""
+    rows = np.arange(1, 300, 3)
+    ids = np.array([f"chunk-{i}" for i in rows], dtype=object)
+    mask = rows // 3 % 10 + 1 <= page_to
+    return AllowedChunks([(ids, mask)]), rows[mask].tolist()
+
+
+def backends(collection, tmp_path):
+    stores = {"chroma": ChromaVectorStore(collection)}
+    if hnswlib is not None:
+        stores["hnsw"] = HNSWVectorStore(collection, str(tmp_path / "hnsw"))
+    quantized = QuantizedVectorStore.build_from_collection(collection, str(tmp_path / "quantized"), "int8")
+    quantized.rescore = True
+    stores["quantized"] = quantized
+    return stores
+
+
+@pytest.mark.parametrize("page_to", [None, 3, 1])
+def test_backends_agree_on_top_k(collection, tmp_path, page_to):
+    collection, vectors = collection
+    if page_to is None:
+        allowed, candidates = None, range(len(vectors))
+    else:
+        allowed, candidates = allowed_pages(page_to)
+    queries = vectors[[0, 50, 101]] + 0.05
+
+    for name, store in backends(collection, tmp_path).items():
+        ids, distances = store.search(queries, K, allowed)
+        for query, found, row in zip(queries, ids, distances):
+            assert found == exact_top_k(vectors, query, candidates), name
+            assert row == sorted(row), name
+
+
+def test_empty_filter_returns_nothing(collection, tmp_path):
+    collection, vectors = collection
+    allowed = AllowedChunks([(np.array(["chunk-1"], dtype=object), np.array([False]))])
+
+    for name, store in backends(collection, tmp_path).items():
+        assert store.search(vectors[:2], K, allowed)[0] == [[], []], name
+
+
+def test_compare_backends_reports_recall(collection):
+    collection, vectors = collection
+    rows = compare_backends(collection, vectors[:20], k=K, m_values=(16,), ef_values=(64,), dtypes=("float16",))
+
+    backends_seen = {row["backend"] for row in rows}
+    assert backends_seen == ({"chroma", "quantized", "hnsw"} if hnswlib is not None else {"chroma", "quantized"})
+    assert all(row["recall"] >= 0.9 for row in rows)
+
+
+def test_compare_backends_skips_hnsw_without_hnswlib(collection, monkeypatch, capsys):
+    collection, vectors = collection
+    monkeypatch.setattr("backend.vectorstores.hnswlib", None)
+    rows = compare_backends(collection, vectors[:5], k=K, dtypes=("float16",))
+
+    assert {row["backend"] for row in rows} == {"chroma", "quantized"}
+    assert "skipping the hnsw rows" in capsys.readouterr().out